@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Script to backfill missing countries of cities from their coordinates.
+
+The extractor leaves countryWikidataId empty when a city has no usable country (P17)
+claim. This script locates all cities with coordinates in the country borders used by the
+frontend maps (frontend/src/components/countryBorders.json) and:
+- fills in the country of cities without one
+- flags cities whose P17 country disagrees with their coordinates
+
+Borders are split into edges and indexed by latitude band, and all points of a band are
+tested against the edges of that band at once with numpy (even-odd rule). The borders are
+simplified (1:110m), so points near a coast or border are matched to the nearest country
+within MAX_DISTANCE_KM, and a P17 country within MAX_DISTANCE_KM of the city is not flagged.
+
+Run from the project root:
+    python scripts/backfill_countries.py
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Height of the latitude bands of the edge index in degrees
+BAND_DEGREES = 0.5
+# Cities outside all borders, and P17 countries, are accepted up to this distance from a border
+MAX_DISTANCE_KM = 25
+# Maximum number of point-edge pairs tested at once (bounds memory)
+MAX_PAIRS = 4_000_000
+KM_PER_DEGREE = 111.195
+
+# Border shapes without an entry in countries.ts, mapped to the country Wikidata uses as P17 there
+BORDER_COUNTRIES = {
+    'Kosovo': 'Q1246',
+    'N. Cyprus': 'Q229',
+    'Somaliland': 'Q1045',
+    'Puerto Rico': 'Q30',
+    'New Caledonia': 'Q142',
+    'Fr. S. Antarctic Lands': 'Q142',
+    'Falkland Is.': 'Q145'
+}
+
+def load_country_ids(countries_file):
+    """Map ISO 3166-1 numeric codes and country names to QIDs using countries.ts."""
+    with open(countries_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    data = json.loads(content[content.index('{'):content.rindex('}') + 1])
+    lookup = {}
+    for name, alpha2, alpha3, numeric, wikidata_id, *rest in data['countries']:
+        if wikidata_id:
+            lookup[numeric] = wikidata_id
+            lookup[name] = wikidata_id
+    return lookup
+
+def decode_topojson(topology, object_name='countries'):
+    """Yield (id, name, rings) of the polygons of a TopoJSON object. Rings are (n, 2) lon/lat arrays."""
+    arcs = []
+    transform = topology.get('transform')
+    for arc in topology['arcs']:
+        points = np.array(arc, dtype=np.float64)
+        if transform:
+            # Quantized arcs are delta-encoded
+            points = np.cumsum(points, axis=0) * transform['scale'] + transform['translate']
+        arcs.append(points)
+
+    def ring(arc_indices):
+        parts = [arcs[i] if i >= 0 else arcs[~i][::-1] for i in arc_indices]
+        return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
+
+    for geometry in topology['objects'][object_name]['geometries']:
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['arcs']]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = geometry['arcs']
+        else:
+            continue
+        yield geometry.get('id'), geometry.get('properties', {}).get('name'), [ring(r) for polygon in polygons for r in polygon]
+
+class CountryBorders:
+    """Country borders as edges indexed by latitude band.
+
+    Each edge is stored in every band it spans, grouped by band and by country within a band,
+    so a point is only tested against the edges of its band.
+    """
+
+    def __init__(self, country_ids, x1, y1, x2, y2, edge_country):
+        self.country_ids = country_ids
+        self.band_count = int(round(180 / BAND_DEGREES))
+        first_band = self._band(np.minimum(y1, y2))
+        last_band = self._band(np.maximum(y1, y2))
+        spans = last_band - first_band + 1
+        edges = np.repeat(np.arange(len(x1)), spans)
+        bands = np.repeat(first_band, spans) + np.arange(len(edges)) - np.repeat(np.cumsum(spans) - spans, spans)
+
+        order = np.lexsort((edge_country[edges], bands))
+        edges, bands = edges[order], bands[order]
+        self.x1, self.y1, self.x2, self.y2 = x1[edges], y1[edges], x2[edges], y2[edges]
+        self.edge_country = edge_country[edges]
+        self.offsets = np.zeros(self.band_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(bands, minlength=self.band_count), out=self.offsets[1:])
+
+    @classmethod
+    def from_topojson(cls, borders_file, countries_file):
+        with open(borders_file, 'r', encoding='utf-8') as f:
+            topology = json.load(f)
+        lookup = load_country_ids(countries_file)
+
+        # Shapes of the same country (e.g. France and its territories) are merged. Shapes without
+        # a QID (e.g. Antarctica) still count, so points in them are not matched elsewhere
+        country_index, segments = {}, []
+        for shape_id, name, rings in decode_topojson(topology):
+            country_id = lookup.get(shape_id) or BORDER_COUNTRIES.get(name) or lookup.get(name) or ''
+            index = country_index.setdefault(country_id, len(country_index))
+            for ring in rings:
+                if not np.array_equal(ring[0], ring[-1]):
+                    ring = np.vstack((ring, ring[:1]))
+                segments.append((ring[:-1], ring[1:], index))
+
+        starts = np.concatenate([start for start, _, _ in segments])
+        ends = np.concatenate([end for _, end, _ in segments])
+        edge_country = np.concatenate([np.full(len(start), index) for start, _, index in segments])
+        return cls(np.array(list(country_index)), starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1], edge_country)
+
+    def _band(self, latitude):
+        return np.clip(((latitude + 90) // BAND_DEGREES).astype(np.int64), 0, self.band_count - 1)
+
+    def _band_groups(self, latitude):
+        """Yield (point indices, band) for each band containing points."""
+        bands = self._band(latitude)
+        order = np.argsort(bands, kind='stable')
+        boundaries = np.flatnonzero(np.diff(bands[order])) + 1
+        for group in np.split(order, boundaries):
+            if len(group):
+                yield group, bands[group[0]]
+
+    def locate(self, latitude, longitude):
+        """Return the index into country_ids of the country containing each point, or -1."""
+        result = np.full(len(latitude), -1, dtype=np.int64)
+        for points, band in self._band_groups(latitude):
+            start, end = self.offsets[band], self.offsets[band + 1]
+            if start == end:
+                continue
+            x1, y1, x2, y2 = self.x1[start:end], self.y1[start:end], self.x2[start:end], self.y2[start:end]
+            countries = self.edge_country[start:end]
+            group_starts = np.flatnonzero(np.concatenate(([True], countries[1:] != countries[:-1])))
+
+            chunk_size = max(1, MAX_PAIRS // (end - start))
+            for chunk_start in range(0, len(points), chunk_size):
+                chunk = points[chunk_start:chunk_start + chunk_size]
+                px, py = longitude[chunk, None], latitude[chunk, None]
+                # Even-odd rule: count the edges crossed by a ray from the point to the east
+                crosses = (y1 > py) != (y2 > py)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    crosses &= px < x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+                inside = np.logical_xor.reduceat(crosses, group_starts, axis=1)
+                found = inside.any(axis=1)
+                result[chunk[found]] = countries[group_starts[inside[found].argmax(axis=1)]]
+        return result
+
+    def nearest(self, latitude, longitude, only_country=None):
+        """Return (country index, distance in km) of the border edge nearest to each point.
+
+        Only edges within MAX_DISTANCE_KM are considered (otherwise -1 and inf). With
+        only_country, the distance to the borders of the given country per point is returned.
+        """
+        result = np.full(len(latitude), -1, dtype=np.int64)
+        distances = np.full(len(latitude), np.inf)
+        band_margin = int(np.ceil(MAX_DISTANCE_KM / KM_PER_DEGREE / BAND_DEGREES))
+        for points, band in self._band_groups(latitude):
+            start = self.offsets[max(band - band_margin, 0)]
+            end = self.offsets[min(band + band_margin + 1, self.band_count)]
+            if start == end:
+                continue
+            x1, y1 = self.x1[start:end], self.y1[start:end]
+            countries = self.edge_country[start:end]
+            # Equirectangular projection around the band
+            scale = np.cos(np.radians((band + 0.5) * BAND_DEGREES - 90)) * KM_PER_DEGREE
+            dx, dy = (self.x2[start:end] - x1) * scale, (self.y2[start:end] - y1) * KM_PER_DEGREE
+            length = np.maximum(dx * dx + dy * dy, 1e-12)
+
+            chunk_size = max(1, MAX_PAIRS // (end - start))
+            for chunk_start in range(0, len(points), chunk_size):
+                chunk = points[chunk_start:chunk_start + chunk_size]
+                px = (longitude[chunk, None] - x1) * scale
+                py = (latitude[chunk, None] - y1) * KM_PER_DEGREE
+                t = np.clip((px * dx + py * dy) / length, 0, 1)
+                squared = (px - t * dx) ** 2 + (py - t * dy) ** 2
+                if only_country is not None:
+                    squared[countries != only_country[chunk, None]] = np.inf
+                nearest_edge = squared.argmin(axis=1)
+                distance = np.sqrt(squared[np.arange(len(chunk)), nearest_edge])
+                within = distance <= MAX_DISTANCE_KM
+                result[chunk[within]] = countries[nearest_edge[within]]
+                distances[chunk[within]] = distance[within]
+        return result, distances
+
+def backfill(df, borders):
+    """Locate the cities of the table. Returns the report frame of backfilled and mismatched cities."""
+    latitude = pd.to_numeric(df['latitude'], errors='coerce').to_numpy()
+    longitude = pd.to_numeric(df['longitude'], errors='coerce').to_numpy()
+    with_coordinates = np.flatnonzero(~np.isnan(latitude) & ~np.isnan(longitude))
+    latitude, longitude = latitude[with_coordinates], longitude[with_coordinates]
+
+    located = borders.locate(latitude, longitude)
+    outside = np.flatnonzero(located < 0)
+    located[outside] = borders.nearest(latitude[outside], longitude[outside])[0]
+    located_ids = np.where(located >= 0, borders.country_ids[np.maximum(located, 0)], '')
+
+    claimed = df['countryWikidataId'].to_numpy()[with_coordinates]
+    missing = (claimed == '') & (located_ids != '')
+
+    # A claimed country is only contradicted if it has borders and the city is not near them
+    country_index = {country_id: i for i, country_id in enumerate(borders.country_ids) if country_id}
+    claimed_index = pd.Series(claimed).map(country_index).fillna(-1).to_numpy(dtype=np.int64)
+    candidates = np.flatnonzero((claimed_index >= 0) & (located_ids != '') & (claimed != located_ids))
+    _, distance = borders.nearest(latitude[candidates], longitude[candidates], only_country=claimed_index[candidates])
+    mismatch = np.zeros(len(claimed), dtype=bool)
+    mismatch[candidates[np.isinf(distance)]] = True
+
+    report_rows = with_coordinates[missing | mismatch]
+    report = df.loc[report_rows, ['cityWikidataId', 'cityLabelEnglish', 'countryWikidataId', 'latitude', 'longitude']].copy()
+    report['locatedCountryWikidataId'] = located_ids[missing | mismatch]
+    report['status'] = np.where(missing[missing | mismatch], 'backfilled', 'mismatch')
+
+    df.loc[with_coordinates[missing], 'countryWikidataId'] = located_ids[missing]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill missing countries of cities from their coordinates.')
+    parser.add_argument('--input', default='serverless/autocomplete/src/city-data.csv', help='Input CSV file path')
+    parser.add_argument('--output', default=None, help='Output CSV file path (default: overwrite the input)')
+    parser.add_argument('--borders', default='frontend/src/components/countryBorders.json',
+                        help='TopoJSON file of the country borders')
+    parser.add_argument('--countries', default='serverless/autocomplete/src/countries.ts',
+                        help='countries.ts with the ISO codes and QIDs of the countries')
+    parser.add_argument('--report', default='scripts/data/country-backfill.csv',
+                        help='CSV file listing the backfilled and mismatched cities')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    borders = CountryBorders.from_topojson(args.borders, args.countries)
+    # Read all values as strings, so the rest of the table is written back unchanged
+    df = pd.read_csv(args.input, dtype=str, keep_default_na=False)
+    print(f"Loaded {len(df):,} cities and {len(borders.country_ids)} country shapes")
+
+    report = backfill(df, borders)
+    backfilled = int((report['status'] == 'backfilled').sum())
+    print(f"Backfilled the country of {backfilled:,} cities")
+    print(f"Found {len(report) - backfilled:,} cities whose country (P17) disagrees with their coordinates")
+
+    output = args.output or args.input
+    df.to_csv(output, index=False)
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(f"Saved {output} and the report to {args.report} in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
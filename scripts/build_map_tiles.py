@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Script to build pre-aggregated map tiles from the deduplicated city table.
+
+Cities are assigned to slippy map tiles (Web Mercator, z/x/y as used by OpenStreetMap)
+for every zoom level. Each non-empty tile is written as a small JSON file with:
+- points: the most populous cities of the tile, at most POINTS_PER_TILE
+- clusters: the remaining cities, counted per cell of a CLUSTER_GRID x CLUSTER_GRID grid
+- countries: number of cities and total population per country in the tile
+
+A map view only fetches the tiles of its viewport at its zoom level, so the payload is
+bounded regardless of the number of cities. For zoom levels above the maximum, the
+maximum zoom tiles are used. countries.json has the same aggregates for the whole world.
+
+The frontend maps (frontend/src/components/CityMap.tsx and WorldMap.tsx) don't load the
+tiles yet; switching them over is deferred to a separate change.
+
+Run from the project root:
+    python scripts/build_map_tiles.py --max-zoom 9
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+# Maximum number of cities shown as points per tile
+POINTS_PER_TILE = 100
+# Cities that are not shown as points are counted per cell of a grid of this size per tile
+CLUSTER_GRID = 8
+# Latitude limit of the Web Mercator projection
+MAX_LATITUDE = 85.05112878
+
+def tile_coordinates(lat, lon, zoom):
+    """Return the (x, y) slippy tile coordinates of points at a zoom level, as float arrays."""
+    n = 2 ** zoom
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * n
+    return np.clip(x, 0, n - 1e-9), np.clip(y, 0, n - 1e-9)
+
+def group_starts(sorted_keys):
+    """Return the start index of each run of equal keys, plus the end."""
+    boundaries = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    return np.concatenate(([0], boundaries, [len(sorted_keys)]))
+
+def load_cities(city_data_file):
+    df = pd.read_csv(city_data_file, usecols=lambda column: column in {
+        'cityWikidataId', 'cityLabelEnglish', 'countryWikidataId', 'population',
+        'latitude', 'longitude', 'superseded_by'
+    })
+    if 'superseded_by' in df.columns:
+        df = df[df['superseded_by'].isna()]
+    df = df.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+    df['population'] = pd.to_numeric(df['population'], errors='coerce').fillna(-1).astype(np.int64)
+    df['countryWikidataId'] = df['countryWikidataId'].fillna('')
+    return df
+
+def build_zoom(df, zoom, country_codes, country_ids):
+    """Return {(x, y): tile} for all non-empty tiles of a zoom level."""
+    # The country keys below are built modulo len(country_ids), which is 0 for an empty table
+    if df.empty or not country_ids:
+        return {}
+    lat = df['latitude'].to_numpy()
+    lon = df['longitude'].to_numpy()
+    population = df['population'].to_numpy()
+    x, y = tile_coordinates(lat, lon, zoom)
+    tile_x, tile_y = x.astype(np.int64), y.astype(np.int64)
+    tile_key = tile_x * (2 ** zoom) + tile_y
+
+    # Cities sorted by tile, most populous first
+    order = np.lexsort((-population, tile_key))
+    sorted_keys = tile_key[order]
+    starts = group_starts(sorted_keys)
+    rank = np.arange(len(order)) - np.repeat(starts[:-1], np.diff(starts))
+    shown = order[rank < POINTS_PER_TILE]
+    rest = order[rank >= POINTS_PER_TILE]
+
+    # Clusters: the remaining cities per grid cell
+    cell_x = ((x[rest] - tile_x[rest]) * CLUSTER_GRID).astype(np.int64)
+    cell_y = ((y[rest] - tile_y[rest]) * CLUSTER_GRID).astype(np.int64)
+    cell_key = (tile_key[rest] * CLUSTER_GRID + cell_x) * CLUSTER_GRID + cell_y
+    cells, cell_index, cell_count = np.unique(cell_key, return_inverse=True, return_counts=True)
+    cell_lat = np.bincount(cell_index, weights=lat[rest]) / cell_count
+    cell_lon = np.bincount(cell_index, weights=lon[rest]) / cell_count
+    cell_population = np.bincount(cell_index, weights=np.maximum(population[rest], 0))
+
+    # Country aggregates per tile
+    country_key = tile_key * len(country_ids) + country_codes
+    country_groups, country_index, country_count = np.unique(country_key, return_inverse=True, return_counts=True)
+    country_population = np.bincount(country_index, weights=np.maximum(population, 0))
+
+    qids = df['cityWikidataId'].to_numpy()
+    labels = df['cityLabelEnglish'].fillna('').to_numpy()
+    tiles = {}
+    def get_tile(key):
+        tile = tiles.get(key)
+        if tile is None:
+            tile = tiles[key] = {'total': 0, 'points': [], 'clusters': [], 'countries': {}}
+        return tile
+
+    for i in shown:
+        get_tile(int(tile_key[i]))['points'].append([
+            qids[i], labels[i], round(float(lat[i]), 4), round(float(lon[i]), 4), int(population[i]) if population[i] >= 0 else None
+        ])
+    for j, cell in enumerate(cells):
+        get_tile(int(cell // (CLUSTER_GRID * CLUSTER_GRID)))['clusters'].append([
+            round(float(cell_lat[j]), 4), round(float(cell_lon[j]), 4), int(cell_count[j]), int(cell_population[j])
+        ])
+    for j, group in enumerate(country_groups):
+        tile = get_tile(int(group // len(country_ids)))
+        country_id = country_ids[group % len(country_ids)]
+        tile['countries'][country_id or 'unknown'] = [int(country_count[j]), int(country_population[j])]
+        tile['total'] += int(country_count[j])
+
+    n = 2 ** zoom
+    return {(key // n, key % n): tile for key, tile in tiles.items()}
+
+def build_country_aggregates(df):
+    grouped = df.assign(population=df['population'].clip(lower=0)).groupby('countryWikidataId')
+    aggregates = grouped.agg(
+        cities=('cityWikidataId', 'size'),
+        population=('population', 'sum'),
+        latitude=('latitude', 'mean'),
+        longitude=('longitude', 'mean'),
+        min_latitude=('latitude', 'min'),
+        max_latitude=('latitude', 'max'),
+        min_longitude=('longitude', 'min'),
+        max_longitude=('longitude', 'max')
+    )
+    return {
+        country_id or 'unknown': {
+            'cities': int(row.cities),
+            'population': int(row.population),
+            'center': [round(row.latitude, 4), round(row.longitude, 4)],
+            'bounds': [row.min_latitude, row.min_longitude, row.max_latitude, row.max_longitude]
+        }
+        for country_id, row in aggregates.iterrows()
+    }
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Build pre-aggregated map tiles from the city table.')
+    parser.add_argument('--input', default='serverless/autocomplete/src/city-data-deduplicated.csv',
+                        help='Deduplicated city table CSV file path')
+    parser.add_argument('--output-dir', default='public-data/map-tiles', help='Output directory for the tiles')
+    parser.add_argument('--min-zoom', type=int, default=0, help='Lowest zoom level')
+    parser.add_argument('--max-zoom', type=int, default=9, help='Highest zoom level')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    df = load_cities(args.input)
+    print(f"Loaded {len(df):,} cities with coordinates")
+
+    # Remove tiles of a previous build, which may have used other zoom levels
+    if os.path.exists(os.path.join(args.output_dir, 'meta.json')):
+        shutil.rmtree(args.output_dir)
+
+    country_codes, country_ids = pd.factorize(df['countryWikidataId'])
+    tile_counts = {}
+    for zoom in range(args.min_zoom, args.max_zoom + 1):
+        tiles = build_zoom(df, zoom, country_codes, list(country_ids))
+        for (x, y), tile in tiles.items():
+            write_json(os.path.join(args.output_dir, str(zoom), str(x), f"{y}.json"), tile)
+        tile_counts[zoom] = len(tiles)
+        print(f"Zoom {zoom}: {len(tiles):,} tiles")
+
+    write_json(os.path.join(args.output_dir, 'countries.json'), build_country_aggregates(df))
+    write_json(os.path.join(args.output_dir, 'meta.json'), {
+        'minZoom': args.min_zoom,
+        'maxZoom': args.max_zoom,
+        'pointsPerTile': POINTS_PER_TILE,
+        'clusterGrid': CLUSTER_GRID,
+        'cities': len(df),
+        'tiles': tile_counts,
+        'pointFields': ['cityWikidataId', 'cityLabelEnglish', 'latitude', 'longitude', 'population'],
+        'clusterFields': ['latitude', 'longitude', 'cities', 'population'],
+        'countryFields': ['cities', 'population']
+    })
+    print(f"Saved {sum(tile_counts.values()):,} tiles to {args.output_dir} in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Query the deduplicated city table by country, class, population, coordinates and links.
+
+Indexes over city-data-deduplicated.csv (with classLabel and ancestorType added from the
+extractor results) are built once and saved to scripts/data/city-index.npz, and rebuilt when
+the table or the results change:
+- bitmap indexes on countryWikidataId, ancestorType and classLabel
+- a sorted index on population for ranges and population order
+- a grid index on coordinates for bounding boxes
+- presence bitmaps for officialWebsite and each social media platform
+
+Each filter of a query becomes a bitmap and the filters are combined by intersecting the
+bitmaps. Rows are only materialized when the result is iterated.
+
+Usage:
+    python scripts/city_query.py build
+    python scripts/city_query.py query --country Q183 --min-population 100000 --has officialWebsite
+    python scripts/city_query.py query --bbox 47.3 5.9 55.1 15.0 --class-label city --limit 20
+"""
+
+import argparse
+import glob
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_stats import load_city_table
+
+# Size of a cell of the coordinate grid in degrees
+GRID_DEGREES = 1.0
+# Number of rows materialized at once when iterating results
+ITER_CHUNK = 4096
+
+SOCIAL_PLATFORMS = ['twitter', 'facebook', 'instagram', 'youtube', 'linkedin', 'bluesky', 'mastodon', 'tiktok', 'threads']
+PRESENCE_FIELDS = ['officialWebsite'] + SOCIAL_PLATFORMS
+
+# Query arguments of the bitmap indexes and the columns they index
+CATEGORY_COLUMNS = {
+    'country': 'countryWikidataId',
+    'ancestor_type': 'ancestorType',
+    'class_label': 'classLabel'
+}
+STRING_COLUMNS = ['cityWikidataId', 'cityLabelEnglish', 'officialWebsite']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CITY_DATA_FILE = os.path.join(ROOT, 'serverless/autocomplete/src/city-data-deduplicated.csv')
+RESULTS_DIR = os.path.join(ROOT, 'scripts/wikidata-cities/data/cities')
+INDEX_FILE = os.path.join(ROOT, 'scripts/data/city-index.npz')
+
+# Number of set bits per byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+class Bitmap:
+    """A set of row indices stored as packed bits (one bit per row)."""
+
+    __slots__ = ('bits', 'size')
+
+    def __init__(self, bits, size):
+        self.bits = bits
+        self.size = size
+
+    @classmethod
+    def from_mask(cls, mask):
+        return cls(np.packbits(mask), len(mask))
+
+    @classmethod
+    def from_indices(cls, indices, size):
+        mask = np.zeros(size, dtype=bool)
+        mask[indices] = True
+        return cls.from_mask(mask)
+
+    @classmethod
+    def full(cls, size):
+        return cls.from_mask(np.ones(size, dtype=bool))
+
+    def __and__(self, other):
+        return Bitmap(self.bits & other.bits, self.size)
+
+    def __or__(self, other):
+        return Bitmap(self.bits | other.bits, self.size)
+
+    def __invert__(self):
+        bits = ~self.bits
+        if self.size % 8:
+            # Clear the padding bits of the last byte
+            bits[-1] &= np.uint8(0xFF << (8 - self.size % 8) & 0xFF)
+        return Bitmap(bits, self.size)
+
+    def count(self):
+        return int(POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def indices(self):
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.size))
+
+    def contains(self, indices):
+        """Return a boolean array telling which of the row indices are in the bitmap."""
+        return (self.bits[indices >> 3] >> (7 - (indices & 7)).astype(np.uint8)) & 1 == 1
+
+class StringColumn:
+    """Strings stored as one UTF-8 buffer and offsets, so the index file stays compact."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [value.encode('utf-8') if isinstance(value, str) else b'' for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+class CategoryIndex:
+    """Bitmap index of a categorical column.
+
+    The rows of each value are stored as one sorted run (rows grouped by value), and turned
+    into a bitmap the first time the value is queried.
+    """
+
+    def __init__(self, values, codes, order=None, offsets=None):
+        self.values = values
+        self.codes = codes
+        if order is None:
+            # Missing values (code -1) form the first run
+            order = np.argsort(codes, kind='stable')
+            offsets = np.zeros(len(values) + 2, dtype=np.int64)
+            np.cumsum(np.bincount(codes + 1, minlength=len(values) + 1), out=offsets[1:])
+        self.order = order
+        self.offsets = offsets
+        self._bitmaps = {}
+
+    @classmethod
+    def from_column(cls, column):
+        codes, values = pd.factorize(column, sort=True)
+        return cls(np.asarray(values, dtype=str), codes.astype(np.int32))
+
+    def rows(self, value):
+        code = np.searchsorted(self.values, value)
+        if code == len(self.values) or self.values[code] != value:
+            return self.order[:0]
+        return self.order[self.offsets[code + 1]:self.offsets[code + 2]]
+
+    def bitmap(self, values):
+        """Return the bitmap of the rows with any of the values."""
+        result = None
+        for value in [values] if isinstance(values, str) else values:
+            if value not in self._bitmaps:
+                self._bitmaps[value] = Bitmap.from_indices(self.rows(value), len(self.codes))
+            result = self._bitmaps[value] if result is None else result | self._bitmaps[value]
+        return result if result is not None else Bitmap.from_mask(np.zeros(len(self.codes), dtype=bool))
+
+    def value(self, row):
+        code = self.codes[row]
+        return str(self.values[code]) if code >= 0 else None
+
+class SortedIndex:
+    """Row indices sorted by a numeric column, for ranges and ordering. Missing values are left out."""
+
+    def __init__(self, order, sorted_values, size):
+        self.order = order
+        self.sorted_values = sorted_values
+        self.size = size
+        # Position of each row in the sorted order (size for missing values)
+        self.ranks = np.full(size, size, dtype=np.int64)
+        self.ranks[order] = np.arange(len(order))
+
+    @classmethod
+    def from_values(cls, values):
+        present = np.flatnonzero(~np.isnan(values))
+        order = present[np.argsort(values[present], kind='stable')]
+        return cls(order, values[order], len(values))
+
+    def bitmap(self, low=None, high=None):
+        """Return the bitmap of the rows with low <= value <= high."""
+        start = 0 if low is None else np.searchsorted(self.sorted_values, low, 'left')
+        end = len(self.order) if high is None else np.searchsorted(self.sorted_values, high, 'right')
+        if end - start <= self.size // 16:
+            return Bitmap.from_indices(self.order[start:end], self.size)
+        # Wide range: a sequential comparison of the ranks is faster than setting scattered rows
+        return Bitmap.from_mask((self.ranks >= start) & (self.ranks < end))
+
+class GridIndex:
+    """Rows grouped by cell of a latitude/longitude grid, for bounding box queries."""
+
+    def __init__(self, latitude, longitude, order=None, offsets=None, cell_degrees=GRID_DEGREES):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.cell_degrees = cell_degrees
+        self.rows_count = int(round(180 / cell_degrees))
+        self.columns_count = int(round(360 / cell_degrees))
+        if order is None:
+            present = np.flatnonzero(~np.isnan(latitude) & ~np.isnan(longitude))
+            cells = self._cells(latitude[present], longitude[present])
+            order = present[np.argsort(cells, kind='stable')]
+            offsets = np.zeros(self.rows_count * self.columns_count + 1, dtype=np.int64)
+            np.cumsum(np.bincount(cells, minlength=self.rows_count * self.columns_count), out=offsets[1:])
+        self.order = order
+        self.offsets = offsets
+
+    def _grid_row(self, latitude):
+        return np.clip(((np.asarray(latitude) + 90) // self.cell_degrees).astype(np.int64), 0, self.rows_count - 1)
+
+    def _grid_column(self, longitude):
+        return np.clip(((np.asarray(longitude) + 180) // self.cell_degrees).astype(np.int64), 0, self.columns_count - 1)
+
+    def _cells(self, latitude, longitude):
+        return self._grid_row(latitude) * self.columns_count + self._grid_column(longitude)
+
+    def rows(self, min_lat, min_lon, max_lat, max_lon):
+        """Return the rows inside the bounding box. A box with min_lon > max_lon crosses the antimeridian."""
+        if min_lat > max_lat:
+            return self.order[:0]
+        if min_lon > max_lon:
+            return np.concatenate((self.rows(min_lat, min_lon, max_lat, 180), self.rows(min_lat, -180, max_lat, max_lon)))
+        first_column, last_column = self._grid_column(min_lon), self._grid_column(max_lon)
+        # The cells of a grid row within the box are contiguous, so each grid row is one slice
+        candidates = np.concatenate([
+            self.order[self.offsets[row * self.columns_count + first_column]:self.offsets[row * self.columns_count + last_column + 1]]
+            for row in range(self._grid_row(min_lat), self._grid_row(max_lat) + 1)
+        ])
+        latitude, longitude = self.latitude[candidates], self.longitude[candidates]
+        inside = (latitude >= min_lat) & (latitude <= max_lat) & (longitude >= min_lon) & (longitude <= max_lon)
+        return candidates[inside]
+
+class QueryResult:
+    """Rows matching a query. Rows are only materialized when iterated."""
+
+    def __init__(self, index, bitmap):
+        self.index = index
+        self.bitmap = bitmap
+
+    def __len__(self):
+        return self.bitmap.count()
+
+    def indices(self):
+        return self.bitmap.indices()
+
+    def __iter__(self):
+        """Yield the matching rows as dicts in table order."""
+        indices = self.indices()
+        for start in range(0, len(indices), ITER_CHUNK):
+            for row in indices[start:start + ITER_CHUNK]:
+                yield self.index.row(row)
+
+    def by_population(self):
+        """Yield the matching rows as dicts, most populous first, then the rows without population."""
+        order = self.index.population_index.order[::-1]
+        for start in range(0, len(order), ITER_CHUNK):
+            chunk = order[start:start + ITER_CHUNK]
+            for row in chunk[self.bitmap.contains(chunk)]:
+                yield self.index.row(row)
+        missing = np.isnan(self.index.population)
+        for row in np.flatnonzero(missing & np.unpackbits(self.bitmap.bits, count=self.bitmap.size).astype(bool)):
+            yield self.index.row(row)
+
+    def top(self, n):
+        """Return the n most populous matching rows."""
+        return list(itertools.islice(self.by_population(), n))
+
+    def frame(self):
+        return pd.DataFrame(list(self))
+
+class CityIndex:
+    """Bitmap, sorted and grid indexes over the deduplicated city table."""
+
+    def __init__(self, strings, population, latitude, longitude, categories, presence, superseded,
+                 population_index=None, grid=None):
+        self.strings = strings
+        self.population = population
+        self.latitude = latitude
+        self.longitude = longitude
+        self.categories = categories
+        self.presence = presence
+        self.superseded = superseded
+        self.size = len(population)
+        self.population_index = population_index or SortedIndex.from_values(population)
+        self.grid = grid or GridIndex(latitude, longitude)
+
+    @classmethod
+    def from_csv(cls, city_data_file=CITY_DATA_FILE, results_dir=RESULTS_DIR):
+        df = load_city_table(city_data_file, results_dir)
+        for column in list(CATEGORY_COLUMNS.values()) + ['officialWebsite', 'socialMedia', 'superseded_by']:
+            if column not in df.columns:
+                df[column] = None
+
+        # socialMedia holds a JSON object per city; presence of a platform is presence of its key
+        social_media = df['socialMedia'].fillna('').astype(str)
+        presence = {'officialWebsite': Bitmap.from_mask(df['officialWebsite'].notna().to_numpy())}
+        for platform in SOCIAL_PLATFORMS:
+            presence[platform] = Bitmap.from_mask(social_media.str.contains(f'"{platform}":', regex=False).to_numpy())
+
+        return cls(
+            strings={column: StringColumn.from_values(df[column].tolist()) for column in STRING_COLUMNS},
+            population=pd.to_numeric(df['population'], errors='coerce').to_numpy(dtype=np.float64),
+            latitude=pd.to_numeric(df['latitude'], errors='coerce').to_numpy(dtype=np.float64),
+            longitude=pd.to_numeric(df['longitude'], errors='coerce').to_numpy(dtype=np.float64),
+            categories={name: CategoryIndex.from_column(df[column]) for name, column in CATEGORY_COLUMNS.items()},
+            presence=presence,
+            superseded=Bitmap.from_mask(df['superseded_by'].notna().to_numpy())
+        )
+
+    def save(self, index_file=INDEX_FILE, source=None):
+        arrays = {
+            'source': np.array(source or []),
+            'population': self.population, 'latitude': self.latitude, 'longitude': self.longitude,
+            'superseded': self.superseded.bits,
+            'population_order': self.population_index.order, 'grid_order': self.grid.order,
+            'grid_offsets': self.grid.offsets
+        }
+        for column, strings in self.strings.items():
+            arrays[f"string_{column}_data"] = strings.data
+            arrays[f"string_{column}_offsets"] = strings.offsets
+        for name, category in self.categories.items():
+            for part in ('values', 'codes', 'order', 'offsets'):
+                arrays[f"category_{name}_{part}"] = getattr(category, part)
+        for field, bitmap in self.presence.items():
+            arrays[f"presence_{field}"] = bitmap.bits
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        np.savez(index_file, **arrays)
+
+    @classmethod
+    def load(cls, index_file=INDEX_FILE, city_data_file=CITY_DATA_FILE, results_dir=RESULTS_DIR):
+        """Load the persisted indexes, rebuilding and saving them if the table or the results changed."""
+        source = get_source_fingerprint(city_data_file, results_dir)
+        if os.path.exists(index_file):
+            with np.load(index_file) as data:
+                if list(data['source']) == source:
+                    size = len(data['population'])
+                    population = data['population']
+                    latitude, longitude = data['latitude'], data['longitude']
+                    return cls(
+                        strings={column: StringColumn(data[f"string_{column}_data"], data[f"string_{column}_offsets"])
+                                 for column in STRING_COLUMNS},
+                        population=population, latitude=latitude, longitude=longitude,
+                        categories={name: CategoryIndex(*(data[f"category_{name}_{part}"]
+                                                          for part in ('values', 'codes', 'order', 'offsets')))
+                                    for name in CATEGORY_COLUMNS},
+                        presence={field: Bitmap(data[f"presence_{field}"], size) for field in PRESENCE_FIELDS},
+                        superseded=Bitmap(data['superseded'], size),
+                        population_index=SortedIndex(data['population_order'], population[data['population_order']], size),
+                        grid=GridIndex(latitude, longitude, data['grid_order'], data['grid_offsets'])
+                    )
+
+        index = cls.from_csv(city_data_file, results_dir)
+        index.save(index_file, source)
+        return index
+
+    def query(self, country=None, ancestor_type=None, class_label=None, min_population=None, max_population=None,
+              bbox=None, has=(), include_superseded=False):
+        """Return the cities matching all given filters.
+
+        country, ancestor_type and class_label take a value or a list of values (any of them
+        matches). bbox is (min_lat, min_lon, max_lat, max_lon). has lists fields of
+        PRESENCE_FIELDS that must be present. Cities superseded by a duplicate are excluded
+        unless include_superseded is set.
+        """
+        bitmaps = []
+        for name, values in (('country', country), ('ancestor_type', ancestor_type), ('class_label', class_label)):
+            if values is not None:
+                bitmaps.append(self.categories[name].bitmap(values))
+        if min_population is not None or max_population is not None:
+            bitmaps.append(self.population_index.bitmap(min_population, max_population))
+        if bbox is not None:
+            bitmaps.append(Bitmap.from_indices(self.grid.rows(*bbox), self.size))
+        for field in [has] if isinstance(has, str) else has:
+            if field not in self.presence:
+                raise ValueError(f"Unknown field {field}, expected one of {', '.join(PRESENCE_FIELDS)}")
+            bitmaps.append(self.presence[field])
+        if not include_superseded:
+            bitmaps.append(~self.superseded)
+
+        result = bitmaps[0] if bitmaps else Bitmap.full(self.size)
+        for bitmap in bitmaps[1:]:
+            result = result & bitmap
+        return QueryResult(self, result)
+
+    def row(self, index):
+        population = self.population[index]
+        latitude, longitude = self.latitude[index], self.longitude[index]
+        row = {column: self.strings[column][index] or None for column in STRING_COLUMNS}
+        row.update({column: self.categories[name].value(index) for name, column in CATEGORY_COLUMNS.items()})
+        row.update({
+            'population': None if np.isnan(population) else int(population),
+            'latitude': None if np.isnan(latitude) else float(latitude),
+            'longitude': None if np.isnan(longitude) else float(longitude)
+        })
+        return row
+
+def get_source_fingerprint(city_data_file, results_dir):
+    """Return path, size and modification time of the city table and the extractor results."""
+    files = [city_data_file] + sorted(glob.glob(os.path.join(results_dir, 'cities_process_*_final.json')))
+    fingerprint = []
+    for path in files:
+        stat = os.stat(path)
+        fingerprint.append(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return fingerprint
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the city table by country, class, population, coordinates and links.')
+    parser.add_argument('--input', default=CITY_DATA_FILE, help='City table CSV file path')
+    parser.add_argument('--results-dir', default=RESULTS_DIR, help='Extractor results, used to add classLabel and ancestorType')
+    parser.add_argument('--index', default=INDEX_FILE, help='File of the persisted indexes')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('build', help='Build and save the indexes')
+    query_parser = subparsers.add_parser('query', help='Print the cities matching all filters, most populous first')
+    query_parser.add_argument('--country', nargs='+', default=None, help='Country QIDs')
+    query_parser.add_argument('--ancestor-type', nargs='+', default=None,
+                              help='Ancestor type labels (e.g. city, municipality)')
+    query_parser.add_argument('--class-label', nargs='+', default=None, help='Class labels (e.g. city)')
+    query_parser.add_argument('--min-population', type=float, default=None)
+    query_parser.add_argument('--max-population', type=float, default=None)
+    query_parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    query_parser.add_argument('--has', nargs='+', default=[], choices=PRESENCE_FIELDS, help='Fields that must be present')
+    query_parser.add_argument('--include-superseded', action='store_true', help='Also include cities superseded by a duplicate')
+    query_parser.add_argument('--limit', type=int, default=20, help='Number of cities to print')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.command == 'build':
+        index = CityIndex.from_csv(args.input, args.results_dir)
+        index.save(args.index, get_source_fingerprint(args.input, args.results_dir))
+        print(f"Saved indexes of {index.size} cities to {args.index} in {time.time() - start_time:.2f} seconds")
+        return
+
+    index = CityIndex.load(args.index, args.input, args.results_dir)
+    load_time = time.time()
+    result = index.query(
+        country=args.country, ancestor_type=args.ancestor_type, class_label=args.class_label,
+        min_population=args.min_population, max_population=args.max_population,
+        bbox=args.bbox, has=args.has, include_superseded=args.include_superseded
+    )
+    count = len(result)
+    for city in result.top(args.limit):
+        population = f"{city['population']:,}" if city['population'] is not None else ''
+        print(f"{city['cityWikidataId']}\t{city['cityLabelEnglish'] or ''}\t{city['countryWikidataId'] or ''}\t{population}")
+    print(f"Found {count:,} cities in {(time.time() - load_time) * 1000:.1f} ms "
+          f"(indexes loaded in {load_time - start_time:.2f} seconds)")
+
+if __name__ == "__main__":
+    main()
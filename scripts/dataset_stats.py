@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Script to report coverage and quality of the city dataset, and to diff two releases.
+
+report: per-field coverage of the city table, broken down by country and classLabel,
+sanity checks on population and coordinates, and coverage of the city network files
+(members and joint statement signatures). All counts are computed column-wise with pandas.
+
+diff: compares two releases of the city table by QID: cities added, removed and changed
+per field.
+
+Run from the project root:
+    python scripts/dataset_stats.py report
+    python scripts/dataset_stats.py diff old/city-data-deduplicated.csv serverless/autocomplete/src/city-data-deduplicated.csv
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+
+import pandas as pd
+
+# Population above this is implausible for a single city
+MAX_POPULATION = 40_000_000
+# Number of example QIDs listed per check and changed field
+EXAMPLES = 5
+
+def load_city_table(city_data_file, results_dir=None):
+    """Load the city table, adding classLabel and ancestorType from the extractor results if missing."""
+    df = pd.read_csv(city_data_file, dtype={'cityWikidataId': str, 'countryWikidataId': str})
+    if 'classLabel' in df.columns or not results_dir:
+        return df
+
+    result_files = sorted(glob.glob(os.path.join(results_dir, 'cities_process_*_final.json')))
+    if not result_files:
+        return df
+    frames = []
+    for path in result_files:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        rows = pd.read_json(path, lines=True).iloc[1:]
+        rows.columns = header[:len(rows.columns)]
+        frames.append(rows[['cityWikidataId', 'classLabel', 'ancestorType']])
+    classes = pd.concat(frames, ignore_index=True).drop_duplicates('cityWikidataId')
+    return df.merge(classes, on='cityWikidataId', how='left')
+
+def coverage(df, fields):
+    """Return the share of non-empty values per field."""
+    return df[fields].notna().mean()
+
+def coverage_by(df, fields, group_field, top=20):
+    """Return a frame of city count and per-field coverage for the largest groups."""
+    present = df[fields].notna()
+    grouped = present.groupby(df[group_field].fillna('(none)'))
+    table = grouped.mean()
+    table.insert(0, 'cities', grouped.size())
+    return table.sort_values('cities', ascending=False).head(top)
+
+def sanity_checks(df):
+    """Return {check: (count, example QIDs)} for rows that fail basic plausibility checks."""
+    qids = df['cityWikidataId'].astype(str)
+    population = pd.to_numeric(df.get('population'), errors='coerce')
+    latitude = pd.to_numeric(df.get('latitude'), errors='coerce')
+    longitude = pd.to_numeric(df.get('longitude'), errors='coerce')
+    population_year = pd.to_numeric(df.get('populationDate', pd.Series(dtype=str)).astype(str).str[:4], errors='coerce')
+
+    checks = {
+        'invalid QID': ~qids.str.fullmatch(r'Q\d+'),
+        'duplicate QID': qids.duplicated(keep=False),
+        'population <= 0': population <= 0,
+        f'population > {MAX_POPULATION:,}': population > MAX_POPULATION,
+        'population date in the future': population_year > datetime.date.today().year,
+        'latitude out of range': latitude.abs() > 90,
+        'longitude out of range': longitude.abs() > 180,
+        'coordinates at 0,0': (latitude == 0) & (longitude == 0),
+        'only one coordinate': latitude.isna() != longitude.isna(),
+    }
+    if 'officialWebsite' in df.columns:
+        website = df['officialWebsite']
+        checks['website not http(s)'] = website.notna() & ~website.astype(str).str.match(r'https?://')
+
+    return {
+        name: (int(mask.sum()), qids[mask].head(EXAMPLES).tolist())
+        for name, mask in checks.items()
+    }
+
+def load_network_records(path):
+    """Load the member or signature records of a network file as a flat frame."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and 'members' in data:
+        records = data['members']
+    elif isinstance(data, dict):
+        records = [vote for statement in data.values() for vote in statement.get('votes', [])]
+    else:
+        records = data
+    return pd.json_normalize(records)
+
+def network_coverage(network_files, city_qids, superseded_qids):
+    """Return per-file record counts, field coverage and the share of cities found in the city table."""
+    report = {}
+    for path in network_files:
+        records = load_network_records(path)
+        if records.empty:
+            continue
+        qid_field = next((f for f in ('wikidata_id', 'associatedCityId') if f in records.columns), None)
+        entry = {'records': len(records), 'coverage': coverage(records, list(records.columns)).round(3).to_dict()}
+        if qid_field:
+            qids = records[qid_field].dropna()
+            entry['with QID'] = int(len(qids))
+            entry['QID in city table'] = int(qids.isin(city_qids).sum())
+            entry['QID superseded'] = int(qids.isin(superseded_qids).sum())
+        report[path] = entry
+    return report
+
+def report(args):
+    df = load_city_table(args.city_data, args.results_dir)
+    fields = [column for column in df.columns if column != 'cityWikidataId']
+
+    result = {
+        'cities': len(df),
+        'coverage': coverage(df, fields).round(3).to_dict(),
+        'checks': {name: {'count': count, 'examples': examples} for name, (count, examples) in sanity_checks(df).items()}
+    }
+    print(f"Cities: {len(df):,}\n")
+    print("Coverage:")
+    for field, share in result['coverage'].items():
+        print(f"  - {field}: {share:.1%}")
+
+    for group_field in ('countryWikidataId', 'classLabel'):
+        if group_field not in df.columns:
+            print(f"\nNo {group_field} column (pass --results-dir to add it from the extractor results)")
+            continue
+        table = coverage_by(df, [f for f in fields if f != group_field], group_field, args.top)
+        result[f'by {group_field}'] = json.loads(table.round(3).to_json(orient='index'))
+        print(f"\nCoverage by {group_field} (top {args.top}):")
+        print(table.to_string(float_format=lambda value: f"{value:.0%}"))
+
+    print("\nSanity checks:")
+    for name, check in result['checks'].items():
+        examples = f" (e.g. {', '.join(check['examples'])})" if check['count'] else ''
+        print(f"  - {name}: {check['count']:,}{examples}")
+
+    network_files = sorted(set(glob.glob(args.networks, recursive=True)) - {args.city_data})
+    superseded = df.loc[df['superseded_by'].notna(), 'cityWikidataId'] if 'superseded_by' in df.columns else []
+    result['networks'] = network_coverage(network_files, df['cityWikidataId'], superseded)
+    print("\nNetwork files:")
+    for path, entry in result['networks'].items():
+        print(f"  {path}: {entry['records']} records")
+        if 'with QID' in entry:
+            print(f"    - with QID: {entry['with QID']}, in city table: {entry['QID in city table']}, "
+                  f"superseded: {entry['QID superseded']}")
+        low = {field: share for field, share in entry['coverage'].items() if share < 1}
+        for field, share in sorted(low.items(), key=lambda item: item[1]):
+            print(f"    - {field}: {share:.1%}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nSaved report to {args.output}")
+
+def diff_releases(old_df, new_df):
+    """Compare two city tables by QID. Returns (added QIDs, removed QIDs, {field: changed QIDs})."""
+    old_df = old_df.drop_duplicates('cityWikidataId').set_index('cityWikidataId')
+    new_df = new_df.drop_duplicates('cityWikidataId').set_index('cityWikidataId')
+
+    added = new_df.index.difference(old_df.index)
+    removed = old_df.index.difference(new_df.index)
+    common = old_df.index.intersection(new_df.index)
+
+    fields = [field for field in old_df.columns if field in new_df.columns]
+    differs = old_df.loc[common, fields].to_numpy() != new_df.loc[common, fields].to_numpy()
+    changed = {field: common[differs[:, i]] for i, field in enumerate(fields)}
+    return added, removed, changed
+
+def diff(args):
+    # Values are compared as strings, so formatting changes (e.g. 1.0 vs 1) show up as changes
+    old_df = pd.read_csv(args.old, dtype=str, keep_default_na=False)
+    new_df = pd.read_csv(args.new, dtype=str, keep_default_na=False)
+    added, removed, changed = diff_releases(old_df, new_df)
+
+    print(f"Cities: {len(old_df):,} -> {len(new_df):,}")
+    print(f"  - added: {len(added):,}{format_examples(added)}")
+    print(f"  - removed: {len(removed):,}{format_examples(removed)}")
+    for column in sorted(set(old_df.columns) ^ set(new_df.columns)):
+        print(f"  - column {'added' if column in new_df.columns else 'removed'}: {column}")
+    print("Changed per field:")
+    for field, qids in changed.items():
+        print(f"  - {field}: {len(qids):,}{format_examples(qids)}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'added': added.tolist(),
+                'removed': removed.tolist(),
+                'changed': {field: qids.tolist() for field, qids in changed.items()}
+            }, f, indent=2)
+        print(f"Saved diff to {args.output}")
+
+def format_examples(qids):
+    return f" (e.g. {', '.join(qids[:EXAMPLES])})" if len(qids) else ''
+
+def main():
+    parser = argparse.ArgumentParser(description='Report coverage and quality of the city dataset.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    report_parser = subparsers.add_parser('report', help='Coverage, sanity checks and network file coverage')
+    report_parser.add_argument('--city-data', default='serverless/autocomplete/src/city-data-deduplicated.csv',
+                               help='City table CSV file path')
+    report_parser.add_argument('--results-dir', default='scripts/wikidata-cities/data/cities',
+                               help='Extractor results, used to add classLabel to the city table')
+    report_parser.add_argument('--networks', default='public-data/city-networks/**/*.json',
+                               help='Glob pattern of the network member and signature files')
+    report_parser.add_argument('--top', type=int, default=20, help='Number of countries and classes to show')
+    report_parser.add_argument('--output', default=None, help='Also write the report to a JSON file')
+
+    diff_parser = subparsers.add_parser('diff', help='Compare two releases of the city table by QID')
+    diff_parser.add_argument('old', help='City table CSV of the previous release')
+    diff_parser.add_argument('new', help='City table CSV of the new release')
+    diff_parser.add_argument('--output', default=None, help='Also write the QIDs to a JSON file')
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        report(args)
+    else:
+        diff(args)
+
+if __name__ == "__main__":
+    main()
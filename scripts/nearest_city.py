@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Reverse geocoding: find the registered cities nearest to coordinates.
+
+Cities of city-data-deduplicated.csv are converted to 3D unit vectors and stored in a
+KD-tree, so Euclidean (chord) distances between vectors order cities the same way as
+great-circle distances, without special cases at the poles or the antimeridian.
+The tree is saved to scripts/data/city-tree.npz and rebuilt when the CSV changes.
+
+Queries are batched: all coordinates of a batch descend the tree together with numpy,
+so lookups for many points (e.g. a signature file with coordinates) are fast.
+
+Usage:
+    python scripts/nearest_city.py build
+    python scripts/nearest_city.py nearest 52.52 13.40 --k 3
+    python scripts/nearest_city.py within 48.86 2.35 --radius 20 --min-population 10000
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Maximum number of cities in a leaf of the tree
+LEAF_SIZE = 16
+# Number of queries processed at once (bounds the memory of candidate arrays,
+# and fits in int16 so candidates can be grouped with a radix sort)
+QUERY_CHUNK = 8192
+
+# Arrays of a KDTree saved with the city data
+TREE_ARRAYS = ['order', 'points', 'split_dim', 'split_value', 'left', 'right', 'start', 'end', 'box_min', 'box_max']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CITY_DATA_FILE = os.path.join(ROOT, 'serverless/autocomplete/src/city-data-deduplicated.csv')
+TREE_FILE = os.path.join(ROOT, 'scripts/data/city-tree.npz')
+
+def to_unit_vectors(lat, lon):
+    """Convert latitudes and longitudes in degrees to an (n, 3) array of unit vectors."""
+    lat = np.radians(np.atleast_1d(np.asarray(lat, dtype=np.float64)))
+    lon = np.radians(np.atleast_1d(np.asarray(lon, dtype=np.float64)))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+def chord_to_km(squared_chord):
+    """Convert squared chord lengths to great-circle distances in km (inf stays inf)."""
+    chord = np.sqrt(squared_chord)
+    distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+    # Missing neighbours have an inf chord, which must not be clamped to half the circumference
+    return np.where(np.isinf(squared_chord), np.inf, distance)
+
+def km_to_squared_chord(distance_km):
+    chord = 2 * np.sin(np.minimum(np.asarray(distance_km, dtype=np.float64) / (2 * EARTH_RADIUS_KM), np.pi / 2))
+    return chord * chord
+
+class KDTree:
+    """Static KD-tree over 3D points with batched k-nearest and radius queries.
+
+    Points are reordered so that each leaf is a contiguous range. Nodes are stored in
+    flat arrays: split dimension and value, children (-1 for leaves), point range and
+    bounding box.
+    """
+
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        self.order = np.arange(len(points))
+        points = np.asarray(points, dtype=np.float64)
+
+        split_dim, split_value, left, right, start, end, box_min, box_max = [], [], [], [], [], [], [], []
+        def add_node(node_start, node_end):
+            node_points = points[self.order[node_start:node_end]]
+            split_dim.append(-1)
+            split_value.append(0.0)
+            left.append(-1)
+            right.append(-1)
+            start.append(node_start)
+            end.append(node_end)
+            box_min.append(node_points.min(axis=0) if len(node_points) else np.zeros(3))
+            box_max.append(node_points.max(axis=0) if len(node_points) else np.zeros(3))
+            return len(start) - 1
+
+        stack = [add_node(0, len(points))]
+        while stack:
+            node = stack.pop()
+            node_start, node_end = start[node], end[node]
+            if node_end - node_start <= leaf_size:
+                continue
+            dim = int(np.argmax(box_max[node] - box_min[node]))
+            middle = (node_start + node_end) // 2
+            indices = self.order[node_start:node_end]
+            partition = np.argpartition(points[indices, dim], middle - node_start)
+            self.order[node_start:node_end] = indices[partition]
+
+            split_dim[node] = dim
+            split_value[node] = points[self.order[middle - 1], dim]
+            left[node] = add_node(node_start, middle)
+            right[node] = add_node(middle, node_end)
+            stack += [left[node], right[node]]
+
+        self.points = points[self.order]
+        self.split_dim = np.array(split_dim, dtype=np.int8)
+        self.split_value = np.array(split_value)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self.start = np.array(start, dtype=np.int64)
+        self.end = np.array(end, dtype=np.int64)
+        self.box_min = np.array(box_min).reshape(-1, 3)
+        self.box_max = np.array(box_max).reshape(-1, 3)
+
+    def _descend(self, node, min_size):
+        """Return which nodes can be descended without going below min_size points."""
+        left, right = self.left[node], self.right[node]
+        size = np.minimum(self.end[left] - self.start[left], self.end[right] - self.start[right])
+        return (left >= 0) & (size >= min_size)
+
+    def _home_nodes(self, queries, min_size=1):
+        """Return the smallest node containing each query point that has at least min_size points."""
+        node = np.zeros(len(queries), dtype=np.int64)
+        active = np.flatnonzero(self._descend(node, min_size))
+        while len(active):
+            current = node[active]
+            go_left = queries[active, self.split_dim[current]] <= self.split_value[current]
+            node[active] = np.where(go_left, self.left[current], self.right[current])
+            active = active[self._descend(node[active], min_size)]
+        return node
+
+    def _candidates(self, queries, query_index, leaves):
+        """Expand (query, node) pairs into (query, point, squared distance) candidates."""
+        counts = self.end[leaves] - self.start[leaves]
+        total = int(counts.sum())
+        first = np.cumsum(counts) - counts
+        points = np.repeat(self.start[leaves] - first, counts) + np.arange(total)
+        query_index = np.repeat(query_index, counts)
+        difference = self.points[points] - queries[query_index]
+        return query_index, points, np.einsum('ij,ij->i', difference, difference)
+
+    def _search(self, queries, bound, skip_nodes=None):
+        """Return the candidates of all leaves within the squared distance bound of each query.
+
+        Leaves inside skip_nodes (one node per query) are left out.
+        """
+        query_index = np.arange(len(queries))
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        results = []
+        while len(nodes):
+            q = queries[query_index]
+            gap = np.maximum(np.maximum(self.box_min[nodes] - q, q - self.box_max[nodes]), 0)
+            keep = np.einsum('ij,ij->i', gap, gap) <= bound[query_index]
+            query_index, nodes = query_index[keep], nodes[keep]
+
+            is_leaf = self.left[nodes] < 0
+            leaf_query, leaves = query_index[is_leaf], nodes[is_leaf]
+            if skip_nodes is not None:
+                skip = skip_nodes[leaf_query]
+                new = (self.start[leaves] < self.start[skip]) | (self.end[leaves] > self.end[skip])
+                leaf_query, leaves = leaf_query[new], leaves[new]
+            if len(leaves):
+                results.append(self._candidates(queries, leaf_query, leaves))
+
+            inner_query, inner = query_index[~is_leaf], nodes[~is_leaf]
+            query_index = np.concatenate((inner_query, inner_query))
+            nodes = np.concatenate((self.left[inner], self.right[inner]))
+
+        if not results:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, np.array([])
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    def query(self, queries, k=1):
+        """Return (squared distances, indices) of the k nearest points, shape (n, k).
+
+        Missing neighbours (fewer than k points) have distance inf and index -1.
+        """
+        # The k nearest points of the smallest node around the query with k points bound the search
+        home_nodes = self._home_nodes(queries, k)
+        home = self._candidates(queries, np.arange(len(queries)), home_nodes)
+        bound = _kth_distance(home[0], home[2], len(queries), k)
+
+        other = self._search(queries, bound, skip_nodes=home_nodes)
+        candidates = (np.concatenate((h, o)) for h, o in zip(home, other))
+        distances, points = _top_k(*candidates, len(queries), k)
+        indices = np.where(points >= 0, self.order[points], -1)
+        return distances, indices
+
+    def query_radius(self, queries, squared_radius):
+        """Return (query index, point index, squared distance) of all points within the radius."""
+        bound = np.broadcast_to(squared_radius, (len(queries),))
+        query_index, points, distances = self._search(queries, bound)
+        within = distances <= bound[query_index]
+        query_index, points, distances = query_index[within], points[within], distances[within]
+        order = _sort_by_query(query_index, distances)
+        return query_index[order], self.order[points[order]], distances[order]
+
+def _sort_by_query(query_index, distances):
+    """Return the order sorting candidates by query index, then distance.
+
+    Faster than np.lexsort: the stable sort of int16 query indices is a radix sort. Query
+    indices beyond the int16 range (more than QUERY_CHUNK queries at once) are sorted as intp.
+    """
+    order = np.argsort(distances)
+    query_index = query_index[order]
+    small = len(query_index) == 0 or query_index.max() <= np.iinfo(np.int16).max
+    return order[np.argsort(query_index.astype(np.int16 if small else np.intp), kind='stable')]
+
+def _group_rank(query_index):
+    """Return the position of each candidate within its query's group (query_index must be sorted)."""
+    if not len(query_index):
+        return query_index
+    group_start = np.flatnonzero(np.concatenate(([True], query_index[1:] != query_index[:-1])))
+    group_size = np.diff(np.append(group_start, len(query_index)))
+    return np.arange(len(query_index)) - np.repeat(group_start, group_size)
+
+def _kth_distance(query_index, distances, query_count, k):
+    """Return the k-th smallest distance per query (inf if fewer), for candidates grouped by query."""
+    rank = _group_rank(query_index)
+    if k > rank.max(initial=-1) + 1:
+        return np.full(query_count, np.inf)
+    table = np.full((query_count, rank.max() + 1), np.inf)
+    table[query_index, rank] = distances
+    return np.partition(table, k - 1, axis=1)[:, k - 1]
+
+def _top_k(query_index, points, distances, query_count, k):
+    """Select the k smallest distances per query from flat candidate arrays."""
+    order = _sort_by_query(query_index, distances)
+    query_index, points, distances = query_index[order], points[order], distances[order]
+    rank = _group_rank(query_index)
+    keep = rank < k
+
+    top_distances = np.full((query_count, k), np.inf)
+    top_points = np.full((query_count, k), -1, dtype=np.int64)
+    top_distances[query_index[keep], rank[keep]] = distances[keep]
+    top_points[query_index[keep], rank[keep]] = points[keep]
+    return top_distances, top_points
+
+class CityLocator:
+    """Nearest-city lookups over the deduplicated city table.
+
+    The tree over all cities with coordinates is persisted; trees for filtered subsets
+    (minimum population, without superseded duplicates) are built on first use and
+    kept in memory.
+    """
+
+    def __init__(self, qids, labels, countries, population, superseded, points, tree=None):
+        self.qids = qids
+        self.labels = labels
+        self.countries = countries
+        self.population = population
+        self.superseded = superseded
+        self.points = points
+        self._trees = {(0, True): (tree or KDTree(points), None)}
+
+    @classmethod
+    def from_csv(cls, city_data_file=CITY_DATA_FILE):
+        df = pd.read_csv(city_data_file, usecols=lambda column: column in {
+            'cityWikidataId', 'cityLabelEnglish', 'countryWikidataId', 'population',
+            'latitude', 'longitude', 'superseded_by'
+        })
+        df = df.dropna(subset=['latitude', 'longitude'])
+        superseded = df['superseded_by'].notna() if 'superseded_by' in df else pd.Series(False, index=df.index)
+        return cls(
+            qids=df['cityWikidataId'].to_numpy(dtype=str),
+            labels=df['cityLabelEnglish'].fillna('').to_numpy(dtype=str),
+            countries=df['countryWikidataId'].fillna('').to_numpy(dtype=str),
+            population=pd.to_numeric(df['population'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64),
+            superseded=superseded.to_numpy(dtype=bool),
+            points=to_unit_vectors(df['latitude'].to_numpy(), df['longitude'].to_numpy())
+        )
+
+    def save(self, tree_file=TREE_FILE, source_file=CITY_DATA_FILE):
+        tree, _ = self._trees[(0, True)]
+        stat = os.stat(source_file)
+        os.makedirs(os.path.dirname(tree_file), exist_ok=True)
+        np.savez(
+            tree_file,
+            source=np.array([os.path.abspath(source_file), str(stat.st_size), str(stat.st_mtime_ns)]),
+            qids=self.qids, labels=self.labels, countries=self.countries,
+            population=self.population, superseded=self.superseded, points=self.points,
+            **{f"tree_{name}": getattr(tree, name) for name in TREE_ARRAYS}
+        )
+
+    @classmethod
+    def load(cls, tree_file=TREE_FILE, source_file=CITY_DATA_FILE):
+        """Load the persisted tree, rebuilding and saving it if the city table changed."""
+        stat = os.stat(source_file)
+        source = [os.path.abspath(source_file), str(stat.st_size), str(stat.st_mtime_ns)]
+        if os.path.exists(tree_file):
+            with np.load(tree_file) as data:
+                if list(data['source']) == source:
+                    tree = KDTree.__new__(KDTree)
+                    for name in TREE_ARRAYS:
+                        setattr(tree, name, data[f"tree_{name}"])
+                    return cls(data['qids'], data['labels'], data['countries'], data['population'],
+                               data['superseded'], data['points'], tree)
+
+        locator = cls.from_csv(source_file)
+        locator.save(tree_file, source_file)
+        return locator
+
+    def _tree(self, min_population=None, include_superseded=False):
+        """Return (tree, city indices of the tree's points or None if all cities)."""
+        key = (min_population or 0, include_superseded)
+        if key not in self._trees:
+            mask = self.population >= key[0] if key[0] else np.ones(len(self.qids), dtype=bool)
+            if not include_superseded:
+                mask &= ~self.superseded
+            subset = np.flatnonzero(mask)
+            self._trees[key] = (KDTree(self.points[subset]), subset)
+        return self._trees[key]
+
+    def nearest(self, lat, lon, k=1, min_population=None, include_superseded=False):
+        """Return (distances in km, city indices) of the k nearest cities, each of shape (n, k).
+
+        lat and lon may be scalars or arrays. Missing neighbours have distance inf and index -1.
+        """
+        queries = to_unit_vectors(lat, lon)
+        tree, subset = self._tree(min_population, include_superseded)
+        distances = np.full((len(queries), k), np.inf)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(tree.points) == 0:
+            return distances, indices
+
+        # Fewer queries at once for large k, as the number of candidates per query grows with k
+        chunk_size = max(1, QUERY_CHUNK // max(1, k // LEAF_SIZE))
+        for chunk_start in range(0, len(queries), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            squared, points = tree.query(queries[chunk], k)
+            distances[chunk] = chord_to_km(squared)
+            if subset is not None:
+                points = np.where(points >= 0, subset[np.maximum(points, 0)], -1)
+            indices[chunk] = points
+        return distances, indices
+
+    def within_radius(self, lat, lon, radius_km, min_population=None, include_superseded=False):
+        """Return (query index, city index, distance in km) of all cities within radius_km.
+
+        The flat arrays are sorted by query index and distance.
+        """
+        queries = to_unit_vectors(lat, lon)
+        tree, subset = self._tree(min_population, include_superseded)
+        squared_radius = np.broadcast_to(km_to_squared_chord(radius_km), (len(queries),))
+        if len(tree.points) == 0:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, np.array([])
+
+        results = []
+        for chunk_start in range(0, len(queries), QUERY_CHUNK):
+            chunk = slice(chunk_start, chunk_start + QUERY_CHUNK)
+            query_index, points, squared = tree.query_radius(queries[chunk], squared_radius[chunk])
+            if subset is not None:
+                points = subset[points]
+            results.append((query_index + chunk_start, points, chord_to_km(squared)))
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    def describe(self, index, distance):
+        return {
+            'wikidata_id': self.qids[index],
+            'label': self.labels[index],
+            'country': self.countries[index] or None,
+            'population': int(self.population[index]) if self.population[index] >= 0 else None,
+            'distance_km': round(float(distance), 3)
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the registered cities nearest to coordinates.')
+    parser.add_argument('--input', default=CITY_DATA_FILE, help='City table CSV file path')
+    parser.add_argument('--tree', default=TREE_FILE, help='File of the persisted tree')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('build', help='Build and save the tree')
+    for name, help_text in (('nearest', 'Print the nearest cities'), ('within', 'Print the cities within a radius')):
+        query_parser = subparsers.add_parser(name, help=help_text)
+        query_parser.add_argument('lat', type=float)
+        query_parser.add_argument('lon', type=float)
+        query_parser.add_argument('--min-population', type=int, default=None,
+                                  help='Only consider cities with at least this population')
+        query_parser.add_argument('--include-superseded', action='store_true',
+                                  help='Also consider cities superseded by a duplicate')
+        if name == 'nearest':
+            query_parser.add_argument('--k', type=int, default=1, help='Number of cities')
+        else:
+            query_parser.add_argument('--radius', type=float, required=True, help='Radius in km')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.command == 'build':
+        locator = CityLocator.from_csv(args.input)
+        locator.save(args.tree, args.input)
+        print(f"Saved tree of {len(locator.qids)} cities to {args.tree} in {time.time() - start_time:.2f} seconds")
+        return
+
+    locator = CityLocator.load(args.tree, args.input)
+    filters = {'min_population': args.min_population, 'include_superseded': args.include_superseded}
+    if args.command == 'nearest':
+        distances, indices = locator.nearest(args.lat, args.lon, args.k, **filters)
+        matches = [(i, d) for i, d in zip(indices[0], distances[0]) if i >= 0]
+    else:
+        _, indices, distances = locator.within_radius(args.lat, args.lon, args.radius, **filters)
+        matches = list(zip(indices, distances))
+
+    for index, distance in matches:
+        city = locator.describe(index, distance)
+        print(f"{city['wikidata_id']}\t{city['label']}\t{city['country'] or ''}\t{city['distance_km']} km")
+    print(f"Found {len(matches)} cities in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Run the city data refresh as a single pipeline with cached stages.
+
+Each stage declares its input files, output files and parameters. Before a stage runs,
+its inputs (including the stage's own script) and parameters are fingerprinted; the
+stage is skipped if the fingerprint matches the last run and its outputs are unchanged.
+Inputs are fingerprinted by content, so a stage whose upstream output didn't change is
+skipped as well. The Wikidata dump is fingerprinted by path, size and modification time
+instead of content. Stages whose dependencies are done run in parallel.
+
+Run from the project root:
+    python scripts/pipeline.py --dump path/to/latest-all.json.gz --distance 5.0
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_FILE = os.path.join(ROOT, 'scripts/data/pipeline-state.json')
+
+WIKIDATA_CITIES_DIR = 'scripts/wikidata-cities'
+CITIES_DIR = f'{WIKIDATA_CITIES_DIR}/data/cities'
+AUTOCOMPLETE_DIR = 'serverless/autocomplete'
+CITY_DATA_CSV = f'{AUTOCOMPLETE_DIR}/src/city-data.csv'
+BACKFILLED_CSV = f'{AUTOCOMPLETE_DIR}/src/city-data-backfilled.csv'
+DEDUPLICATED_CSV = f'{AUTOCOMPLETE_DIR}/src/city-data-deduplicated.csv'
+
+def define_stages(args):
+    """Declare the pipeline stages with their commands, inputs, outputs and parameters.
+
+    Paths are relative to the project root and may be glob patterns. Inputs listed in
+    'large_inputs' are fingerprinted by path, size and modification time only.
+    """
+    extract_params = {'dump': os.path.abspath(args.dump)}
+    extract_command = [sys.executable, f'{WIKIDATA_CITIES_DIR}/main.py', '--dump', os.path.abspath(args.dump)]
+    extract_inputs = [f'{WIKIDATA_CITIES_DIR}/{name}' for name in
+                      ('main.py', 'extractor.py', 'parser.py', 'city_buffer.py', 'merge.py', 'subclasses.py',
+                       'admin_regions.py', 'names.py', 'dump_reader.py',
+                       'subdump.py', 'ntriples.py')]
+    if args.derive_subclasses:
+        extract_command.append('--derive-subclasses')
+        extract_params['derive_subclasses'] = True
+    else:
+        extract_command += ['--subclasses', args.subclasses]
+        extract_inputs.append(args.subclasses)
+
+    return [
+        {
+            'name': 'extract',
+            'command': extract_command,
+            'inputs': extract_inputs,
+            'large_inputs': [args.dump],
+            'outputs': [f'{CITIES_DIR}/cities_process_*_final.json', f'{CITIES_DIR}/province_lookup.json',
+                        f'{CITIES_DIR}/first_level_regions.json'],
+            'params': extract_params
+        },
+        {
+            'name': 'labels',
+            # province_lookup.json is an output of extract, so the names are filled in by combine instead
+            'command': [sys.executable, f'{WIKIDATA_CITIES_DIR}/labels.py', os.path.abspath(args.dump),
+                        '--skip-province-lookup'],
+            'inputs': [f'{WIKIDATA_CITIES_DIR}/labels.py', f'{WIKIDATA_CITIES_DIR}/merge.py',
+                       f'{WIKIDATA_CITIES_DIR}/admin_regions.py', f'{WIKIDATA_CITIES_DIR}/dump_reader.py',
+                       f'{WIKIDATA_CITIES_DIR}/subdump.py', f'{CITIES_DIR}/cities_process_*_final.json',
+                       f'{CITIES_DIR}/first_level_regions.json'],
+            'large_inputs': [args.dump],
+            'outputs': [f'{CITIES_DIR}/labels.json'],
+            'params': {}
+        },
+        {
+            'name': 'combine',
+            'command': [sys.executable, f'{WIKIDATA_CITIES_DIR}/combine_city_results.py'],
+            'inputs': [f'{WIKIDATA_CITIES_DIR}/combine_city_results.py', f'{WIKIDATA_CITIES_DIR}/merge.py',
+                       f'{WIKIDATA_CITIES_DIR}/labels.py', f'{WIKIDATA_CITIES_DIR}/admin_regions.py',
+                       f'{CITIES_DIR}/cities_process_*_final.json', f'{CITIES_DIR}/province_lookup.json',
+                       f'{CITIES_DIR}/labels.json', f'{CITIES_DIR}/first_level_regions.json'],
+            'outputs': [CITY_DATA_CSV],
+            'params': {}
+        },
+        {
+            'name': 'population',
+            'command': [sys.executable, f'{WIKIDATA_CITIES_DIR}/population.py', 'build'],
+            'inputs': [f'{WIKIDATA_CITIES_DIR}/population.py', f'{WIKIDATA_CITIES_DIR}/merge.py',
+                       f'{CITIES_DIR}/cities_process_*_final.json'],
+            'outputs': [f'{WIKIDATA_CITIES_DIR}/data/population/*'],
+            'params': {}
+        },
+        {
+            'name': 'names',
+            'command': [sys.executable, f'{WIKIDATA_CITIES_DIR}/names.py', 'build'],
+            'inputs': [f'{WIKIDATA_CITIES_DIR}/names.py', f'{WIKIDATA_CITIES_DIR}/merge.py',
+                       f'{CITIES_DIR}/cities_process_*_final.json'],
+            'outputs': [f'{WIKIDATA_CITIES_DIR}/data/names/*'],
+            'params': {}
+        },
+        {
+            'name': 'backfill-countries',
+            # Written to a separate file, as the combined CSV is the output of combine
+            'command': [sys.executable, 'scripts/backfill_countries.py', '--output', BACKFILLED_CSV],
+            'inputs': ['scripts/backfill_countries.py', 'frontend/src/components/countryBorders.json',
+                       f'{AUTOCOMPLETE_DIR}/src/countries.ts', CITY_DATA_CSV],
+            'outputs': [BACKFILLED_CSV, 'scripts/data/country-backfill.csv'],
+            'params': {}
+        },
+        {
+            'name': 'deduplicate',
+            'command': [sys.executable, 'scripts/deduplicate_cities.py', '--input', BACKFILLED_CSV,
+                        '--distance', str(args.distance)],
+            'inputs': ['scripts/deduplicate_cities.py', BACKFILLED_CSV],
+            'outputs': [DEDUPLICATED_CSV],
+            'params': {'distance': args.distance}
+        },
+        {
+            'name': 'nearest-city',
+            'command': [sys.executable, 'scripts/nearest_city.py', 'build'],
+            'inputs': ['scripts/nearest_city.py', DEDUPLICATED_CSV],
+            'outputs': ['scripts/data/city-tree.npz'],
+            'params': {}
+        },
+        {
+            'name': 'city-query',
+            'command': [sys.executable, 'scripts/city_query.py', 'build'],
+            'inputs': ['scripts/city_query.py', 'scripts/dataset_stats.py', DEDUPLICATED_CSV,
+                       f'{CITIES_DIR}/cities_process_*_final.json'],
+            'outputs': ['scripts/data/city-index.npz'],
+            'params': {}
+        },
+        {
+            'name': 'map-tiles',
+            'command': [sys.executable, 'scripts/build_map_tiles.py'],
+            'inputs': ['scripts/build_map_tiles.py', DEDUPLICATED_CSV],
+            'outputs': ['public-data/map-tiles/meta.json', 'public-data/map-tiles/countries.json'],
+            'params': {}
+        },
+        {
+            'name': 'enrich',
+            'command': [sys.executable, 'scripts/enrich_members_data.py'],
+            'inputs': ['scripts/enrich_members_data.py', DEDUPLICATED_CSV, 'scripts/data/countries.csv',
+                       'public-data/city-networks/eurocities/members-wikidata.json'],
+            'outputs': ['public-data/city-networks/eurocities/members-wikidata-enriched.json'],
+            'params': {}
+        },
+        {
+            'name': 'split-by-letter',
+            'command': ['npm', 'run', '--prefix', AUTOCOMPLETE_DIR, 'split-csv-letter'],
+            'inputs': [f'{AUTOCOMPLETE_DIR}/src/split_csv_by_letter.ts', f'{AUTOCOMPLETE_DIR}/src/character-map.ts',
+                       DEDUPLICATED_CSV],
+            'outputs': [f'{AUTOCOMPLETE_DIR}/src/split_by_letter/*.csv'],
+            'params': {}
+        },
+        {
+            'name': 'split-by-qid',
+            'command': ['npm', 'run', '--prefix', AUTOCOMPLETE_DIR, 'split-csv-qid'],
+            'inputs': [f'{AUTOCOMPLETE_DIR}/src/split_csv_by_qid.ts', DEDUPLICATED_CSV],
+            'outputs': [f'{AUTOCOMPLETE_DIR}/src/split_by_qid/*.csv'],
+            'params': {}
+        }
+    ]
+
+def get_dependencies(stages):
+    """A stage depends on every stage that declares one of its inputs as an output."""
+    producers = {}
+    for stage in stages:
+        for pattern in stage['outputs']:
+            producers[pattern] = stage['name']
+    return {
+        stage['name']: {producers[pattern] for pattern in stage['inputs'] if pattern in producers} - {stage['name']}
+        for stage in stages
+    }
+
+def expand(patterns):
+    """Expand glob patterns relative to the project root into a sorted list of paths."""
+    paths = set()
+    for pattern in patterns:
+        paths.update(os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, pattern)))
+    return sorted(paths)
+
+class FileHasher:
+    """Content hashes of files, cached by path, size and modification time across runs."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def hash(self, path):
+        stat = os.stat(os.path.join(ROOT, path))
+        key = f"{stat.st_size}:{stat.st_mtime_ns}"
+        cached = self.cache.get(path)
+        if cached and cached['key'] == key:
+            return cached['hash']
+
+        digest = hashlib.sha256()
+        with open(os.path.join(ROOT, path), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        self.cache[path] = {'key': key, 'hash': digest.hexdigest()}
+        return digest.hexdigest()
+
+def fingerprint(stage, hasher):
+    """Fingerprint a stage from its command, parameters and inputs."""
+    inputs = {path: hasher.hash(path) for path in expand(stage['inputs'])}
+    for path in stage.get('large_inputs', []):
+        stat = os.stat(path)
+        inputs[os.path.abspath(path)] = f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    document = json.dumps({
+        'command': stage['command'][1:],
+        'params': stage['params'],
+        'inputs': inputs
+    }, sort_keys=True)
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+def outputs_valid(stage, stage_state, hasher):
+    """Check that the outputs recorded for a stage still exist unchanged."""
+    recorded = stage_state.get('outputs')
+    if not recorded:
+        return False
+    current = expand(stage['outputs'])
+    if sorted(recorded) != current:
+        return False
+    return all(hasher.hash(path) == recorded[path] for path in current)
+
+def run_stage(stage):
+    """Run a stage's command from the project root. Returns (returncode, seconds)."""
+    start_time = time.time()
+    print(f"[{stage['name']}] Running: {' '.join(stage['command'])}")
+    result = subprocess.run(stage['command'], cwd=ROOT)
+    return result.returncode, time.time() - start_time
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'stages': {}, 'hashes': {}}
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    with open(STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+def run_pipeline(stages, state, force=(), dry_run=False, jobs=None):
+    """Run all stages in dependency order, skipping stages whose outputs are still valid.
+
+    Returns True if all stages succeeded.
+    """
+    dependencies = get_dependencies(stages)
+    stages_by_name = {stage['name']: stage for stage in stages}
+    hasher = FileHasher(state['hashes'])
+    pending = set(stages_by_name)
+    done = set()
+    failed = set()
+    running = {}
+
+    def ready(name):
+        return dependencies[name] <= done
+
+    with ThreadPoolExecutor(max_workers=jobs or len(stages)) as executor:
+        while pending or running:
+            # Stages whose dependencies failed can't run
+            for name in sorted(pending):
+                if dependencies[name] & failed:
+                    print(f"[{name}] Skipped: a dependency failed")
+                    pending.discard(name)
+                    failed.add(name)
+
+            for name in sorted(n for n in pending if ready(n)):
+                pending.discard(name)
+                stage = stages_by_name[name]
+                stage_fingerprint = fingerprint(stage, hasher)
+                stage_state = state['stages'].get(name, {})
+                if (name not in force and stage_state.get('fingerprint') == stage_fingerprint
+                        and outputs_valid(stage, stage_state, hasher)):
+                    print(f"[{name}] Up to date")
+                    done.add(name)
+                elif dry_run:
+                    print(f"[{name}] Would run: {' '.join(stage['command'])}")
+                    done.add(name)
+                else:
+                    running[executor.submit(run_stage, stage)] = (name, stage_fingerprint)
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, stage_fingerprint = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode != 0:
+                    print(f"[{name}] Failed with exit code {returncode} after {seconds:.2f} seconds")
+                    failed.add(name)
+                    continue
+                print(f"[{name}] Completed in {seconds:.2f} seconds")
+                stage = stages_by_name[name]
+                state['stages'][name] = {
+                    'fingerprint': stage_fingerprint,
+                    'outputs': {path: hasher.hash(path) for path in expand(stage['outputs'])}
+                }
+                save_state(state)
+                done.add(name)
+
+    return not failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the city data refresh pipeline.')
+    parser.add_argument('--dump', required=True, help='Path to the Wikidata dump file')
+    parser.add_argument('--subclasses', default=f'{WIKIDATA_CITIES_DIR}/city-subclasses.json',
+                        help='City subclasses JSON file')
+    parser.add_argument('--derive-subclasses', action='store_true',
+                        help='Derive the city subclasses from the dump instead of --subclasses')
+    parser.add_argument('--distance', type=float, default=5.0,
+                        help='Maximum distance in km to consider cities as duplicates')
+    parser.add_argument('--force', nargs='*', default=[], help='Stages to run even if up to date')
+    parser.add_argument('--jobs', type=int, default=None, help='Maximum number of stages to run in parallel')
+    parser.add_argument('--dry-run', action='store_true', help='Only print which stages would run')
+    args = parser.parse_args()
+
+    stages = define_stages(args)
+    unknown = set(args.force) - {stage['name'] for stage in stages}
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    state = load_state()
+    success = run_pipeline(stages, state, set(args.force), args.dry_run, args.jobs)
+    save_state(state)
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Script to resolve free-text city names (e.g. signature lists of joint statements) to Wikidata QIDs.
+
+Builds a character trigram index over the normalized city names of city-data-deduplicated.csv
+and, if the name store of wikidata-cities/names.py has been built, the labels and aliases of
+the cities in other languages. For each input name, the cities sharing the most trigrams are
+retrieved and reranked by:
+1. String similarity of the normalized names
+2. Match with the country hint (e.g. "Mayor of Athens, Greece")
+3. Population
+
+Writes a JSON file with the best match, a confidence score and the runner-up candidates.
+"""
+
+import argparse
+import csv
+import difflib
+import heapq
+import json
+import math
+import os
+import pathlib
+import re
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent / 'wikidata-cities'))
+from names import NameStore
+
+# Country names not in countries.ts
+COUNTRY_ALIASES = {
+    'uk': 'Q145', 'united kingdom': 'Q145', 'england': 'Q145', 'scotland': 'Q145', 'wales': 'Q145',
+    'northern ireland': 'Q145', 'us': 'Q30', 'usa': 'Q30', 'united states': 'Q30',
+    'turkey': 'Q43', 'turkiye': 'Q43', 'russia': 'Q159', 'south korea': 'Q884', 'czech republic': 'Q213'
+}
+
+# Number of candidates retrieved from the index and reranked
+CANDIDATES = 50
+# Trigrams occurring in more names than this are only used if a name has no rarer ones
+MAX_POSTING_LENGTH = 20000
+
+# Weights of the reranking score
+SIMILARITY_WEIGHT = 0.75
+COUNTRY_WEIGHT = 0.15
+POPULATION_WEIGHT = 0.10
+
+def normalize_name(name):
+    """Lowercase, strip accents and punctuation and collapse whitespace."""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c) and unicodedata.category(c) != 'Cf')
+    name = re.sub(r'[^\w]+', ' ', name.lower().replace('ı', 'i'))
+    return ' '.join(name.split())
+
+def trigrams(normalized_name):
+    padded = f"  {normalized_name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def load_country_lookup(countries_file):
+    """Map normalized country names and ISO codes to QIDs using countries.ts."""
+    with open(countries_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    data = json.loads(content[content.index('{'):content.rindex('}') + 1])
+
+    lookup = dict(COUNTRY_ALIASES)
+    for name, alpha2, alpha3, numeric, wikidata_id, *rest in data['countries']:
+        if wikidata_id:
+            for key in (name, alpha2, alpha3):
+                lookup[normalize_name(key)] = wikidata_id
+    return lookup
+
+def resolve_country(country_hint, country_lookup):
+    if not country_hint:
+        return None
+    normalized = normalize_name(country_hint)
+    if normalized.startswith('the '):
+        normalized = normalized[4:]
+    return country_lookup.get(normalized)
+
+class CityNameIndex:
+    """Character trigram inverted index over city names and aliases.
+
+    name_store (a NameStore) adds the labels and aliases of the cities in NAME_LANGUAGES.
+    """
+
+    def __init__(self, city_data_file, name_store=None):
+        self.cities = []
+        self.names = []
+        self.name_city = []
+        self.postings = defaultdict(list)
+
+        with open(city_data_file, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                if row.get('superseded_by'):
+                    continue
+                try:
+                    population = int(float(row['population'])) if row.get('population') else 0
+                except ValueError:
+                    population = 0
+                city_index = len(self.cities)
+                self.cities.append({
+                    'wikidata_id': row['cityWikidataId'],
+                    'label': row['cityLabelEnglish'],
+                    'country': row.get('countryWikidataId') or None,
+                    'population': population
+                })
+
+                names = [row['cityLabelEnglish']]
+                if name_store is not None:
+                    names += name_store.names(row['cityWikidataId'])
+                for normalized in {normalize_name(name) for name in names if name}:
+                    self._add_name(normalized, city_index)
+
+    def _add_name(self, normalized, city_index):
+        name_id = len(self.names)
+        self.names.append(normalized)
+        self.name_city.append(city_index)
+        for gram in trigrams(normalized):
+            self.postings[gram].append(name_id)
+
+    def candidates(self, normalized, limit=CANDIDATES):
+        """Return the IDs of the names sharing the most trigrams with a normalized name."""
+        grams = [gram for gram in trigrams(normalized) if gram in self.postings]
+        if not grams:
+            return []
+        rare_grams = [gram for gram in grams if len(self.postings[gram]) <= MAX_POSTING_LENGTH]
+        counts = defaultdict(int)
+        for gram in rare_grams or grams:
+            for name_id in self.postings[gram]:
+                counts[name_id] += 1
+        return heapq.nlargest(limit, counts, key=counts.__getitem__)
+
+    def resolve(self, name, country_id=None, limit=3):
+        """Return the best matching cities for a name, with scores between 0 and 1."""
+        normalized = normalize_name(name)
+        best_by_city = {}
+        for name_id in self.candidates(normalized):
+            city_index = self.name_city[name_id]
+            city = self.cities[city_index]
+
+            similarity = difflib.SequenceMatcher(None, normalized, self.names[name_id]).ratio()
+            if country_id is None:
+                country_score = 0.5
+            else:
+                country_score = 1.0 if city['country'] == country_id else 0.0
+            population_score = min(math.log10(city['population'] + 1) / 7, 1.0)
+
+            score = (SIMILARITY_WEIGHT * similarity + COUNTRY_WEIGHT * country_score
+                     + POPULATION_WEIGHT * population_score)
+            if score > best_by_city.get(city_index, (-1,))[0]:
+                best_by_city[city_index] = (score, similarity)
+
+        ranked = heapq.nlargest(limit, best_by_city.items(), key=lambda item: item[1][0])
+        return [
+            dict(self.cities[city_index], score=round(score, 3), similarity=round(similarity, 3))
+            for city_index, (score, similarity) in ranked
+        ]
+
+def parse_input(input_file, input_format):
+    """Read (name, country hint) pairs from a signature list.
+
+    Formats:
+    - lines: one city per line, optionally followed by ", country"
+    - pairs: a city line followed by a country line (e.g. members_from_website.txt)
+    - mayor-of: only lines containing "Mayor of <city>[, country]" (e.g. signatures.txt)
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        lines = []
+        for line in f:
+            line = ''.join(c for c in line if unicodedata.category(c) != 'Cf').strip()
+            line = re.sub(r'^(\d+\.|[–-])\s*', '', line)
+            if line and not line.startswith('#'):
+                lines.append(line)
+
+    if input_format == 'pairs':
+        return [(lines[i], lines[i + 1] if i + 1 < len(lines) else None) for i in range(0, len(lines), 2)]
+
+    entries = []
+    for line in lines:
+        if input_format == 'mayor-of':
+            match = re.search(r'Mayor of (.+)$', line, re.IGNORECASE)
+            if not match:
+                continue
+            line = re.split(r'\s+and\s+', match.group(1))[0]
+        parts = [part.strip() for part in line.split(',')]
+        entries.append((parts[0], parts[-1] if len(parts) > 1 else None))
+    return entries
+
+def main():
+    parser = argparse.ArgumentParser(description='Resolve free-text city names to Wikidata QIDs.')
+    parser.add_argument('input', help='Text file with city names')
+    parser.add_argument('--format', choices=['lines', 'pairs', 'mayor-of'], default='lines',
+                        help='Input format (see parse_input)')
+    parser.add_argument('--output', default=None,
+                        help='Output JSON file path (default: <input>.matched.json)')
+    parser.add_argument('--city-data', default='serverless/autocomplete/src/city-data-deduplicated.csv',
+                        help='City table CSV file path')
+    parser.add_argument('--names', default='scripts/wikidata-cities/data/names',
+                        help='Name store with the labels and aliases of the cities (skipped if missing)')
+    parser.add_argument('--countries', default='serverless/autocomplete/src/countries.ts',
+                        help='Countries file used to resolve country hints')
+    parser.add_argument('--candidates', type=int, default=3,
+                        help='Number of candidates to keep per name')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    name_store = None
+    if os.path.isdir(args.names):
+        name_store = NameStore(args.names)
+    else:
+        print(f"No name store in {args.names}, only indexing the English labels")
+    print(f"Building name index from {args.city_data}...")
+    index = CityNameIndex(args.city_data, name_store)
+    if name_store is not None:
+        name_store.close()
+    country_lookup = load_country_lookup(args.countries)
+    print(f"Indexed {len(index.names)} names of {len(index.cities)} cities in {time.time() - start_time:.2f} seconds")
+
+    entries = parse_input(args.input, args.format)
+    start_time = time.time()
+    results = []
+    for name, country_hint in entries:
+        country_id = resolve_country(country_hint, country_lookup)
+        candidates = index.resolve(name, country_id, args.candidates)
+        best = candidates[0] if candidates else None
+        results.append({
+            'input': name,
+            'country_hint': country_hint,
+            'country_hint_id': country_id,
+            'wikidata_id': best['wikidata_id'] if best else None,
+            'label': best['label'] if best else None,
+            'confidence': best['score'] if best else 0.0,
+            'candidates': candidates
+        })
+    print(f"Resolved {len(results)} names in {time.time() - start_time:.2f} seconds")
+
+    output_file = args.output or f"{os.path.splitext(args.input)[0]}.matched.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    low_confidence = sum(1 for result in results if result['confidence'] < 0.8)
+    print(f"Saved matches to {output_file}")
+    print(f"  - {low_confidence} matches with confidence below 0.8 should be checked manually")
+
+if __name__ == "__main__":
+    main()
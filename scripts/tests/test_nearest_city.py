@@ -0,0 +1,52 @@
+"""
+Check CityLocator against a brute-force search on random cities.
+
+Run from the scripts directory with: python -m unittest discover tests
+"""
+
+import sys
+import pathlib
+import unittest
+
+import numpy as np
+
+# Add the parent directory to sys.path to allow imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+from nearest_city import CityLocator, to_unit_vectors, chord_to_km
+
+def random_locator(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    lon = rng.uniform(-180, 180, n)
+    locator = CityLocator(
+        qids=np.array([f"Q{i + 1}" for i in range(n)], dtype=object),
+        labels=np.array([f"City {i + 1}" for i in range(n)], dtype=object),
+        countries=np.array(['Q183'] * n, dtype=object),
+        population=rng.integers(0, 1_000_000, n),
+        superseded=np.zeros(n, dtype=bool),
+        points=to_unit_vectors(lat, lon)
+    )
+    return locator, lat, lon
+
+class NearestCityTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        locator, lat, lon = random_locator(2000)
+        queries = to_unit_vectors([48.1, -33.9, 0.0], [11.6, 151.2, 0.0])
+        distances, indices = locator.nearest([48.1, -33.9, 0.0], [11.6, 151.2, 0.0], k=5)
+        squared = ((queries[:, None, :] - locator.points[None, :, :]) ** 2).sum(axis=2)
+        expected = np.sort(chord_to_km(squared), axis=1)[:, :5]
+        np.testing.assert_allclose(distances, expected)
+        self.assertTrue((indices >= 0).all())
+
+    def test_k_larger_than_filtered_set(self):
+        locator, lat, lon = random_locator(200)
+        min_population = np.sort(locator.population)[-3]
+        distances, indices = locator.nearest(0.0, 0.0, k=5, min_population=min_population)
+        # Only 3 cities pass the filter, the other neighbours are missing
+        self.assertTrue(np.isfinite(distances[0, :3]).all())
+        self.assertTrue((indices[0, :3] >= 0).all())
+        self.assertTrue(np.isinf(distances[0, 3:]).all())
+        self.assertTrue((indices[0, 3:] == -1).all())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+"""
+Resolve the first-level administrative division (state, province, region, ...) of the cities.
+
+The direct located in the administrative territorial entity (P131) value of a city is
+usually a county, district or municipality. During the extraction scan, ParentPointers
+collects the current P131 parent of the cities and the administrative divisions as parallel
+integer arrays of numeric QIDs, with a flag for the first-level divisions. After the scan,
+the chains above the cities' P131 values are walked up to the first-level division with a
+memoized walk and path compression, so each entity is visited once no matter how many
+cities share it.
+
+A node is the first-level division if its P31 type is in FIRST_LEVEL_TYPES, or if its
+parent is a country (or it has no parent). Countries are the P17 values seen in the scan.
+The result is a mapping from P131 value to first-level QID, saved as first_level_regions.json
+and applied to stateProvinceWikidataId by combine_city_results.py.
+
+A city whose P131 value is the country itself (e.g. Berlin Q64, located in Germany Q183)
+has no division between it and the country; the P131 value maps to None and the city gets a
+blank stateProvinceWikidataId.
+"""
+
+import json
+import os
+from array import array
+
+FIRST_LEVEL_REGIONS_FILE = 'first_level_regions.json'
+
+# Types that are first-level divisions regardless of their parent
+FIRST_LEVEL_TYPES = {
+    "Q10864048",  # first-level administrative country subdivision
+    "Q35657",     # state of the United States
+    "Q11828004",  # province of Canada
+    "Q5852411",   # territory of Canada
+    "Q107390",    # territory of the United States
+    "Q48091"      # federal district (for Washington D.C.)
+}
+
+# Types whose P131 parent is kept besides the cities; entities that contain administrative
+# territorial entities (P150) are kept as well, which covers most parents on the chains
+ADMINISTRATIVE_TYPES = FIRST_LEVEL_TYPES | {
+    "Q56061",     # administrative territorial entity
+    "Q13220204",  # second-level administrative country subdivision
+    "Q13221722",  # third-level administrative country subdivision
+    "Q14757767"   # fourth-level administrative country subdivision
+}
+
+# Region of walks that end outside the scanned entities (see ParentPointers.resolve)
+UNRESOLVED = -1
+
+def qid_to_int(qid):
+    return int(qid[1:])
+
+def get_claim_id(claim):
+    value = claim.get('mainsnak', {}).get('datavalue', {}).get('value')
+    return value.get('id') if isinstance(value, dict) else None
+
+def get_current_parent(record):
+    """Return the current P131 value of a record, or None.
+
+    Claims with an end date (P582) are skipped; the first preferred value wins, otherwise
+    the first value.
+    """
+    current = None
+    for claim in record.get('claims', {}).get('P131', []):
+        admin_id = get_claim_id(claim)
+        if not admin_id or 'P582' in claim.get('qualifiers', {}):
+            continue
+        if claim.get('rank') == 'preferred':
+            return admin_id
+        if current is None:
+            current = admin_id
+    return current
+
+class ParentPointers:
+    """P131 parent pointers of the cities and administrative divisions, as parallel arrays.
+
+    child and parent are numeric QIDs; first_level is 1 if a P31 value of the child is in
+    FIRST_LEVEL_TYPES. starts are the P131 values of the cities, which are resolved after
+    the scan.
+    """
+
+    def __init__(self):
+        self.child = array('q')
+        self.parent = array('q')
+        self.first_level = array('b')
+        self.countries = set()
+        self.starts = set()
+
+    def __len__(self):
+        return len(self.child)
+
+    def add(self, record, city_types=()):
+        """Add the current P131 parent of a city (P31 in city_types) or administrative division.
+
+        Other entities with a P131 value (buildings, schools, lakes, ...) are skipped: they are
+        never on the chain of a city and would make up most of the pointers.
+        """
+        entity_id = record.get('id', '')
+        parent_id = get_current_parent(record)
+        if not entity_id.startswith('Q') or not parent_id or not parent_id.startswith('Q'):
+            return
+
+        claims = record['claims']
+        type_ids = {get_claim_id(claim) for claim in claims.get('P31', [])}
+        is_administrative = 'P150' in claims or not type_ids.isdisjoint(ADMINISTRATIVE_TYPES)
+        if not is_administrative and type_ids.isdisjoint(city_types):
+            return
+
+        self.child.append(qid_to_int(entity_id))
+        self.parent.append(qid_to_int(parent_id))
+        self.first_level.append(1 if type_ids & FIRST_LEVEL_TYPES else 0)
+        for claim in claims.get('P17', []):
+            country_id = get_claim_id(claim)
+            if country_id and country_id.startswith('Q'):
+                self.countries.add(qid_to_int(country_id))
+
+    def add_start(self, admin_id):
+        if admin_id and admin_id.startswith('Q'):
+            self.starts.add(qid_to_int(admin_id))
+
+    def extend(self, other):
+        """Add the pointers collected by another worker."""
+        self.child.extend(other.child)
+        self.parent.extend(other.parent)
+        self.first_level.extend(other.first_level)
+        self.countries |= other.countries
+        self.starts |= other.starts
+
+    def resolve(self, known=None):
+        """Return {P131 QID of a city: first-level QID, or None if it is a country}.
+
+        known is a mapping of an earlier full run (see incremental.py): walks end at its P131
+        values and first-level regions. As only part of the dump was scanned then, a walk that
+        reaches an entity without a parent pointer can't be resolved, and its start is left out
+        of the result instead of being resolved to that entity.
+        """
+        # Built once, so each step of a walk is a lookup instead of a scan over the pointers
+        index = {child: i for i, child in enumerate(self.child)}
+        resolved = {}
+        for admin_id, region_id in (known or {}).items():
+            region = qid_to_int(region_id) if region_id else None
+            resolved[qid_to_int(admin_id)] = region
+            if region:
+                resolved[region] = region
+
+        def walk(node):
+            path = []
+            on_path = set()
+            while True:
+                if node in resolved:
+                    region = resolved[node]
+                    break
+                if node in self.countries:
+                    region = None
+                    break
+                i = index.get(node)
+                if i is None and known is not None:
+                    region = UNRESOLVED
+                    break
+                if i is None or self.first_level[i]:
+                    region = node
+                    break
+                parent = self.parent[i]
+                if parent in self.countries or parent in on_path:
+                    # parent in on_path: a P131 cycle, which is cut at this node
+                    region = node
+                    break
+                path.append(node)
+                on_path.add(node)
+                node = parent
+            # Path compression: every node on the walk points to the result directly
+            for visited in path:
+                resolved[visited] = region
+            resolved[node] = region
+            return region
+
+        return {
+            f"Q{start}": (f"Q{region}" if region else None)
+            for start in sorted(self.starts) for region in [walk(start)] if region != UNRESOLVED
+        }
+
+def save_first_level_regions(regions, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, FIRST_LEVEL_REGIONS_FILE)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(regions, f, separators=(',', ':'))
+    return output_file
+
+def load_first_level_regions(input_dir):
+    """Read {P131 QID: first-level QID} written by main.py, or {} if it doesn't exist."""
+    regions_file = os.path.join(input_dir, FIRST_LEVEL_REGIONS_FILE)
+    if not os.path.exists(regions_file):
+        return {}
+    with open(regions_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,181 @@
+import json
+import math
+import os
+from array import array
+
+from parser import RESULT_HEADER
+from merge import merge_runs
+
+# Fields stored as IDs into the per-batch string table (values repeat a lot)
+INTERNED_FIELDS = [
+    "countryWikidataId", "countryDate", "stateProvinceWikidataId", "ancestorType",
+    "classLabel", "populationDate", "mayorWikidataId"
+]
+
+# Sentinel for missing values in integer columns
+MISSING = -1
+
+class CityBuffer:
+    """Column buffer for extracted cities that is flushed to a JSON Lines file in fixed-size batches.
+
+    Instead of keeping one dict per city, fields are stored column-wise: numeric fields in
+    typed arrays, repeated strings as IDs into a string table and list fields as flat arrays
+    with offsets. Everything is cleared on flush, so memory stays constant per worker.
+
+    Each flushed batch is sorted by QID, and finish() merges these sorted runs into the
+    final file, so result files are sorted by numeric QID.
+    """
+
+    def __init__(self, output_file, batch_size=1000):
+        self.output_file = output_file
+        self.batch_size = batch_size
+        self.total = 0
+        self.runs = []
+
+        with open(output_file, 'wb') as f:
+            f.write((json.dumps(RESULT_HEADER, ensure_ascii=False) + '\n').encode('utf-8'))
+
+        self._reset()
+
+    def _reset(self):
+        self.strings = []
+        self.string_ids = {}
+
+        self.qids = array('q')
+        self.labels = []
+        self.websites = []
+        self.population = array('q')
+        self.latitude = array('d')
+        self.longitude = array('d')
+        self.interned = {field: array('l') for field in INTERNED_FIELDS}
+
+        # socialMedia: (platform, handle) pairs, sisterCities: QIDs, each with an offsets array
+        self.social_platforms = array('l')
+        self.social_handles = []
+        self.social_offsets = array('l', [0])
+        self.sister_cities = array('l')
+        self.sister_offsets = array('l', [0])
+
+        # populationHistory: (date ordinal, value) points with an offsets array
+        self.history_dates = array('l')
+        self.history_values = array('q')
+        self.history_offsets = array('l', [0])
+
+        # names: labels and aliases in other languages, as string IDs (often shared between cities)
+        self.names = array('l')
+        self.name_offsets = array('l', [0])
+
+    def __len__(self):
+        return len(self.qids)
+
+    def _intern(self, value):
+        if value is None:
+            return MISSING
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(value)
+            self.string_ids[value] = string_id
+        return string_id
+
+    def _string(self, string_id):
+        return None if string_id == MISSING else self.strings[string_id]
+
+    def append(self, city):
+        """Add a city dict as returned by extract_city_data, flushing if the batch is full."""
+        self.qids.append(int(city["cityWikidataId"][1:]))
+        self.labels.append(city["cityLabelEnglish"])
+        self.websites.append(city["officialWebsite"])
+        self.population.append(MISSING if city["population"] is None else city["population"])
+        self.latitude.append(math.nan if city["latitude"] is None else city["latitude"])
+        self.longitude.append(math.nan if city["longitude"] is None else city["longitude"])
+
+        for field in INTERNED_FIELDS:
+            self.interned[field].append(self._intern(city[field]))
+
+        for platform, handle in (city["socialMedia"] or {}).items():
+            self.social_platforms.append(self._intern(platform))
+            self.social_handles.append(handle)
+        self.social_offsets.append(len(self.social_handles))
+
+        for sister_city_id in city["sisterCities"] or []:
+            self.sister_cities.append(self._intern(sister_city_id))
+        self.sister_offsets.append(len(self.sister_cities))
+
+        for date_ordinal, value in city["populationHistory"] or []:
+            self.history_dates.append(date_ordinal)
+            self.history_values.append(value)
+        self.history_offsets.append(len(self.history_values))
+
+        for name in city.get("names") or []:
+            self.names.append(self._intern(name))
+        self.name_offsets.append(len(self.names))
+
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def rows(self):
+        """Yield the buffered cities as lists in RESULT_HEADER order, sorted by QID."""
+        for i in sorted(range(len(self)), key=self.qids.__getitem__):
+            start, end = self.social_offsets[i], self.social_offsets[i + 1]
+            social_media = {
+                self.strings[self.social_platforms[j]]: self.social_handles[j]
+                for j in range(start, end)
+            }
+            start, end = self.sister_offsets[i], self.sister_offsets[i + 1]
+            sister_cities = [self.strings[j] for j in self.sister_cities[start:end]]
+            start, end = self.history_offsets[i], self.history_offsets[i + 1]
+            population_history = [
+                [self.history_dates[j], self.history_values[j]] for j in range(start, end)
+            ]
+            start, end = self.name_offsets[i], self.name_offsets[i + 1]
+            names = [self.strings[j] for j in self.names[start:end]]
+
+            latitude = self.latitude[i]
+            longitude = self.longitude[i]
+            population = self.population[i]
+            yield [
+                f"Q{self.qids[i]}",
+                self.labels[i],
+                self._string(self.interned["countryWikidataId"][i]),
+                self._string(self.interned["countryDate"][i]),
+                self._string(self.interned["stateProvinceWikidataId"][i]),
+                self._string(self.interned["ancestorType"][i]),
+                self._string(self.interned["classLabel"][i]),
+                None if population == MISSING else population,
+                self._string(self.interned["populationDate"][i]),
+                None if math.isnan(latitude) else latitude,
+                None if math.isnan(longitude) else longitude,
+                self.websites[i],
+                social_media or None,
+                self._string(self.interned["mayorWikidataId"][i]),
+                sister_cities or None,
+                population_history or None,
+                names or None
+            ]
+
+    def flush(self):
+        """Append the buffered cities to the output file and clear the buffer."""
+        if not len(self):
+            return
+        with open(self.output_file, 'ab') as f:
+            self.runs.append((f.tell(), len(self)))
+            for row in self.rows():
+                f.write((json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.total += len(self)
+        self._reset()
+
+    def finish(self, final_file):
+        """Flush and write all cities sorted by QID to final_file (or remove the output if empty).
+
+        Returns the total number of cities.
+        """
+        self.flush()
+        if not self.total:
+            os.remove(self.output_file)
+        elif len(self.runs) == 1:
+            os.replace(self.output_file, final_file)
+        else:
+            merge_runs(self.output_file, self.runs, final_file, RESULT_HEADER)
+            os.remove(self.output_file)
+        return self.total
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Combine the per-process result files into the city CSV used by the autocomplete service.
+
+The cities_process_*_final.json files are each sorted by numeric QID, so they are
+combined with a streaming k-way merge: memory use is constant and the output is
+sorted by QID regardless of how the work was split between the processes.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import pathlib
+
+# Add the parent directory to sys.path to allow imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from merge import iter_rows, merge_sorted
+from labels import fill_province_names
+from admin_regions import load_first_level_regions
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent
+INPUT_DIR = str(SCRIPT_DIR / 'data/cities')
+OUTPUT_FILE = str(SCRIPT_DIR / '../../serverless/autocomplete/src/city-data.csv')
+
+OUTPUT_HEADER = ["cityWikidataId", "cityLabelEnglish", "countryWikidataId", "stateProvinceWikidataId",
+                 "stateProvinceLabel", "population", "populationDate", "latitude", "longitude",
+                 "officialWebsite", "socialMedia"]
+
+def read_province_lookup(input_dir):
+    """Read the province lookup file written by the extractor."""
+    province_lookup_file = os.path.join(input_dir, 'province_lookup.json')
+    if not os.path.exists(province_lookup_file):
+        print(f"Warning: Province lookup file not found at {province_lookup_file}")
+        return {}
+    with open(province_lookup_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def read_label_table(input_dir):
+    """Read the label table written by labels.py, if it exists."""
+    labels_file = os.path.join(input_dir, 'labels.json')
+    if not os.path.exists(labels_file):
+        return {}
+    with open(labels_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def find_result_files(input_dir):
+    """Find all final result files of the extractor processes."""
+    if not os.path.exists(input_dir):
+        return []
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if re.match(r'cities_process_\d+_final\.json$', name)
+    )
+
+def read_header(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.loads(f.readline())
+
+def round_coordinate(value):
+    """Round to 2 decimal places the same way as Math.round in the previous JS implementation."""
+    return math.floor(value * 100 + 0.5) / 100
+
+def format_csv_value(value):
+    """Format and escape a single CSV value."""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    elif isinstance(value, float) and value.is_integer():
+        value = str(int(value))
+    else:
+        value = str(value)
+
+    if ',' in value or '"' in value or '\n' in value:
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def transform_rows(rows, header, province_lookup, regions=None):
+    """Convert result rows (in the extractor's header order) into output rows.
+
+    regions maps the direct P131 values to their first-level division (see admin_regions.py);
+    values that are not in it are kept (incremental.py lists their cities in stale_artifacts.json).
+    """
+    regions = regions or {}
+    index = {field: header.index(field) for field in header}
+    def get(row, field):
+        return row[index[field]] if field in index else None
+
+    for row in rows:
+        latitude = get(row, 'latitude')
+        longitude = get(row, 'longitude')
+        if latitude is not None and longitude is not None:
+            latitude = round_coordinate(latitude)
+            longitude = round_coordinate(longitude)
+
+        state_province_id = get(row, 'stateProvinceWikidataId')
+        state_province_id = regions.get(state_province_id, state_province_id)
+        state_province_label = None
+        if state_province_id and state_province_id in province_lookup:
+            state_province_label = province_lookup[state_province_id]['name']
+
+        yield [
+            get(row, 'cityWikidataId'),
+            get(row, 'cityLabelEnglish'),
+            get(row, 'countryWikidataId'),
+            state_province_id,
+            state_province_label,
+            get(row, 'population'),
+            get(row, 'populationDate'),
+            latitude,
+            longitude,
+            get(row, 'officialWebsite'),
+            get(row, 'socialMedia')
+        ]
+
+def combine(result_files, output_file, province_lookup, regions=None):
+    """Merge the sorted result files into the output CSV. Returns the number of cities."""
+    sources = []
+    for path in result_files:
+        header = read_header(path)
+        if 'cityWikidataId' not in header or 'cityLabelEnglish' not in header or 'countryWikidataId' not in header:
+            print(f"Warning: Required fields missing in {path}, skipping")
+            continue
+        sources.append(transform_rows(iter_rows(path), header, province_lookup, regions))
+
+    count = 0
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        f.write(','.join(OUTPUT_HEADER))
+        for row in merge_sorted(sources):
+            f.write('\n' + ','.join(format_csv_value(value) for value in row))
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine the extractor results into a single CSV file.')
+    parser.add_argument('--input-dir', default=INPUT_DIR,
+                        help='Directory with the cities_process_*_final.json files')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='Output CSV file path')
+    args = parser.parse_args()
+
+    print('Starting to combine city results...')
+    province_lookup = read_province_lookup(args.input_dir)
+    print(f"Loaded province lookup with {len(province_lookup)} provinces")
+    filled = fill_province_names(province_lookup, read_label_table(args.input_dir))
+    if filled:
+        print(f"Filled {filled} province names from labels.json")
+
+    regions = load_first_level_regions(args.input_dir)
+    print(f"Loaded first-level regions of {len(regions)} P131 values")
+
+    result_files = find_result_files(args.input_dir)
+    print(f"Found {len(result_files)} result files")
+    if not result_files:
+        print('No result files found. Make sure the Python script has been run.')
+        sys.exit(1)
+
+    count = combine(result_files, args.output, province_lookup, regions)
+    print(f"Successfully wrote {count} cities to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Input backends for reading the Wikidata dump line by line as bytes.
+
+All backends are opened with open_dump and yield a binary file-like object that supports
+readline() and iteration over lines. Lines stay bytes, so callers can filter them before
+decoding and parsing. The backend is chosen from the file extension by default:
+- .json: uncompressed dump, memory-mapped
+- .gz: piped through pigz if installed, otherwise gzip
+- .zst: zstandard module if installed, otherwise piped through zstd
+- .bz2: piped through lbzip2 or pbzip2 if installed, otherwise bz2 (handles the multistream dump)
+"""
+
+import bz2
+import contextlib
+import gzip
+import io
+import mmap
+import shutil
+import subprocess
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BACKENDS = ['auto', 'mmap', 'gzip', 'pigz', 'zstd', 'bz2']
+
+# Read buffer size of the decompressors and pipes
+BUFFER_SIZE = 4 * 1024 * 1024
+
+# External parallel decompressors, in order of preference
+PARALLEL_DECOMPRESSORS = {
+    'gzip': ['pigz'],
+    'bz2': ['lbzip2', 'pbzip2'],
+    'zstd': ['zstd']
+}
+
+class MappedLines:
+    """Line reader over a memory-mapped file."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._map, 'madvise'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+    def readline(self):
+        return self._map.readline()
+
+    def __iter__(self):
+        return iter(self._map.readline, b'')
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+def get_format(path):
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.bz2'):
+        return 'bz2'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return 'json'
+
+def find_decompressor(format_name):
+    """Return the first installed external decompressor for a format, or None."""
+    for command in PARALLEL_DECOMPRESSORS.get(format_name, []):
+        if shutil.which(command):
+            return command
+    return None
+
+def resolve_backend(path, backend='auto'):
+    """Return (backend, external command or None) used to read a dump file."""
+    format_name = get_format(path)
+    if backend != 'auto':
+        command = 'pigz' if backend == 'pigz' else None
+        if backend == 'zstd' and zstandard is None:
+            command = 'zstd'
+        if command and not shutil.which(command):
+            raise ValueError(f"Backend {backend} needs {command}, which is not installed")
+        return backend, command
+
+    if format_name == 'json':
+        return 'mmap', None
+    if format_name == 'zstd' and zstandard is not None:
+        return 'zstd', None
+    command = find_decompressor(format_name)
+    if command:
+        return ('pigz' if command == 'pigz' else format_name), command
+    return format_name, None
+
+@contextlib.contextmanager
+def _pipe(command, path):
+    process = subprocess.Popen([command, '-dc', path], stdout=subprocess.PIPE, bufsize=BUFFER_SIZE)
+    try:
+        yield process.stdout
+    except BaseException:
+        process.stdout.close()
+        process.terminate()
+        process.wait()
+        raise
+
+    at_end = not process.stdout.read(1)
+    process.stdout.close()
+    if not at_end:
+        # The reader stopped early (e.g. max_lines), so the decompressor can be stopped
+        process.terminate()
+        process.wait()
+        return
+
+    # A truncated or corrupt dump also ends the output, so only the exit code tells it apart
+    process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"{command} failed with exit code {process.returncode} on {path}")
+
+@contextlib.contextmanager
+def open_dump(path, backend='auto'):
+    """Open a dump file for reading lines as bytes with the given (or detected) backend."""
+    backend, command = resolve_backend(path, backend)
+    if command:
+        with _pipe(command, path) as f:
+            yield f
+    elif backend == 'mmap':
+        lines = MappedLines(path)
+        try:
+            yield lines
+        finally:
+            lines.close()
+    elif backend == 'zstd':
+        with open(path, 'rb') as raw:
+            decompressor = zstandard.ZstdDecompressor(max_window_size=2 ** 31)
+            with decompressor.stream_reader(raw, read_size=BUFFER_SIZE) as reader:
+                yield io.BufferedReader(reader, buffer_size=BUFFER_SIZE)
+    elif backend == 'bz2':
+        with bz2.open(path, 'rb') as f:
+            yield io.BufferedReader(f, buffer_size=BUFFER_SIZE)
+    else:
+        with gzip.open(path, 'rb') as f:
+            yield io.BufferedReader(f, buffer_size=BUFFER_SIZE)
+
+def describe_backend(path, backend='auto'):
+    backend, command = resolve_backend(path, backend)
+    return f"{backend} ({command})" if command else backend
@@ -1,14 +1,22 @@
-import gzip
 import json
 import pydash
 import os
+import re
 import datetime
+import queue
+import time
 import sys
 import pathlib
 
 # Add the parent directory to sys.path to allow imports
 sys.path.insert(0, str(pathlib.Path(__file__).parent))
-from parser import parse_wikidata_date, save_results
+from parser import parse_wikidata_date
+from city_buffer import CityBuffer
+from admin_regions import ADMINISTRATIVE_TYPES, ParentPointers, get_current_parent
+from names import extract_names
+from dump_reader import open_dump
+from ntriples import filter_triple, get_predicates, is_ntriples, iter_entities
+from subdump import SubdumpWriter, is_candidate
 
 # State/province extraction added
 
@@ -21,7 +29,13 @@ PROVINCE_TYPES = {
     "Q48091"      # federal district (for Washington D.C.)
 }
 
-# Dictionary to store province IDs (only used in process 0)
+# Item IDs referenced in a raw JSON dump line (the dump has no space after the colon)
+ENTITY_ID_PATTERN = re.compile(rb'"id": ?"(Q\d+)"')
+
+# Seconds between checks of the workers while the reader waits for a free queue slot
+QUEUE_POLL_SECONDS = 5
+
+# Set of province IDs (only collected by processes that collect provinces)
 province_ids = set()
 
 def save_province_data(province_ids, output_dir):
@@ -45,132 +59,264 @@ def save_province_data(province_ids, output_dir):
     
     print(f"Province lookup map saved to {output_file}")
 
-def process_lines(process_id, wikidata_dump_path, city_subclasses, output_dir, skip_lines=0, num_processes=4, max_lines=None):
-    """Process lines from the Wikidata dump file."""
-    print(f"Process {process_id}: Starting processing")
+def process_record(record, city_subclasses, cities, process_id, collect_provinces=False, admin_graph=None):
+    """Match a single entity record and add it to the cities buffer if it is a city.
     
-    cities = []
-    lines_read = 0
-    lines_processed = 0
-    save_interval = 1000
+    With an admin_graph (ParentPointers), the P131 parents of cities and administrative
+    divisions are collected too.
+    """
+    if admin_graph is not None:
+        admin_graph.add(record, city_subclasses)
+    
+    # Check if this entity is a province/state for USA or Canada
+    if collect_provinces:
+        country_id = get_province_country(record)
+        if country_id:
+            entity_id = pydash.get(record, 'id')
+            province_ids.add(entity_id)
+            print(f"Process {process_id}: Found province {entity_id} in {country_id}")
+    
+    best_type = find_best_city_type(record, city_subclasses)
+    if not best_type:
+        return
+    
+    # Skip cities that have been replaced by something else (P1366)
+    replaced_by = get_replaced_by(record)
+    if replaced_by:
+        city_id = pydash.get(record, 'id')
+        city_name = pydash.get(record, 'labels.en.value')
+        print(f"Process {process_id}: Skipping city {city_id} ({city_name}) - replaced by {replaced_by}")
+        return
+    
+    city_data = extract_city_data(record, best_type, collect_provinces)
+    cities.append(city_data)
+    if admin_graph is not None:
+        admin_graph.add_start(city_data["stateProvinceWikidataId"])
+    
+    if len(cities) == 0:
+        print(f"Process {process_id}: Saved {cities.total} cities")
+
+def feed_batches(wikidata_dump_path, batch_queue, num_workers, batch_lines=1000, skip_lines=0, max_lines=None, backend='auto',
+                 check_workers=None):
+    """Read the dump and put batches of raw lines on a queue for the workers to pull.
+    
+    Batches are passed as a single bytes object to keep the queue overhead low. After the
+    last batch, one None per worker signals the end of the input. For an N-Triples dump, only
+    the triples the extractors use are passed on, and batches end between entities.
     
-    try:
-        with gzip.open(wikidata_dump_path, 'rt') as f:
-            f.read(2)  # Skip the first two bytes: "{\n"
+    While the queue is full, check_workers() is called every QUEUE_POLL_SECONDS; it should
+    raise if a worker died, since the reader would otherwise wait for a free slot forever.
+    
+    Returns (lines_read, seconds spent waiting for a free queue slot).
+    """
+    lines_read = 0
+    blocked_time = 0.0
+    batch = []
+    
+    def put(item):
+        nonlocal blocked_time
+        start_time = time.time()
+        while True:
+            try:
+                batch_queue.put(item, timeout=QUEUE_POLL_SECONDS)
+                break
+            except queue.Full:
+                if check_workers is not None:
+                    check_workers()
+        blocked_time += time.time() - start_time
+    
+    predicates = get_predicates() if is_ntriples(wikidata_dump_path) else None
+    last_subject = None
+    
+    with open_dump(wikidata_dump_path, backend) as f:
+        if predicates is None:
+            f.readline()  # Skip the opening "[" line
+        
+        for i in range(skip_lines):
+            f.readline()
+        
+        for line in f:
+            lines_read += 1
+            if max_lines is not None and lines_read >= max_lines:
+                break
             
-            if skip_lines > 0:
-                for i in range(skip_lines):
-                    f.readline()
+            if predicates is None:
+                batch.append(line)
+                if len(batch) >= batch_lines:
+                    put(b''.join(batch))
+                    batch = []
+            else:
+                triple = filter_triple(line, predicates)
+                if triple is not None:
+                    # All triples of an entity go to the same worker
+                    if len(batch) >= batch_lines and triple[0] != last_subject:
+                        put(b''.join(batch))
+                        batch = []
+                    last_subject = triple[0]
+                    batch.append(line)
             
-            while True:
-                line = f.readline()
-                if not line:  # End of file
-                    break
-                
-                lines_read += 1
-                
-                if max_lines is not None and lines_read >= max_lines:
-                    break
-                
-                if lines_read % num_processes != process_id:
-                    continue
-                
-                if lines_read % 1_000_000 == 0:
-                    print(f"Process {process_id}: Read {lines_read:,} lines, processed {lines_processed:,}")
-                
-                try:
-                    record = json.loads(line.rstrip(',\n'))
-                    lines_processed += 1
-                    
-                    # If this is process 0, check if this entity is a province/state for USA or Canada
-                    if process_id == 0 and pydash.has(record, 'claims.P31'):
-                        entity_id = pydash.get(record, 'id')
-                        
-                        # Check if this entity is a province/state
-                        is_province = False
-                        country_id = None
-                        
-                        # Check instance of (P31) claims
-                        for p31 in pydash.get(record, 'claims.P31', []):
-                            entity_type_id = pydash.get(p31, 'mainsnak.datavalue.value.id')
-                            if entity_type_id in PROVINCE_TYPES:
-                                is_province = True
-                                break
-                        
-                        # If it's a province, check which country it belongs to
-                        if is_province and pydash.has(record, 'claims.P17'):
-                            for country_claim in pydash.get(record, 'claims.P17', []):
-                                if pydash.has(country_claim, 'mainsnak.datavalue.value.id'):
-                                    country_id = pydash.get(country_claim, 'mainsnak.datavalue.value.id')
-                                    if country_id in ['Q30', 'Q16']:  # USA or Canada
-                                        # Add to province IDs set
-                                        province_ids.add(entity_id)
-                                        print(f"Process {process_id}: Found province {entity_id} in {country_id}")
-                                        break
-                    
-                    # Process cities
-                    if pydash.has(record, 'claims.P31') and pydash.get(record, 'labels.en.value'):
-                        matching_city_types = []
-                        for p31 in pydash.get(record, 'claims.P31'):
-                            city_type_id = pydash.get(p31, 'mainsnak.datavalue.value.id')
-                            if city_type_id in city_subclasses:
-                                matching_city_types.append({
-                                    'id': city_type_id,
-                                    'ancestor_label': city_subclasses[city_type_id]['ancestorLabel'],
-                                    'subclass_label': city_subclasses[city_type_id]['subclassLabel']
-                                })
-                        
-                        if matching_city_types:
-                            # Sort by specificity (city is most specific)
-                            def get_type_priority(type_info):
-                                label = type_info['ancestor_label'].lower()
-                                if 'city' in label:
-                                    return 0
-                                elif 'municipality' in label:
-                                    return 1
-                                else:
-                                    return 2
-                            
-                            matching_city_types.sort(key=get_type_priority)
-                            best_type = matching_city_types[0]
-                            
-                            # Skip cities that have been replaced by something else (P1366)
-                            if pydash.has(record, 'claims.P1366'):
-                                city_id = pydash.get(record, 'id')
-                                city_name = pydash.get(record, 'labels.en.value')
-                                replaced_by = pydash.get(record, 'claims.P1366[0].mainsnak.datavalue.value.id', 'unknown')
-                                print(f"Process {process_id}: Skipping city {city_id} ({city_name}) - replaced by {replaced_by}")
-                                continue
-                            
-                            city_data = extract_city_data(record, best_type, process_id)
-                            cities.append(city_data)
-                            
-                            if len(cities) % save_interval == 0:
-                                output_file = f"{output_dir}/cities_process_{process_id}_{len(cities)}.json"
-                                save_results(cities, output_file)
-                                print(f"Process {process_id}: Saved {len(cities)} cities")
-                
-                except json.decoder.JSONDecodeError:
-                    continue
+            if lines_read % 1_000_000 == 0:
+                print(f"Reader: Read {lines_read:,} lines")
+    
+    if batch:
+        put(b''.join(batch))
+    for i in range(num_workers):
+        put(None)
     
-    except Exception as e:
-        print(f"Process {process_id}: Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    return lines_read, blocked_time
+
+def process_batches(worker_id, batch_queue, result_queue, city_subclasses, output_dir, subdump_dir=None, ntriples=False):
+    """Worker that pulls batches of dump lines from a queue until it receives None.
+    
+    All workers collect provinces and the P131 parent pointers (see admin_regions.py); they
+    are reported back together with utilization stats on the result queue. With a
+    subdump_dir, the raw lines of candidate entities are also written to a sub-dump shard
+    (see subdump.py). With ntriples, the batches are lines of an N-Triples dump and are
+    grouped into entities (see ntriples.py).
+    """
+    print(f"Process {worker_id}: Starting processing")
+    
+    partial_file = f"{output_dir}/cities_process_{worker_id}_partial.json"
+    cities = CityBuffer(partial_file)
+    subdump = SubdumpWriter(subdump_dir, f"candidates_{worker_id}") if subdump_dir else None
+    admin_graph = ParentPointers()
+    candidate_types = set(city_subclasses) | PROVINCE_TYPES
+    # Lines that can't be a city, province or administrative division are skipped undecoded
+    relevant_ids = {qid.encode('ascii') for qid in candidate_types | ADMINISTRATIVE_TYPES}
+    start_time = time.time()
+    busy_time = 0.0
+    batches = 0
+    lines_processed = 0
     
-    if cities:
-        output_file = f"{output_dir}/cities_process_{process_id}_final.json"
-        save_results(cities, output_file)
-        print(f"Process {process_id}: Completed. Found {len(cities)} cities")
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            break
+        
+        batch_start_time = time.time()
+        lines = batch.split(b'\n')
+        records = iter_entities(lines) if ntriples else parse_json_lines(lines, subdump, candidate_types, relevant_ids)
+        for record in records:
+            lines_processed += 1
+            
+            # Keep pulling batches on errors, otherwise the reader would block on a full queue
+            try:
+                process_record(record, city_subclasses, cities, worker_id, collect_provinces=True,
+                               admin_graph=admin_graph)
+            except Exception as e:
+                print(f"Process {worker_id}: Error: {str(e)}")
+                import traceback
+                traceback.print_exc()
+        
+        busy_time += time.time() - batch_start_time
+        batches += 1
+    
+    cities.finish(f"{output_dir}/cities_process_{worker_id}_final.json")
+    print(f"Process {worker_id}: Completed. Found {cities.total} cities")
+    if subdump:
+        subdump.close()
+    
+    result_queue.put({
+        'worker_id': worker_id,
+        'batches': batches,
+        'lines': lines_processed,
+        'cities': cities.total,
+        'busy_time': busy_time,
+        'wall_time': time.time() - start_time,
+        'subdump_lines': subdump.count if subdump else 0,
+        'province_ids': province_ids,
+        'admin_graph': admin_graph
+    })
+
+def may_be_relevant(line, relevant_ids):
+    """Cheap check on a raw JSON dump line before it is decoded.
+
+    True if the line references any of relevant_ids (a superset of its P31 values) or has a
+    contains administrative territorial entity (P150) claim, which admin_regions.py keeps.
+    """
+    if b'"P150"' in line:
+        return True
+    return not relevant_ids.isdisjoint(ENTITY_ID_PATTERN.findall(line))
+
+def parse_json_lines(lines, subdump=None, candidate_types=(), relevant_ids=None):
+    """Yield the records of JSON dump lines, writing the lines of candidate entities to the sub-dump.
     
-    # If this is process 0, save the province data
-    if process_id == 0 and province_ids:
-        save_province_data(province_ids, output_dir)
-        print(f"Process {process_id}: Saved {len(province_ids)} provinces")
+    With relevant_ids (byte strings of QIDs), lines that fail may_be_relevant are skipped
+    without decoding them.
+    """
+    for line in lines:
+        if relevant_ids is not None and not may_be_relevant(line, relevant_ids):
+            continue
+        try:
+            record = json.loads(line.rstrip(b','))
+        except json.decoder.JSONDecodeError:
+            continue
+        
+        if subdump and is_candidate(record, candidate_types):
+            subdump.write(line)
+        yield record
+
+def get_province_country(record):
+    """Return the country (USA or Canada) of a province/state record, or None if it is not one."""
+    if not pydash.has(record, 'claims.P31'):
+        return None
+    
+    # Check instance of (P31) claims
+    is_province = False
+    for p31 in pydash.get(record, 'claims.P31', []):
+        entity_type_id = pydash.get(p31, 'mainsnak.datavalue.value.id')
+        if entity_type_id in PROVINCE_TYPES:
+            is_province = True
+            break
+    
+    # If it's a province, check which country it belongs to
+    if is_province and pydash.has(record, 'claims.P17'):
+        for country_claim in pydash.get(record, 'claims.P17', []):
+            if pydash.has(country_claim, 'mainsnak.datavalue.value.id'):
+                country_id = pydash.get(country_claim, 'mainsnak.datavalue.value.id')
+                if country_id in ['Q30', 'Q16']:  # USA or Canada
+                    return country_id
     
-    return len(cities)
+    return None
+
+def find_best_city_type(record, city_subclasses):
+    """Return the most specific matching city type of a record, or None if it is not a city."""
+    if not (pydash.has(record, 'claims.P31') and pydash.get(record, 'labels.en.value')):
+        return None
+    
+    matching_city_types = []
+    for p31 in pydash.get(record, 'claims.P31'):
+        city_type_id = pydash.get(p31, 'mainsnak.datavalue.value.id')
+        if city_type_id in city_subclasses:
+            matching_city_types.append({
+                'id': city_type_id,
+                'ancestor_label': city_subclasses[city_type_id]['ancestorLabel'],
+                'subclass_label': city_subclasses[city_type_id]['subclassLabel']
+            })
+    
+    if not matching_city_types:
+        return None
+    
+    # Sort by specificity (city is most specific)
+    def get_type_priority(type_info):
+        label = type_info['ancestor_label'].lower()
+        if 'city' in label:
+            return 0
+        elif 'municipality' in label:
+            return 1
+        else:
+            return 2
+    
+    matching_city_types.sort(key=get_type_priority)
+    return matching_city_types[0]
 
-def extract_city_data(record, best_type, process_id=None):
+def get_replaced_by(record):
+    """Return the ID of the entity that replaced this one (P1366), or None."""
+    if not pydash.has(record, 'claims.P1366'):
+        return None
+    return pydash.get(record, 'claims.P1366[0].mainsnak.datavalue.value.id', 'unknown')
+
+def extract_city_data(record, best_type, collect_provinces=False):
     """Extract city data from a Wikidata record."""
     city_wikidata_id = pydash.get(record, 'id')
     city_label_english = pydash.get(record, 'labels.en.value')
@@ -180,8 +326,10 @@ def extract_city_data(record, best_type, process_id=None):
     # Extract country ID and date
     country_wikidata_id, country_date = extract_country(record)
     
-    # Extract population and date
-    population, population_date = extract_population(record)
+    # Extract population and date, and all dated population values
+    valid_population_data = collect_population_data(record)
+    population, population_date = extract_population(record, valid_population_data)
+    population_history = extract_population_history(record, valid_population_data)
     
     # Extract coordinates
     latitude, longitude = extract_coordinates(record)
@@ -203,7 +351,10 @@ def extract_city_data(record, best_type, process_id=None):
     sister_cities = extract_sister_cities(record)
     
     # Extract state/province
-    state_province_id = extract_state_province(record, country_wikidata_id, process_id)
+    state_province_id = extract_state_province(record, country_wikidata_id, collect_provinces)
+    
+    # Extract labels and aliases in other languages for search
+    names = extract_names(record)
     
     return {
         "cityWikidataId": city_wikidata_id,
@@ -220,17 +371,17 @@ def extract_city_data(record, best_type, process_id=None):
         "officialWebsite": official_website,
         "socialMedia": social_media if social_media else None,
         "mayorWikidataId": mayor_wikidata_id,
-        "sisterCities": sister_cities if sister_cities else None
+        "sisterCities": sister_cities if sister_cities else None,
+        "populationHistory": population_history if population_history else None,
+        "names": names if names else None
     }
 
-def extract_population(record):
-    """Extract population and date from a Wikidata record."""
-    population = None
-    population_date = None
+def collect_population_data(record):
+    """Collect all valid population values of a Wikidata record with their dates, in claim order."""
+    valid_population_data = []
     
     if pydash.has(record, 'claims.P1082'):
         population_claims = pydash.get(record, 'claims.P1082', [])
-        valid_population_data = []
         
         for pop_claim in population_claims:
             if pydash.has(pop_claim, 'mainsnak.datavalue.value.amount'):
@@ -262,19 +413,45 @@ def extract_population(record):
                     })
                 except ValueError:
                     continue
-        
-        if valid_population_data:
-            # Sort by date using parsed datetime objects
-            sorted_data = sorted(
-                valid_population_data,
-                key=lambda x: (x['parsed_date'] is None, x['parsed_date'] or datetime.datetime.min),
-                reverse=True
-            )
-            population = sorted_data[0]['value']
-            population_date = sorted_data[0]['date']
+    
+    return valid_population_data
+
+def extract_population(record, valid_population_data=None):
+    """Extract population and date from a Wikidata record."""
+    population = None
+    population_date = None
+    
+    if valid_population_data is None:
+        valid_population_data = collect_population_data(record)
+    
+    if valid_population_data:
+        # Sort by date using parsed datetime objects
+        sorted_data = sorted(
+            valid_population_data,
+            key=lambda x: (x['parsed_date'] is None, x['parsed_date'] or datetime.datetime.min),
+            reverse=True
+        )
+        population = sorted_data[0]['value']
+        population_date = sorted_data[0]['date']
     
     return population, population_date
 
+def extract_population_history(record, valid_population_data=None):
+    """Extract all valid population values as [date ordinal, value] pairs sorted by date.
+    
+    The date ordinal is datetime.date.toordinal() of the parsed date, or 0 for values
+    without a usable date. Values with equal dates keep their claim order.
+    """
+    if valid_population_data is None:
+        valid_population_data = collect_population_data(record)
+    
+    history = [
+        [x['parsed_date'].toordinal() if x['parsed_date'] else 0, x['value']]
+        for x in valid_population_data
+    ]
+    history.sort(key=lambda point: point[0])
+    return history
+
 def extract_country(record):
     """Extract country and date from a Wikidata record."""
     country_wikidata_id = ''
@@ -575,53 +752,21 @@ def extract_sister_cities(record):
     
     return sister_cities
 
-def extract_state_province(record, country_wikidata_id, process_id=None):
+def extract_state_province(record, country_wikidata_id, collect_provinces=False):
     """Extract state or province information from a Wikidata record.
     
     For cities in the USA (Q30) and Canada (Q16), this is particularly important.
-    For other countries, it's included but not strictly required.
+    For other countries, it's included but not strictly required. This is the direct P131
+    value, which is often a county or district; main.py resolves it to the first-level
+    division (see admin_regions.py).
     
-    If process_id is 0, also collect province labels for the province lookup.
+    If collect_provinces is set, also collect province IDs for the province lookup.
     """
-    state_province_id = None
-    
-    # Located in the administrative territorial entity (P131)
-    if pydash.has(record, 'claims.P131'):
-        admin_claims = pydash.get(record, 'claims.P131', [])
-        valid_admin_entities = []
-        
-        for admin_claim in admin_claims:
-            if pydash.has(admin_claim, 'mainsnak.datavalue.value.id'):
-                admin_id = pydash.get(admin_claim, 'mainsnak.datavalue.value.id')
-                
-                # Check for preferred rank
-                rank = pydash.get(admin_claim, 'rank', 'normal')
-                is_preferred = (rank == 'preferred')
-                
-                # Check if this is a current relationship (no end date)
-                has_end_date = False
-                if pydash.has(admin_claim, 'qualifiers.P582'):  # End date qualifier
-                    has_end_date = True
-                
-                if not has_end_date:  # Only consider current administrative relationships
-                    valid_admin_entities.append({
-                        'id': admin_id,
-                        'is_preferred': is_preferred
-                    })
-        
-        if valid_admin_entities:
-            # First check for preferred rank
-            preferred_entities = [e for e in valid_admin_entities if e['is_preferred']]
-            
-            if preferred_entities:
-                # Just take the first preferred entity
-                state_province_id = preferred_entities[0]['id']
-            else:
-                # Just take the first entity
-                state_province_id = valid_admin_entities[0]['id']
+    # Located in the administrative territorial entity (P131), current and preferred first
+    state_province_id = get_current_parent(record)
     
-    # If this is process 0 and we found a state/province ID for USA or Canada, add it to our collection
-    if process_id == 0 and state_province_id and country_wikidata_id in ['Q30', 'Q16']:
+    # If we found a state/province ID for USA or Canada, add it to our collection
+    if collect_provinces and state_province_id and country_wikidata_id in ['Q30', 'Q16']:
         province_ids.add(state_province_id)
     
     return state_province_id
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Apply a set of changed Wikidata entities to the already extracted city data.
+
+Instead of re-reading the full dump, this takes a directory of changed entity
+documents and upserts or deletes rows in the cities_process_*_final.json files
+by QID, using the same matching logic as process_record. Supported inputs:
+- *.json: a single entity, or a Special:EntityData document ({"entities": {...}})
+- *.json.gz / *.jsonl / *.ndjson: one entity per line, in the same format as the full dump
+
+Entities that no longer match (wrong P31, replaced via P1366, or marked "missing")
+are removed. New P131 values of the cities are resolved to their first-level division
+from the parent pointers of the changed entities and the first_level_regions.json of the
+last full run (see admin_regions.py). Afterwards it reports which downstream artifacts are
+now stale, and which cities need a full run because their P131 value couldn't be resolved.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+import pathlib
+import unicodedata
+
+# Add the parent directory to sys.path to allow imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from parser import load_city_subclasses, load_results, save_results
+from extractor import (
+    extract_city_data, find_best_city_type, get_province_country, get_replaced_by, province_ids
+)
+from admin_regions import ParentPointers, load_first_level_regions, save_first_level_regions
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent
+CITY_SUBCLASSES_PATH = str(SCRIPT_DIR / 'city-subclasses.json')
+OUTPUT_DIR = str(SCRIPT_DIR / 'data/cities')
+
+FINAL_FILE_PATTERN = re.compile(r'cities_process_(\d+)_final\.json$')
+
+def read_entity_file(path):
+    """Yield entity records from a single change file."""
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+        if 'entities' in document:
+            for entity_id, record in document['entities'].items():
+                record.setdefault('id', entity_id)
+                yield record
+        else:
+            yield document
+        return
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if not line or line in ('[', ']'):
+                continue
+            try:
+                yield json.loads(line)
+            except json.decoder.JSONDecodeError:
+                print(f"Skipping malformed line in {path}")
+
+def iter_changes(changes_dir):
+    """Yield entity records from all change files in a directory, in file name order."""
+    patterns = ['*.json', '*.json.gz', '*.jsonl', '*.ndjson']
+    paths = sorted(p for pattern in patterns for p in glob.glob(os.path.join(changes_dir, pattern)))
+    for path in paths:
+        yield from read_entity_file(path)
+
+def load_existing(output_dir):
+    """Load all final per-process result files and index them by QID."""
+    files = {}
+    index = {}
+    for name in sorted(os.listdir(output_dir)):
+        if not FINAL_FILE_PATTERN.match(name):
+            continue
+        path = os.path.join(output_dir, name)
+        files[path] = load_results(path)
+        for i, city in enumerate(files[path]):
+            index[city['cityWikidataId']] = (path, i)
+    return files, index
+
+def apply_changes(records, files, index, city_subclasses, deleted_ids=(), admin_graph=None):
+    """Upsert or delete cities by QID.
+
+    With an admin_graph (ParentPointers), the P131 parents of the changed entities and the
+    P131 values of the changed cities are collected too.
+
+    Returns the list of (old_city, new_city) changes and the set of files that were modified.
+    """
+    changes = []
+    dirty_paths = set()
+
+    def remove(entity_id):
+        if entity_id in index:
+            path, i = index.pop(entity_id)
+            changes.append((files[path][i], None))
+            files[path][i] = None
+            dirty_paths.add(path)
+
+    for entity_id in deleted_ids:
+        remove(entity_id)
+
+    for record in records:
+        entity_id = record.get('id')
+        if not entity_id:
+            continue
+
+        if 'missing' in record:
+            remove(entity_id)
+            continue
+
+        # Keep the province lookup complete for new provinces
+        if get_province_country(record):
+            province_ids.add(entity_id)
+        if admin_graph is not None:
+            admin_graph.add(record, city_subclasses)
+
+        best_type = find_best_city_type(record, city_subclasses)
+        if not best_type or get_replaced_by(record):
+            remove(entity_id)
+            continue
+
+        # The direct P131 values aren't provinces; their first-level regions are added instead
+        city_data = extract_city_data(record, best_type)
+        if admin_graph is not None:
+            admin_graph.add_start(city_data["stateProvinceWikidataId"])
+        if entity_id in index:
+            path, i = index[entity_id]
+            if files[path][i] != city_data:
+                changes.append((files[path][i], city_data))
+                files[path][i] = city_data
+                dirty_paths.add(path)
+        else:
+            # Add new cities to the smallest file to keep the files balanced
+            path = min(files, key=lambda p: len(files[p]))
+            files[path].append(city_data)
+            index[entity_id] = (path, len(files[path]) - 1)
+            changes.append((None, city_data))
+            dirty_paths.add(path)
+
+    return changes, dirty_paths
+
+def get_letter_shard(city_name):
+    """Approximate the split_by_letter shard of a city name (see split_csv_by_letter.ts)."""
+    if not city_name:
+        return None
+    first_letter = unicodedata.normalize('NFKD', city_name[0].upper())[0]
+    return first_letter if 'A' <= first_letter <= 'Z' else '#'
+
+def get_qid_shard(qid):
+    """Return the split_by_qid shard of a QID (see split_csv_by_qid.ts)."""
+    return 'Q' + qid[1:].zfill(2)[:2]
+
+def find_stale_artifacts(changes, regions=None):
+    """Determine which downstream artifacts are affected by a list of changes.
+
+    With regions (see admin_regions.py), the changed cities whose P131 value is not in it are
+    listed as unresolvedRegions; they need a run of main.py on the full dump.
+    """
+    name_groups = set()
+    letter_shards = set()
+    qid_shards = set()
+    unresolved = set()
+
+    for old_city, new_city in changes:
+        for city in (old_city, new_city):
+            if city is None:
+                continue
+            name_groups.add(city['cityLabelEnglish'])
+            letter_shards.add(get_letter_shard(city['cityLabelEnglish']))
+            qid_shards.add(get_qid_shard(city['cityWikidataId']))
+        admin_id = new_city and new_city['stateProvinceWikidataId']
+        if regions is not None and admin_id and admin_id not in regions:
+            unresolved.add(new_city['cityWikidataId'])
+
+    letter_shards.discard(None)
+    return {
+        'combinedCsv': bool(changes),
+        'dedupNameGroups': sorted(name_groups),
+        'letterShards': sorted(f"{shard}.csv" for shard in letter_shards),
+        'qidShards': sorted(f"{shard}.csv" for shard in qid_shards),
+        'unresolvedRegions': sorted(unresolved, key=lambda qid: int(qid[1:])),
+        'fullRunRequired': bool(unresolved)
+    }
+
+def update_province_lookup(output_dir):
+    """Add newly seen provinces to province_lookup.json, keeping existing names."""
+    output_file = f"{output_dir}/province_lookup.json"
+    province_lookup = {}
+    if os.path.exists(output_file):
+        with open(output_file, 'r', encoding='utf-8') as f:
+            province_lookup = json.load(f)
+
+    new_ids = province_ids - set(province_lookup)
+    if not new_ids:
+        return 0
+
+    for province_id in new_ids:
+        province_lookup[province_id] = {"name": ""}
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(province_lookup, f, ensure_ascii=False, indent=2)
+    return len(new_ids)
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply changed Wikidata entities to the extracted city data.')
+    parser.add_argument('changes_dir', help='Directory with changed entity JSON documents')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR,
+                        help='Directory with the cities_process_*_final.json files')
+    parser.add_argument('--subclasses', default=CITY_SUBCLASSES_PATH,
+                        help='City subclasses JSON file')
+    parser.add_argument('--deleted', default=None,
+                        help='Optional text file with one deleted QID per line')
+    args = parser.parse_args()
+
+    city_subclasses = load_city_subclasses(args.subclasses)
+    files, index = load_existing(args.output_dir)
+    if not files:
+        print(f"No cities_process_*_final.json files found in {args.output_dir}. Run main.py first.")
+        sys.exit(1)
+    print(f"Loaded {len(index)} cities from {len(files)} files")
+
+    deleted_ids = []
+    if args.deleted:
+        with open(args.deleted, 'r', encoding='utf-8') as f:
+            deleted_ids = [line.strip() for line in f if line.strip()]
+
+    admin_graph = ParentPointers()
+    changes, dirty_paths = apply_changes(
+        iter_changes(args.changes_dir), files, index, city_subclasses, deleted_ids, admin_graph
+    )
+
+    # Resolve the P131 values the last full run hasn't seen
+    regions = load_first_level_regions(args.output_dir)
+    new_regions = {admin_id: region for admin_id, region in admin_graph.resolve(known=regions).items()
+                   if admin_id not in regions}
+    if new_regions:
+        regions.update(new_regions)
+        save_first_level_regions(regions, args.output_dir)
+    province_ids.update(region for region in new_regions.values() if region)
+
+    for path in sorted(dirty_paths):
+        # Keep the files sorted by numeric QID for combine_city_results.py
+        cities = sorted((city for city in files[path] if city is not None),
+                        key=lambda city: int(city['cityWikidataId'][1:]))
+        save_results(cities, path)
+        print(f"Updated {path}")
+
+    new_provinces = update_province_lookup(args.output_dir)
+
+    added = sum(1 for old_city, new_city in changes if old_city is None)
+    deleted = sum(1 for old_city, new_city in changes if new_city is None)
+    print(f"Incremental update complete:")
+    print(f"  - {added} cities added")
+    print(f"  - {len(changes) - added - deleted} cities updated")
+    print(f"  - {deleted} cities deleted")
+    print(f"  - {new_provinces} new provinces")
+    print(f"  - {len(new_regions)} new first-level regions")
+
+    stale = find_stale_artifacts(changes, regions)
+    stale_file = f"{args.output_dir}/stale_artifacts.json"
+    with open(stale_file, 'w', encoding='utf-8') as f:
+        json.dump(stale, f, ensure_ascii=False, indent=2)
+
+    if stale['combinedCsv']:
+        print("Stale artifacts (re-run combine_city_results.py and the steps after it):")
+        print(f"  - city-data.csv and city-data-deduplicated.csv")
+        print(f"  - {len(stale['dedupNameGroups'])} dedup name groups")
+        print(f"  - split_by_letter: {', '.join(stale['letterShards'])}")
+        print(f"  - split_by_qid: {', '.join(stale['qidShards'])}")
+    else:
+        print("No changes, all downstream artifacts are up to date")
+    if stale['fullRunRequired']:
+        print(f"Warning: the first-level region of {len(stale['unresolvedRegions'])} cities couldn't be resolved "
+              f"from the changes, run main.py on the full dump (see unresolvedRegions)")
+    print(f"Stale artifact report saved to {stale_file}")
+
+if __name__ == "__main__":
+    main()
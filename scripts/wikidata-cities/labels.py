@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Resolve the labels of all entities referenced by the extracted cities in one pass over the dump.
+
+The result files only contain QIDs of countries, provinces, mayors and sister cities. This
+collects the set of referenced QIDs, then scans the dump once: the entity ID is read from
+the raw line and checked against the set, so only referenced entities are decoded and parsed.
+
+Writes labels.json, a table of QID -> {language: label}, to the cities data directory and
+fills the names in province_lookup.json.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import pathlib
+
+# Add the parent directory to sys.path to allow imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from merge import iter_rows
+from admin_regions import load_first_level_regions
+from dump_reader import BACKENDS, open_dump
+from subdump import (SUBDUMP_DIR, SubdumpWriter, finish_references, get_manifest_candidate_types,
+                     get_subdump_manifest, is_candidate, read_manifest, remove_shards)
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent
+INPUT_DIR = str(SCRIPT_DIR / 'data/cities')
+# Languages kept in the label table (None for all)
+LANGUAGES = ['en', 'de', 'fr', 'es', 'it', 'pt', 'nl', 'pl', 'sv', 'el', 'tr', 'uk', 'ru', 'ar', 'zh', 'ja']
+
+# Result fields that contain QIDs of other entities
+REFERENCE_FIELDS = ['countryWikidataId', 'stateProvinceWikidataId', 'mayorWikidataId', 'sisterCities']
+
+# Entity ID at the start of a dump line, e.g. {"type":"item","id":"Q64",...
+ENTITY_ID_PATTERN = re.compile(rb'"id":\s*"([QP]\d+)"')
+
+def collect_referenced_ids(result_files):
+    """Return the set of QIDs referenced by the cities in the result files."""
+    referenced_ids = set()
+    for path in result_files:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        indices = [header.index(field) for field in REFERENCE_FIELDS if field in header]
+
+        for row in iter_rows(path):
+            for index in indices:
+                value = row[index]
+                if isinstance(value, list):
+                    referenced_ids.update(value)
+                elif value:
+                    referenced_ids.add(value)
+    return referenced_ids
+
+def read_labels(record, languages=LANGUAGES):
+    """Return {language: label} of an entity, restricted to the given languages."""
+    labels = record.get('labels', {})
+    if languages is not None:
+        labels = {language: labels[language] for language in languages if language in labels}
+    return {language: label['value'] for language, label in labels.items() if label.get('value')}
+
+def resolve_labels(wikidata_dump_path, entity_ids, languages=LANGUAGES, backend='auto',
+                   subdump=None, candidate_types=()):
+    """Scan the dump once and return {QID: {language: label}} for the given entities.
+
+    With a SubdumpWriter, the raw lines of the entities are also written to the sub-dump,
+    except candidate entities, which the extraction already wrote. The scan stops early
+    once all entities were found.
+    """
+    wanted = {entity_id.encode('ascii') for entity_id in entity_ids}
+    labels = {}
+    lines_read = 0
+
+    with open_dump(wikidata_dump_path, backend) as f:
+        f.readline()  # Skip the opening "[" line
+
+        for line in f:
+            lines_read += 1
+            if lines_read % 1_000_000 == 0:
+                print(f"Label pass: Read {lines_read:,} lines, found {len(labels):,} of {len(wanted):,} entities")
+
+            match = ENTITY_ID_PATTERN.search(line, 0, 200)
+            if not match or match.group(1) not in wanted:
+                continue
+
+            try:
+                record = json.loads(line.rstrip(b',\n'))
+            except json.decoder.JSONDecodeError:
+                continue
+
+            labels[record['id']] = read_labels(record, languages)
+            if subdump and not is_candidate(record, candidate_types):
+                subdump.write(line)
+            if len(labels) == len(wanted):
+                break
+
+    return labels
+
+def fill_province_names(province_lookup, labels):
+    """Fill empty province names with the English (or any) label. Returns the number filled."""
+    filled = 0
+    for province_id, province in province_lookup.items():
+        province_labels = labels.get(province_id)
+        if province_labels and not province.get('name'):
+            province['name'] = province_labels.get('en') or next(iter(province_labels.values()))
+            filled += 1
+    return filled
+
+def update_province_lookup(input_dir, labels):
+    """Fill the names in province_lookup.json. Returns the number filled."""
+    province_lookup_file = os.path.join(input_dir, 'province_lookup.json')
+    if not os.path.exists(province_lookup_file):
+        return 0
+    with open(province_lookup_file, 'r', encoding='utf-8') as f:
+        province_lookup = json.load(f)
+
+    filled = fill_province_names(province_lookup, labels)
+    with open(province_lookup_file, 'w', encoding='utf-8') as f:
+        json.dump(province_lookup, f, indent=2, ensure_ascii=False)
+    return filled
+
+def find_result_files(input_dir):
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if re.match(r'cities_process_\d+_final\.json$', name)
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Resolve the labels of entities referenced by the extracted cities.')
+    parser.add_argument('dump', help='Path to the Wikidata JSON dump (.json, .json.gz, .json.bz2 or .json.zst)')
+    parser.add_argument('--backend', choices=BACKENDS, default='auto', help='Input backend for reading the dump')
+    parser.add_argument('--input-dir', default=INPUT_DIR,
+                        help='Directory with the cities_process_*_final.json files')
+    parser.add_argument('--output', default=None, help='Label table file (default: <input-dir>/labels.json)')
+    parser.add_argument('--languages', default=','.join(LANGUAGES),
+                        help='Comma-separated languages to keep, or "all"')
+    parser.add_argument('--write-subdump', action='store_true',
+                        help=f'Add the referenced entities to the sub-dump in {SUBDUMP_DIR}')
+    parser.add_argument('--skip-province-lookup', action='store_true',
+                        help="Don't fill the names in province_lookup.json")
+    args = parser.parse_args()
+
+    languages = None if args.languages == 'all' else args.languages.split(',')
+    output_file = args.output or os.path.join(args.input_dir, 'labels.json')
+
+    entity_ids = collect_referenced_ids(find_result_files(args.input_dir))
+    # The first-level regions replace stateProvinceWikidataId in the combined CSV
+    entity_ids.update(region for region in load_first_level_regions(args.input_dir).values() if region)
+    print(f"Found {len(entity_ids):,} referenced entities")
+
+    subdump = None
+    candidate_types = ()
+    if args.write_subdump:
+        manifest = read_manifest(SUBDUMP_DIR)
+        if manifest is None or get_subdump_manifest(args.dump) is not None:
+            parser.error('--write-subdump needs the full dump and a sub-dump written by main.py --write-subdump')
+        candidate_types = get_manifest_candidate_types(manifest)
+        remove_shards(SUBDUMP_DIR, 'references')
+        subdump = SubdumpWriter(SUBDUMP_DIR, 'references')
+
+    start_time = time.time()
+    labels = resolve_labels(args.dump, entity_ids, languages, args.backend, subdump, candidate_types)
+    print(f"Resolved labels of {len(labels):,} entities in {time.time() - start_time:.2f} seconds")
+
+    if subdump:
+        subdump.close()
+        subdump_path = finish_references(SUBDUMP_DIR, subdump.count)
+        print(f"Added {subdump.count:,} referenced entities to {subdump_path}")
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(dict(sorted(labels.items(), key=lambda item: int(item[0][1:]))), f,
+                  ensure_ascii=False, separators=(',', ':'))
+    print(f"Saved label table to {output_file}")
+
+    if not args.skip_province_lookup:
+        filled = update_province_lookup(args.input_dir, labels)
+        print(f"Filled {filled} province names in province_lookup.json")
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,244 @@
 #!/usr/bin/env python3
+import argparse
 import os
+import glob
 import time
 import multiprocessing
+import queue
 import sys
 import pathlib
 
 # Add the parent directory to sys.path to allow imports
 sys.path.insert(0, str(pathlib.Path(__file__).parent))
 from parser import load_city_subclasses
-from extractor import process_lines
+from extractor import PROVINCE_TYPES, feed_batches, process_batches, save_province_data
+from subclasses import derive_city_subclasses
+from admin_regions import ParentPointers, load_first_level_regions, save_first_level_regions
+from dump_reader import BACKENDS, describe_backend
+from ntriples import is_ntriples
+from subdump import SUBDUMP_DIR, SUBDUMP_FILE, check_subdump, finish_candidates, get_subdump_manifest, remove_shards, zstandard
 
 # Configuration
 SCRIPT_DIR = pathlib.Path(__file__).parent
 WIKIDATA_DUMP_PATH = '/Users/c/Desktop/project/data_20221022/wikidata/latest-all.json.gz'
 CITY_SUBCLASSES_PATH = str(SCRIPT_DIR / 'city-subclasses.json')
 OUTPUT_DIR = str(SCRIPT_DIR / 'data/cities')
+# Derive the city subclasses from the dump (cached per dump file) instead of city-subclasses.json
+DERIVE_CITY_SUBCLASSES = False
+# Input backend for the dump ('auto' picks one from the file extension, see dump_reader.py)
+DUMP_BACKEND = 'auto'
+# Also write the candidate entities to a zstd sub-dump for faster re-extraction (see subdump.py)
+WRITE_SUBDUMP = False
+# Number of worker processes (None to size the pool from available cores and memory)
+NUM_PROCESSES = None
+# Number of dump lines per batch handed out to the workers
+BATCH_LINES = 1000
+# Seconds to wait for a worker's result before checking whether it is still alive
+RESULT_POLL_SECONDS = 5
+# Estimated peak memory of one worker, used to avoid swapping on small machines
+WORKER_MEMORY_BYTES = 512 * 1024 * 1024
+
+def get_available_memory():
+    """Return the available physical memory in bytes, or None if it can't be determined."""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def get_num_workers():
+    """Size the worker pool from available cores and memory.
+
+    One core is left for the reader, which decompresses the dump and hands out batches.
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    num_workers = max(1, cores - 1)
+
+    available_memory = get_available_memory()
+    if available_memory is not None:
+        num_workers = min(num_workers, max(1, available_memory // WORKER_MEMORY_BYTES))
+
+    return num_workers
+
+def check_workers(processes):
+    """Raise if a worker exited with an error, e.g. an uncaught exception or the OOM killer."""
+    for i, p in enumerate(processes):
+        if p.exitcode is not None and p.exitcode != 0:
+            raise RuntimeError(f"Process {i} (PID {p.pid}) exited with code {p.exitcode}")
+
+def collect_stats(processes, result_queue):
+    """Collect one stats dict per worker from the result queue.
+
+    Raises if a worker exits without reporting, instead of waiting for its result forever.
+    """
+    stats = []
+    while len(stats) < len(processes):
+        try:
+            stats.append(result_queue.get(timeout=RESULT_POLL_SECONDS))
+            continue
+        except queue.Empty:
+            pass
+        check_workers(processes)
+        reported = {s['worker_id'] for s in stats}
+        missing = [i for i, p in enumerate(processes) if i not in reported and not p.is_alive()]
+        if missing:
+            # A worker puts its result before exiting, so it may still be on its way
+            try:
+                stats.append(result_queue.get(timeout=RESULT_POLL_SECONDS))
+            except queue.Empty:
+                raise RuntimeError(f"Process {missing[0]} exited without reporting its results")
+    return stats
+
+def print_utilization(stats, total_time, reader_blocked_time):
+    """Print per-worker utilization collected from the workers."""
+    print("Worker utilization:")
+    for s in sorted(stats, key=lambda s: s['worker_id']):
+        utilization = s['busy_time'] / s['wall_time'] if s['wall_time'] else 0
+        print(f"  - Process {s['worker_id']}: {s['batches']:,} batches, {s['lines']:,} lines, "
+              f"{s['cities']:,} cities, busy {s['busy_time']:.2f}s ({utilization:.0%})")
+    # If the reader rarely waits for a free queue slot, reading/decompression is the bottleneck
+    print(f"  - Reader: blocked on full queue for {reader_blocked_time:.2f}s of {total_time:.2f}s")
 
 def main():
     """Extract cities and municipalities from Wikidata dump."""
+    parser = argparse.ArgumentParser(description='Extract cities and municipalities from the Wikidata dump.')
+    parser.add_argument('--dump', default=WIKIDATA_DUMP_PATH,
+                        help='Path to the Wikidata dump file (JSON, or truthy N-Triples with a .nt extension)')
+    parser.add_argument('--subclasses', default=CITY_SUBCLASSES_PATH, help='City subclasses JSON file')
+    parser.add_argument('--derive-subclasses', action='store_true', default=DERIVE_CITY_SUBCLASSES,
+                        help='Derive the city subclasses from the dump instead of --subclasses')
+    parser.add_argument('--backend', choices=BACKENDS, default=DUMP_BACKEND, help='Input backend for reading the dump')
+    parser.add_argument('--write-subdump', action='store_true', default=WRITE_SUBDUMP,
+                        help=f'Write the candidate entities to {SUBDUMP_DIR}/{SUBDUMP_FILE}')
+    args = parser.parse_args()
+
     # Ensure output directory exists
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
+
+    # Fail before starting the workers if the backend can't be used
+    try:
+        print(f"Reading {args.dump} with backend {describe_backend(args.dump, args.backend)}")
+    except ValueError as e:
+        parser.error(str(e))
+
     # Number of processes to use
-    num_processes = 8
-    
+    num_processes = NUM_PROCESSES or get_num_workers()
+
     # Number of lines to skip at the beginning
     skip_lines = 0
-    
+
     # Maximum number of lines to process (None for no limit)
     max_lines = None
-    
+
+    # Deriving the subclasses and writing a sub-dump are only supported for the JSON dump
+    ntriples = is_ntriples(args.dump)
+    if ntriples and args.derive_subclasses:
+        parser.error('--derive-subclasses needs the JSON dump, not an N-Triples dump')
+    if ntriples and args.write_subdump:
+        parser.error('--write-subdump needs the JSON dump, not an N-Triples dump')
+
     # Load city and municipality subclasses
-    city_subclasses = load_city_subclasses(CITY_SUBCLASSES_PATH)
-    
+    city_subclasses_path = args.subclasses
+    if args.derive_subclasses:
+        city_subclasses_path = derive_city_subclasses(args.dump, backend=args.backend)
+    city_subclasses = load_city_subclasses(city_subclasses_path)
+
+    # A sub-dump only contains the entities of the subclass set it was built with
+    try:
+        check_subdump(args.dump, city_subclasses)
+    except ValueError as e:
+        parser.error(str(e))
+    subdump_dir = None
+    if args.write_subdump:
+        if get_subdump_manifest(args.dump) is not None:
+            parser.error('--write-subdump needs the full dump, not a sub-dump')
+        if zstandard is None:
+            parser.error('--write-subdump requires the zstandard package')
+        subdump_dir = SUBDUMP_DIR
+        remove_shards(subdump_dir, '')
+
+    # Remove results of previous runs, which may have used a different number of processes
+    for old_file in glob.glob(f"{OUTPUT_DIR}/cities_process_*.json"):
+        os.remove(old_file)
+
     # Start timing
     start_time = time.time()
-    
+
+    # Workers pull batches of lines from a bounded queue, so idle workers take the next batch
+    batch_queue = multiprocessing.Queue(maxsize=num_processes * 4)
+    result_queue = multiprocessing.Queue()
+
     # Create and start processes
     processes = []
-    
+
     for i in range(num_processes):
         p = multiprocessing.Process(
-            target=process_lines,
-            args=(i, WIKIDATA_DUMP_PATH, city_subclasses, OUTPUT_DIR, skip_lines, num_processes, max_lines)
+            target=process_batches,
+            args=(i, batch_queue, result_queue, city_subclasses, OUTPUT_DIR, subdump_dir, ntriples)
         )
         processes.append(p)
         p.start()
         print(f"Started process {i} (PID {p.pid})")
-    
+
+    try:
+        lines_read, reader_blocked_time = feed_batches(
+            args.dump, batch_queue, num_processes, BATCH_LINES, skip_lines, max_lines, args.backend,
+            check_workers=lambda: check_workers(processes)
+        )
+        print(f"Reader: Finished after {lines_read:,} lines")
+
+        # Collect the results before joining, so the workers can flush the result queue
+        stats = collect_stats(processes, result_queue)
+    except RuntimeError as e:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+        sys.exit(f"Extraction failed: {e}")
+
     # Wait for all processes to complete
     for p in processes:
         p.join()
-    
+
+    province_ids = set()
+    admin_graph = ParentPointers()
+    for s in stats:
+        province_ids |= s['province_ids']
+        admin_graph.extend(s.pop('admin_graph'))
+
+    # A sub-dump lacks most administrative entities, so keep the regions of the full dump run
+    if get_subdump_manifest(args.dump) is None:
+        regions_start_time = time.time()
+        regions = admin_graph.resolve()
+        regions_file = save_first_level_regions(regions, OUTPUT_DIR)
+        province_ids |= {region for region in regions.values() if region}
+        print(f"Resolved first-level regions of {len(regions):,} P131 values from {len(admin_graph):,} "
+              f"parent pointers in {time.time() - regions_start_time:.2f} seconds, saved to {regions_file}")
+    else:
+        province_ids |= {region for region in load_first_level_regions(OUTPUT_DIR).values() if region}
+    del admin_graph
+
+    if province_ids:
+        save_province_data(province_ids, OUTPUT_DIR)
+        print(f"Saved {len(province_ids)} provinces")
+
+    if subdump_dir:
+        candidate_count = sum(s['subdump_lines'] for s in stats)
+        subdump_path = finish_candidates(subdump_dir, args.dump, city_subclasses, PROVINCE_TYPES, candidate_count)
+        print(f"Saved {candidate_count:,} candidate entities to {subdump_path}")
+
     # End timing
     end_time = time.time()
     print(f"All processes completed in {end_time - start_time:.2f} seconds")
+    print_utilization(stats, end_time - start_time, reader_blocked_time)
     print(f"Results saved to {OUTPUT_DIR}/cities_process_*_final.json")
 
 if __name__ == "__main__":
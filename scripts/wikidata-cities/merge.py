@@ -0,0 +1,71 @@
+import heapq
+import json
+import os
+
+# Maximum number of sorted runs merged at once (one open file per run)
+MAX_FAN_IN = 64
+
+def qid_key(row):
+    """Sort key of a result row: the numeric part of its QID (first column)."""
+    return int(row[0][1:])
+
+def iter_rows(path, offset=None, count=None):
+    """Yield the rows of a JSON Lines result file.
+
+    Without an offset the header line is skipped and all rows are read, otherwise
+    count rows are read starting at the given byte offset.
+    """
+    with open(path, 'rb') as f:
+        if offset is None:
+            f.readline()
+        else:
+            f.seek(offset)
+        read = 0
+        for line in f:
+            if count is not None and read >= count:
+                break
+            if not line.strip():
+                continue
+            read += 1
+            yield json.loads(line)
+
+def merge_sorted(iterables):
+    """Streaming k-way merge of row iterables that are each sorted by QID."""
+    return heapq.merge(*iterables, key=qid_key)
+
+def write_rows(f, rows):
+    """Write rows as JSON Lines to a binary file and return the number of rows written."""
+    written = 0
+    for row in rows:
+        f.write((json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8'))
+        written += 1
+    return written
+
+def merge_runs(path, runs, output_file, header):
+    """Merge sorted runs of a JSON Lines file into a single sorted file.
+
+    runs is a list of (byte offset, row count) pairs in path. If there are more than
+    MAX_FAN_IN runs, groups of runs are merged into intermediate files first.
+    """
+    sources = [(path, offset, count) for offset, count in runs]
+    merge_pass = 0
+    while len(sources) > MAX_FAN_IN:
+        intermediate_file = f"{output_file}.merge{merge_pass}"
+        merged_sources = []
+        with open(intermediate_file, 'wb') as f:
+            for i in range(0, len(sources), MAX_FAN_IN):
+                group = sources[i:i + MAX_FAN_IN]
+                offset = f.tell()
+                count = write_rows(f, merge_sorted(iter_rows(*source) for source in group))
+                merged_sources.append((intermediate_file, offset, count))
+        for previous_file in {source[0] for source in sources} - {path}:
+            os.remove(previous_file)
+        sources = merged_sources
+        merge_pass += 1
+
+    with open(output_file, 'wb') as f:
+        f.write((json.dumps(header, ensure_ascii=False) + '\n').encode('utf-8'))
+        write_rows(f, merge_sorted(iter_rows(*source) for source in sources))
+
+    for previous_file in {source[0] for source in sources} - {path}:
+        os.remove(previous_file)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Multilingual names of all cities, in a compact store with a folded prefix index for search.
+
+The extractor keeps the labels and aliases of a city in NAME_LANGUAGES (without duplicates and
+the English label, which is cityLabelEnglish) as names in the per-process result files. This
+builds a store from them:
+- strings.bin: UTF-8 bytes of every distinct name, each stored once however many cities use it
+- string_offsets.bin: start of each name in strings.bin, plus the total size (int64)
+- qids.bin: numeric QIDs of the cities, sorted (int64)
+- offsets.bin: start of each city's names in name_ids.bin, plus the total (int32)
+- name_ids.bin: name index of each name of a city, the English label first (int32)
+- keys.bin, key_offsets.bin: distinct folded names (see fold_name), sorted by their UTF-8 bytes
+- posting_offsets.bin: start of each key's cities in postings.bin, plus the total (int32)
+- postings.bin: city index of each (key, city) pair, in QID order per key (int32)
+
+A prefix lookup is a binary search in the sorted keys followed by a scan over the keys that
+start with the prefix. The files are memory-mapped when loaded.
+
+Usage:
+    python names.py build
+    python names.py search München Köln 北京
+    python names.py show Q64 Q1055
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import os
+import re
+import sys
+import pathlib
+import unicodedata
+from array import array
+
+# Add the parent directory to sys.path to allow imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from merge import iter_rows, merge_sorted
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent
+INPUT_DIR = str(SCRIPT_DIR / 'data/cities')
+OUTPUT_DIR = str(SCRIPT_DIR / 'data/names')
+# Languages of the labels and aliases kept as names (None for all)
+NAME_LANGUAGES = ['en', 'de', 'fr', 'es', 'it', 'pt', 'nl', 'pl', 'sv', 'el', 'tr', 'uk', 'ru', 'ar', 'zh', 'ja']
+
+# Integer column files and their array type codes
+COLUMNS = {
+    'string_offsets': 'q',
+    'qids': 'q',
+    'offsets': 'i',
+    'name_ids': 'i',
+    'key_offsets': 'q',
+    'posting_offsets': 'i',
+    'postings': 'i'
+}
+# Byte files, indexed by string_offsets and key_offsets
+BLOBS = ['strings', 'keys']
+
+# Letters without a decomposition, folded like character-map.ts of the autocomplete service
+FOLD_TABLE = str.maketrans({
+    'ł': 'l', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'þ': 'th', 'æ': 'ae', 'œ': 'oe', 'ı': 'i', 'ħ': 'h'
+})
+# Combining diacritical marks (accents on Latin, Greek and Cyrillic letters). Marks of other
+# scripts, e.g. the Japanese voicing mark, change the letter and are kept.
+DIACRITICS_PATTERN = re.compile('[\u0300-\u036f]')
+
+def fold_name(name):
+    """Fold a name for prefix search: case, accents, compatibility forms and whitespace.
+
+    "München" and "MUNCHEN" both fold to "munchen"; names in other scripts (e.g. "北京")
+    only lose compatibility forms such as full-width letters.
+    """
+    folded = unicodedata.normalize('NFKD', name.casefold().translate(FOLD_TABLE))
+    folded = unicodedata.normalize('NFC', DIACRITICS_PATTERN.sub('', folded))
+    return ' '.join(folded.split())
+
+def extract_names(record, languages=NAME_LANGUAGES):
+    """Return the labels and then the aliases of a record in the given languages.
+
+    Names are kept once, in language order, and the English label is left out.
+    """
+    labels = record.get('labels', {})
+    aliases = record.get('aliases', {})
+    if languages is None:
+        languages = sorted(set(labels) | set(aliases))
+
+    seen = {labels.get('en', {}).get('value')}
+    names = []
+    def add(name):
+        if name and name not in seen:
+            seen.add(name)
+            names.append(name)
+
+    for language in languages:
+        add(labels.get(language, {}).get('value'))
+    for language in languages:
+        for alias in aliases.get(language, []):
+            add(alias.get('value'))
+    return names
+
+def iter_city_names(result_files):
+    """Yield (numeric QID, English label, names) of all cities, sorted by QID."""
+    sources = []
+    for path in result_files:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        if 'names' not in header:
+            print(f"Warning: No names in {path}, re-run the extraction")
+            continue
+        names_index = header.index('names')
+        sources.append(([row[0], row[1], row[names_index]] for row in iter_rows(path)))
+
+    for qid, label, names in merge_sorted(sources):
+        yield int(qid[1:]), label, names or []
+
+def build_name_store(result_files, output_dir):
+    """Write the name store from the per-process result files.
+
+    Returns a dict of counts and sizes, which is also saved as meta.json.
+    """
+    columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+    string_ids = {}
+    strings = []
+    key_ids = {}
+    keys = []
+    # Folded key of each name, so every distinct name is folded once
+    string_keys = array('i')
+    # (key, city) pairs, sorted by key below
+    pair_keys = array('i')
+    pair_cities = array('i')
+    english_bytes = 0
+
+    for qid, label, names in iter_city_names(result_files):
+        city = len(columns['qids'])
+        columns['qids'].append(qid)
+        columns['offsets'].append(len(columns['name_ids']))
+        if label:
+            english_bytes += len(label.encode('utf-8'))
+
+        city_keys = set()
+        for name in ([label] if label else []) + names:
+            string_id = string_ids.get(name)
+            if string_id is None:
+                string_id = string_ids[name] = len(strings)
+                strings.append(name.encode('utf-8'))
+                key = fold_name(name)
+                key_id = key_ids.get(key)
+                if key_id is None:
+                    key_id = key_ids[key] = len(keys)
+                    keys.append(key.encode('utf-8'))
+                string_keys.append(key_id)
+            columns['name_ids'].append(string_id)
+
+            key_id = string_keys[string_id]
+            if key_id not in city_keys:
+                city_keys.add(key_id)
+                pair_keys.append(key_id)
+                pair_cities.append(city)
+    columns['offsets'].append(len(columns['name_ids']))
+    del string_ids, key_ids, string_keys
+
+    # Sort the keys and group the (key, city) pairs by key with a counting sort, which keeps
+    # the cities of a key in QID order
+    key_order = sorted(range(len(keys)), key=keys.__getitem__)
+    key_rank = array('i', [0]) * len(keys)
+    for rank, key_id in enumerate(key_order):
+        key_rank[key_id] = rank
+    posting_offsets = array('i', [0]) * (len(keys) + 1)
+    for key_id in pair_keys:
+        posting_offsets[key_rank[key_id] + 1] += 1
+    for i in range(len(keys)):
+        posting_offsets[i + 1] += posting_offsets[i]
+    postings = array('i', [0]) * len(pair_cities)
+    fill = array('i', posting_offsets[:-1])
+    for key_id, city in zip(pair_keys, pair_cities):
+        rank = key_rank[key_id]
+        postings[fill[rank]] = city
+        fill[rank] += 1
+    columns['posting_offsets'] = posting_offsets
+    columns['postings'] = postings
+    del pair_keys, pair_cities, fill
+
+    os.makedirs(output_dir, exist_ok=True)
+    blobs = {'strings': strings, 'keys': [keys[key_id] for key_id in key_order]}
+    offset_columns = {'strings': 'string_offsets', 'keys': 'key_offsets'}
+    for blob_name, values in blobs.items():
+        offsets = columns[offset_columns[blob_name]]
+        position = 0
+        with open(os.path.join(output_dir, f"{blob_name}.bin"), 'wb') as f:
+            for value in values:
+                offsets.append(position)
+                f.write(value)
+                position += len(value)
+        offsets.append(position)
+
+    for name, column in columns.items():
+        with open(os.path.join(output_dir, f"{name}.bin"), 'wb') as f:
+            column.tofile(f)
+
+    meta = {
+        'cities': len(columns['qids']),
+        'names': len(columns['name_ids']),
+        'distinctNames': len(strings),
+        'keys': len(keys),
+        'postings': len(postings),
+        'englishLabelBytes': english_bytes,
+        'storeBytes': sum(os.path.getsize(os.path.join(output_dir, f"{name}.bin")) for name in list(COLUMNS) + BLOBS),
+        'languages': NAME_LANGUAGES,
+        'columns': COLUMNS
+    }
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    return meta
+
+class BlobStrings:
+    """Sequence view of the byte strings in a blob file, so bisect works on it directly."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+class NameStore:
+    """Read-only access to a name store written by build_name_store."""
+
+    def __init__(self, store_dir=OUTPUT_DIR):
+        self._mmaps = []
+        self.columns = {}
+        for name, typecode in list(COLUMNS.items()) + [(blob_name, 'B') for blob_name in BLOBS]:
+            path = os.path.join(store_dir, f"{name}.bin")
+            if os.path.getsize(path) == 0:
+                self.columns[name] = array(typecode)
+                continue
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmaps.append(mapped)
+            self.columns[name] = memoryview(mapped).cast(typecode)
+
+        self.qids = self.columns['qids']
+        self.offsets = self.columns['offsets']
+        self.name_ids = self.columns['name_ids']
+        self.postings = self.columns['postings']
+        self.posting_offsets = self.columns['posting_offsets']
+        self.strings = BlobStrings(self.columns['strings'], self.columns['string_offsets'])
+        self.keys = BlobStrings(self.columns['keys'], self.columns['key_offsets'])
+
+    def __len__(self):
+        return len(self.qids)
+
+    def index_of(self, qid):
+        """Return the city index of a QID, or None if it is not in the store."""
+        qid_number = int(qid[1:]) if isinstance(qid, str) else qid
+        i = bisect.bisect_left(self.qids, qid_number)
+        if i < len(self.qids) and self.qids[i] == qid_number:
+            return i
+        return None
+
+    def names(self, qid):
+        """Return the names of a city, the English label first."""
+        i = self.index_of(qid)
+        if i is None:
+            return []
+        return [self.strings[j].decode('utf-8') for j in self.name_ids[self.offsets[i]:self.offsets[i + 1]]]
+
+    def search(self, query, limit=None):
+        """Return the QIDs of cities with a name starting with the query (after folding).
+
+        Cities with an exact match come first, then by matching name and QID.
+        """
+        prefix = fold_name(query).encode('utf-8')
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        i = bisect.bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            for city in self.postings[self.posting_offsets[i]:self.posting_offsets[i + 1]]:
+                if city not in seen:
+                    seen.add(city)
+                    results.append(f"Q{self.qids[city]}")
+                    if limit is not None and len(results) >= limit:
+                        return results
+            i += 1
+        return results
+
+    def close(self):
+        for name in list(self.columns):
+            if isinstance(self.columns[name], memoryview):
+                self.columns[name].release()
+        self.qids = self.offsets = self.name_ids = self.postings = self.posting_offsets = None
+        self.strings = self.keys = None
+        self.columns = {}
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps = []
+
+def find_result_files(input_dir):
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if re.match(r'cities_process_\d+_final\.json$', name)
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the multilingual name store.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build the store from the extractor results')
+    build_parser.add_argument('--input-dir', default=INPUT_DIR,
+                              help='Directory with the cities_process_*_final.json files')
+    build_parser.add_argument('--output-dir', default=OUTPUT_DIR, help='Directory for the store')
+
+    search_parser = subparsers.add_parser('search', help='Print the cities with a name starting with each query')
+    search_parser.add_argument('queries', nargs='+', help='Name prefixes in any language')
+    search_parser.add_argument('--limit', type=int, default=10, help='Maximum number of cities per query')
+    search_parser.add_argument('--store-dir', default=OUTPUT_DIR, help='Directory of the store')
+
+    show_parser = subparsers.add_parser('show', help='Print the names of cities')
+    show_parser.add_argument('qids', nargs='+', help='City QIDs')
+    show_parser.add_argument('--store-dir', default=OUTPUT_DIR, help='Directory of the store')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        meta = build_name_store(find_result_files(args.input_dir), args.output_dir)
+        print(f"Saved {meta['names']} names ({meta['distinctNames']} distinct, {meta['keys']} search keys) "
+              f"of {meta['cities']} cities to {args.output_dir}")
+        print(f"Store size: {meta['storeBytes']:,} bytes, English labels alone: {meta['englishLabelBytes']:,} bytes")
+        return
+
+    store = NameStore(args.store_dir)
+    if args.command == 'search':
+        for query in args.queries:
+            print(f"{query}:")
+            for qid in store.search(query, args.limit):
+                print(f"  {qid}: {' | '.join(store.names(qid))}")
+    else:
+        for qid in args.qids:
+            print(f"{qid}: {' | '.join(store.names(qid))}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
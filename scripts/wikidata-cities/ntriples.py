@@ -0,0 +1,153 @@
+"""
+Reader for the truthy N-Triples dump (latest-truthy.nt.gz / .nt.bz2) as an alternative input.
+
+The truthy dump has one triple per line and only the best-rank statements of each entity
+(wdt: properties), without qualifiers, references or sitelinks. Lines are filtered by their
+predicate before anything is decoded: only labels and aliases in NAME_LANGUAGES and the
+direct properties in PROPERTIES are kept. The triples of an entity are consecutive, so they
+are grouped by subject and turned into records with the same shape as the JSON dump
+(id, labels.<lang>.value, aliases.<lang>[].value, claims.<P>[].mainsnak.datavalue.value), and
+the extractors work unchanged.
+
+Without qualifiers there are no dates: populationDate and countryDate are always null, the
+populationHistory points are undated, the first of several best-rank values is used, and
+mayors can't be filtered by end date. tests/test_ntriples.py checks that the other fields
+match the JSON dump.
+"""
+
+import re
+
+from names import NAME_LANGUAGES
+
+# Direct properties read by the extractors
+PROPERTIES = [
+    'P31',    # instance of
+    'P17',    # country
+    'P131',   # located in the administrative territorial entity
+    'P150',   # contains the administrative territorial entity
+    'P1082',  # population
+    'P625',   # coordinate location
+    'P856',   # official website
+    'P6',     # head of government
+    'P1308',  # officeholder
+    'P190',   # twinned administrative body
+    'P1366',  # replaced by
+    'P2002', 'P2013', 'P2003', 'P2397', 'P4264', 'P8605', 'P4033', 'P7085', 'P10566'  # social media
+]
+# Languages of the labels and aliases that are kept (None for all)
+LABEL_LANGUAGES = None if NAME_LANGUAGES is None else {language.encode('ascii') for language in NAME_LANGUAGES}
+
+ENTITY_IRI = b'<http://www.wikidata.org/entity/'
+DIRECT_PROPERTY_IRI = b'<http://www.wikidata.org/prop/direct/'
+LABEL_PREDICATE = b'<http://www.w3.org/2000/01/rdf-schema#label>'
+ALIAS_PREDICATE = b'<http://www.w3.org/2004/02/skos/core#altLabel>'
+DECIMAL_TYPE = b'^^<http://www.w3.org/2001/XMLSchema#decimal>'
+WKT_TYPE = b'^^<http://www.opengis.net/ont/geosparql#wktLiteral>'
+
+ESCAPE_PATTERN = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ESCAPES = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+POINT_PATTERN = re.compile(r'Point\(\s*(\S+)\s+(\S+)\s*\)')
+
+def is_ntriples(path):
+    """Check if a dump file is in N-Triples format (.nt, optionally compressed)."""
+    for extension in ('.gz', '.bz2', '.zst'):
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+    return path.endswith('.nt')
+
+def get_predicates(properties=PROPERTIES):
+    return {DIRECT_PROPERTY_IRI + p.encode('ascii') + b'>' for p in properties} | {LABEL_PREDICATE, ALIAS_PREDICATE}
+
+def get_language(term):
+    """Return the language tag of a literal term (e.g. b'de' of b'"Köln"@de'), or None."""
+    end = term.rfind(b'"@')
+    return term[end + 2:] if end > 0 else None
+
+def filter_triple(line, predicates):
+    """Return (subject, predicate, object term) of a line to keep, or None.
+
+    Only looks at the raw bytes, so the lines that are dropped are never decoded.
+    """
+    parts = line.split(b' ', 2)
+    if len(parts) < 3 or parts[1] not in predicates or not parts[0].startswith(ENTITY_IRI):
+        return None
+    term = parts[2].rstrip(b' .\r\n')
+    if parts[1] in (LABEL_PREDICATE, ALIAS_PREDICATE):
+        language = get_language(term)
+        if language is None or (LABEL_LANGUAGES is not None and language not in LABEL_LANGUAGES):
+            return None
+    return parts[0], parts[1], term
+
+def unescape(text):
+    if '\\' not in text:
+        return text
+    def replace(match):
+        if match.group(3) is not None:
+            return ESCAPES.get(match.group(3), match.group(3))
+        return chr(int(match.group(1) or match.group(2), 16))
+    return ESCAPE_PATTERN.sub(replace, text)
+
+def parse_term(term):
+    """Convert an object term to the datavalue value of the JSON dump, or None (e.g. unknown values)."""
+    if term.startswith(ENTITY_IRI):
+        return {'id': term[len(ENTITY_IRI):-1].decode('ascii')}
+    if term.startswith(b'<'):
+        # Other IRIs are URL values (e.g. official website)
+        return unescape(term[1:-1].decode('utf-8'))
+    if not term.startswith(b'"'):
+        return None
+
+    end = term.rindex(b'"')
+    text = unescape(term[1:end].decode('utf-8'))
+    suffix = term[end + 1:]
+    if suffix == DECIMAL_TYPE:
+        return {'amount': text if text[:1] in ('+', '-') else '+' + text}
+    if suffix == WKT_TYPE:
+        # Coordinates on other globes are prefixed with the globe IRI
+        match = POINT_PATTERN.fullmatch(text)
+        if not match:
+            return None
+        return {'latitude': float(match.group(2)), 'longitude': float(match.group(1))}
+    return text
+
+def build_record(subject, triples):
+    """Build a JSON dump style record from the (predicate, term) pairs of an entity."""
+    record = {'id': subject[len(ENTITY_IRI):-1].decode('ascii'), 'labels': {}, 'aliases': {}, 'claims': {}}
+    for predicate, term in triples:
+        try:
+            value = parse_term(term)
+        except (ValueError, UnicodeDecodeError):
+            continue
+        if value is None:
+            continue
+        if predicate in (LABEL_PREDICATE, ALIAS_PREDICATE):
+            language = get_language(term).decode('ascii')
+            if predicate == LABEL_PREDICATE:
+                record['labels'][language] = {'language': language, 'value': value}
+            else:
+                record['aliases'].setdefault(language, []).append({'language': language, 'value': value})
+            continue
+        property_id = predicate[len(DIRECT_PROPERTY_IRI):-1].decode('ascii')
+        record['claims'].setdefault(property_id, []).append({
+            'mainsnak': {'snaktype': 'value', 'property': property_id, 'datavalue': {'value': value}},
+            'rank': 'normal'
+        })
+    return record
+
+def iter_entities(lines, properties=PROPERTIES):
+    """Yield a record per entity from N-Triples lines (bytes), keeping only the given properties."""
+    predicates = get_predicates(properties)
+    subject = None
+    triples = []
+    for line in lines:
+        triple = filter_triple(line, predicates)
+        if triple is None:
+            continue
+        if triple[0] != subject:
+            if triples:
+                yield build_record(subject, triples)
+            subject = triple[0]
+            triples = []
+        triples.append(triple[1:])
+    if triples:
+        yield build_record(subject, triples)
@@ -2,6 +2,13 @@ import re
 import datetime
 from dateutil import parser as date_parser
 
+# Column order of the per-process result files
+RESULT_HEADER = ["cityWikidataId", "cityLabelEnglish", "countryWikidataId", "countryDate",
+                 "stateProvinceWikidataId", "ancestorType",
+                 "classLabel", "population", "populationDate", "latitude", "longitude",
+                 "officialWebsite", "socialMedia", "mayorWikidataId", "sisterCities",
+                 "populationHistory", "names"]
+
 def parse_wikidata_date(time_str):
     """Parse a Wikidata time string into a normalized date format."""
     if not time_str:
@@ -85,13 +92,8 @@ def save_results(cities, filename):
     """Save the extracted cities to a JSON file with each record on a single line."""
     import json
     
-    header = ["cityWikidataId", "cityLabelEnglish", "countryWikidataId", "countryDate", 
-              "stateProvinceWikidataId", "ancestorType",
-              "classLabel", "population", "populationDate", "latitude", "longitude",
-              "officialWebsite", "socialMedia", "mayorWikidataId", "sisterCities"]
-    
     with open(filename, 'w', encoding='utf-8') as f:
-        f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        f.write(json.dumps(RESULT_HEADER, ensure_ascii=False) + '\n')
         
         for city in cities:
             city_record = [
@@ -109,6 +111,22 @@ def save_results(cities, filename):
                 city["officialWebsite"],
                 city["socialMedia"],
                 city["mayorWikidataId"],
-                city["sisterCities"]
+                city["sisterCities"],
+                city.get("populationHistory"),
+                city.get("names")
             ]
             f.write(json.dumps(city_record, ensure_ascii=False) + '\n')
+
+def load_results(filename):
+    """Load cities saved by save_results back into a list of dicts."""
+    import json
+    
+    cities = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        for line in f:
+            if not line.strip():
+                continue
+            cities.append(dict(zip(header, json.loads(line))))
+    
+    return cities
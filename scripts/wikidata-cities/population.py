@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Columnar store of the historical population values of all cities.
+
+The extractor keeps every valid population value (P1082) of a city as populationHistory
+in the per-process result files. This builds a compact store from them:
+- qids.bin: numeric QIDs of the cities, sorted (int64)
+- offsets.bin: start of each city's points, plus the total number of points (int64)
+- cities.bin: city index of each point (int32)
+- dates.bin: date ordinal of each point, 0 if it has no usable date (int32)
+- values.bin: population value of each point (int64)
+
+Points of a city are sorted by date. The files are memory-mapped when loaded, so
+lookups don't need to read the whole store.
+
+Usage:
+    python population.py build
+    python population.py check
+    python population.py show Q64 Q1055
+"""
+
+import argparse
+import bisect
+import datetime
+import json
+import mmap
+import os
+import re
+import sys
+import pathlib
+from array import array
+
+# Add the parent directory to sys.path to allow imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+from merge import iter_rows, merge_sorted
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent
+INPUT_DIR = str(SCRIPT_DIR / 'data/cities')
+OUTPUT_DIR = str(SCRIPT_DIR / 'data/population')
+
+# Column files and their array type codes
+COLUMNS = {
+    'qids': 'q',
+    'offsets': 'q',
+    'cities': 'i',
+    'dates': 'i',
+    'values': 'q'
+}
+
+# Number of points written at once while building
+WRITE_BATCH_SIZE = 100_000
+
+def date_from_ordinal(date_ordinal):
+    return datetime.date.fromordinal(date_ordinal) if date_ordinal else None
+
+def iter_population_histories(result_files):
+    """Yield (numeric QID, populationHistory) of all cities, sorted by QID."""
+    sources = []
+    for path in result_files:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        if 'populationHistory' not in header:
+            print(f"Warning: No populationHistory in {path}, re-run the extraction")
+            continue
+        history_index = header.index('populationHistory')
+        sources.append(([row[0], row[history_index]] for row in iter_rows(path)))
+
+    for qid, history in merge_sorted(sources):
+        yield int(qid[1:]), history or []
+
+def build_population_store(result_files, output_dir):
+    """Write the columnar population store from the per-process result files.
+
+    The input is merged by QID and written in batches, so memory use stays constant.
+    Returns (number of cities, number of points).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    files = {name: open(os.path.join(output_dir, f"{name}.bin"), 'wb') for name in COLUMNS}
+    buffers = {name: array(typecode) for name, typecode in COLUMNS.items()}
+
+    def write_buffers():
+        for name, buffer in buffers.items():
+            buffer.tofile(files[name])
+            del buffer[:]
+
+    city_count = 0
+    point_count = 0
+    try:
+        for qid, history in iter_population_histories(result_files):
+            buffers['qids'].append(qid)
+            buffers['offsets'].append(point_count)
+            for date_ordinal, value in history:
+                buffers['cities'].append(city_count)
+                buffers['dates'].append(date_ordinal)
+                buffers['values'].append(value)
+            point_count += len(history)
+            city_count += 1
+
+            if len(buffers['values']) >= WRITE_BATCH_SIZE:
+                write_buffers()
+
+        buffers['offsets'].append(point_count)
+        write_buffers()
+    finally:
+        for f in files.values():
+            f.close()
+
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'cities': city_count, 'points': point_count, 'columns': COLUMNS}, f, indent=2)
+
+    return city_count, point_count
+
+class PopulationStore:
+    """Read-only access to a population store written by build_population_store."""
+
+    def __init__(self, store_dir=OUTPUT_DIR):
+        self._mmaps = []
+        self.columns = {}
+        for name, typecode in COLUMNS.items():
+            path = os.path.join(store_dir, f"{name}.bin")
+            if os.path.getsize(path) == 0:
+                self.columns[name] = array(typecode)
+                continue
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmaps.append(mapped)
+            self.columns[name] = memoryview(mapped).cast(typecode)
+
+        self.qids = self.columns['qids']
+        self.offsets = self.columns['offsets']
+        self.cities = self.columns['cities']
+        self.dates = self.columns['dates']
+        self.values = self.columns['values']
+
+    def __len__(self):
+        return len(self.qids)
+
+    def index_of(self, qid):
+        """Return the city index of a QID, or None if it is not in the store."""
+        qid_number = int(qid[1:]) if isinstance(qid, str) else qid
+        i = bisect.bisect_left(self.qids, qid_number)
+        if i < len(self.qids) and self.qids[i] == qid_number:
+            return i
+        return None
+
+    def _series(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return [(date_from_ordinal(self.dates[j]), self.values[j]) for j in range(start, end)]
+
+    def series(self, qid):
+        """Return the (date, population) points of a city sorted by date (date is None if unknown)."""
+        i = self.index_of(qid)
+        return [] if i is None else self._series(i)
+
+    def series_many(self, qids):
+        """Return a dict of QID -> points for several cities, looked up in QID order."""
+        result = {}
+        for qid in sorted(qids, key=lambda q: int(q[1:])):
+            result[qid] = self.series(qid)
+        return result
+
+    def _latest(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if start == end:
+            return None, None
+        # Same order as extract_population: points without a date come first and win, otherwise
+        # the latest value is the first of the points with the highest date
+        if self.dates[start] == 0:
+            return None, self.values[start]
+        j = end - 1
+        while j > start and self.dates[j - 1] == self.dates[j]:
+            j -= 1
+        return date_from_ordinal(self.dates[j]), self.values[j]
+
+    def latest(self, qid):
+        """Return the (date, population) of the most recent value of a city, as in the city table."""
+        i = self.index_of(qid)
+        return (None, None) if i is None else self._latest(i)
+
+    def iter_latest(self):
+        """Yield (QID, date, population) of the most recent value of every city with a population."""
+        for i in range(len(self.qids)):
+            date, value = self._latest(i)
+            if value is not None:
+                yield f"Q{self.qids[i]}", date, value
+
+    def close(self):
+        for name in list(self.columns):
+            if isinstance(self.columns[name], memoryview):
+                self.columns[name].release()
+        self.qids = self.offsets = self.cities = self.dates = self.values = None
+        self.columns = {}
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps = []
+
+def check_latest(store, result_files):
+    """Compare iter_latest() with the population column of the result files.
+
+    Returns a list of (QID, population column, latest value of the store) that differ.
+    """
+    sources = []
+    for path in result_files:
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        population_index = header.index('population')
+        sources.append(([row[0], row[population_index]] for row in iter_rows(path)))
+    expected = {qid: population for qid, population in merge_sorted(sources) if population is not None}
+
+    mismatches = []
+    for qid, date, value in store.iter_latest():
+        population = expected.pop(qid, None)
+        if population != value:
+            mismatches.append((qid, population, value))
+    mismatches.extend((qid, population, None) for qid, population in expected.items())
+    return mismatches
+
+def find_result_files(input_dir):
+    return sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if re.match(r'cities_process_\d+_final\.json$', name)
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the historical population store.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build the store from the extractor results')
+    build_parser.add_argument('--input-dir', default=INPUT_DIR,
+                              help='Directory with the cities_process_*_final.json files')
+    build_parser.add_argument('--output-dir', default=OUTPUT_DIR, help='Directory for the store')
+
+    check_parser = subparsers.add_parser('check', help='Check that the latest values match the population column')
+    check_parser.add_argument('--input-dir', default=INPUT_DIR,
+                              help='Directory with the cities_process_*_final.json files')
+    check_parser.add_argument('--store-dir', default=OUTPUT_DIR, help='Directory of the store')
+
+    show_parser = subparsers.add_parser('show', help='Print the population history of cities')
+    show_parser.add_argument('qids', nargs='+', help='City QIDs')
+    show_parser.add_argument('--store-dir', default=OUTPUT_DIR, help='Directory of the store')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        city_count, point_count = build_population_store(find_result_files(args.input_dir), args.output_dir)
+        print(f"Saved {point_count} population values of {city_count} cities to {args.output_dir}")
+    elif args.command == 'check':
+        store = PopulationStore(args.store_dir)
+        mismatches = check_latest(store, find_result_files(args.input_dir))
+        store.close()
+        for qid, population, value in mismatches[:20]:
+            print(f"  {qid}: population column {population}, latest value {value}")
+        if mismatches:
+            print(f"{len(mismatches)} cities differ from the population column")
+            sys.exit(1)
+        print("The latest values match the population column")
+    else:
+        store = PopulationStore(args.store_dir)
+        for qid, points in store.series_many(args.qids).items():
+            print(f"{qid}:")
+            for date, value in points:
+                print(f"  {date.isoformat() if date else 'unknown'}: {value:,}")
+        store.close()
+
+if __name__ == "__main__":
+    main()
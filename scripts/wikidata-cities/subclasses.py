@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Derive the city subclass hierarchy from the Wikidata dump itself.
+
+This replaces the SPARQL export in city-subclasses.json: a first pass over the dump
+collects only the subclass of (P279) edges and English labels of class items, computes
+the transitive closure below the ancestor classes and caches the result keyed by the
+dump file. The cache has the same format as city-subclasses.json, so it can be loaded
+with load_city_subclasses.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import time
+from array import array
+
+from dump_reader import BACKENDS, open_dump
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent
+CACHE_DIR = str(SCRIPT_DIR / 'data/subclasses')
+# Maximum subclass depth below the ancestors, same as in city-subclasses.sparql (0 for no limit)
+MAX_DEPTH = 3
+
+# Ancestor classes, same as in city-subclasses.sparql
+ANCESTOR_CLASSES = {
+    "Q515": "city",
+    "Q15284": "municipality",
+    "Q7930989": "city or town",
+    "Q3299260": "local government area"
+}
+
+def qid_to_int(qid):
+    return int(qid[1:])
+
+def collect_subclass_edges(wikidata_dump_path, backend='auto'):
+    """Collect P279 edges and English labels of class items from the dump.
+
+    Lines are checked for the raw bytes of "P279" before they are decoded and parsed,
+    so most entities are skipped without any JSON parsing.
+
+    Returns (child, parent, labels) where child and parent are parallel integer arrays
+    of numeric QIDs and labels maps numeric QIDs to English labels.
+    """
+    child = array('q')
+    parent = array('q')
+    labels = {}
+    lines_read = 0
+
+    with open_dump(wikidata_dump_path, backend) as f:
+        f.readline()  # Skip the opening "[" line
+
+        for line in f:
+            lines_read += 1
+            if lines_read % 1_000_000 == 0:
+                print(f"Subclass pass: Read {lines_read:,} lines, found {len(child):,} edges")
+
+            if b'"P279"' not in line:
+                continue
+
+            try:
+                record = json.loads(line.rstrip(b',\n'))
+            except json.decoder.JSONDecodeError:
+                continue
+
+            entity_id = record.get('id', '')
+            if not entity_id.startswith('Q'):
+                continue
+            entity_number = qid_to_int(entity_id)
+
+            for claim in record.get('claims', {}).get('P279', []):
+                value = claim.get('mainsnak', {}).get('datavalue', {}).get('value', {})
+                parent_id = value.get('id') if isinstance(value, dict) else None
+                if parent_id and parent_id.startswith('Q'):
+                    child.append(entity_number)
+                    parent.append(qid_to_int(parent_id))
+
+            label = record.get('labels', {}).get('en', {}).get('value')
+            if label:
+                labels[entity_number] = label
+
+    return child, parent, labels
+
+def compute_closure(child, parent, roots, max_depth=None):
+    """Compute all transitive subclasses of each root class.
+
+    The edges are converted to dense node indices and a compressed children adjacency
+    (offsets + targets), then each root is expanded with a breadth-first search.
+
+    Like the SPARQL query, the roots themselves are not included, only classes below them;
+    a root that is a subclass of another root (city is a subclass of city or town) is
+    included under that root.
+
+    Returns a dict mapping each root to an array of numeric QIDs.
+    """
+    # Dense node indices
+    node_index = {}
+    nodes = array('q')
+    def get_index(qid_number):
+        index = node_index.get(qid_number)
+        if index is None:
+            index = len(nodes)
+            node_index[qid_number] = index
+            nodes.append(qid_number)
+        return index
+
+    dense_child = array('l', (get_index(c) for c in child))
+    dense_parent = array('l', (get_index(p) for p in parent))
+    root_indices = {root: get_index(root) for root in roots}
+
+    # Children adjacency via counting sort by parent
+    offsets = array('l', [0]) * (len(nodes) + 1)
+    for p in dense_parent:
+        offsets[p + 1] += 1
+    for i in range(len(nodes)):
+        offsets[i + 1] += offsets[i]
+    children = array('l', [0]) * len(dense_child)
+    fill = array('l', offsets[:-1])
+    for c, p in zip(dense_child, dense_parent):
+        children[fill[p]] = c
+        fill[p] += 1
+
+    closure = {}
+    for root, root_index in root_indices.items():
+        visited = bytearray(len(nodes))
+        visited[root_index] = 1
+        frontier = [root_index]
+        members = array('q')
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            next_frontier = []
+            for node in frontier:
+                for c in children[offsets[node]:offsets[node + 1]]:
+                    if not visited[c]:
+                        visited[c] = 1
+                        next_frontier.append(c)
+                        members.append(nodes[c])
+            frontier = next_frontier
+            depth += 1
+        closure[root] = members
+
+    return closure
+
+def get_cache_path(wikidata_dump_path, cache_dir=CACHE_DIR, max_depth=MAX_DEPTH):
+    """Return the cache file for a dump, keyed by its path, size and modification time."""
+    stat = os.stat(wikidata_dump_path)
+    key = f"{os.path.abspath(wikidata_dump_path)}:{stat.st_size}:{stat.st_mtime_ns}:{max_depth}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, f"city-subclasses-{digest}.json")
+
+def derive_city_subclasses(wikidata_dump_path, cache_dir=CACHE_DIR, max_depth=MAX_DEPTH, backend='auto'):
+    """Build (or reuse) the cached city subclasses file for a dump and return its path."""
+    cache_path = get_cache_path(wikidata_dump_path, cache_dir, max_depth)
+    if os.path.exists(cache_path):
+        print(f"Using cached city subclasses from {cache_path}")
+        return cache_path
+
+    start_time = time.time()
+    child, parent, labels = collect_subclass_edges(wikidata_dump_path, backend)
+    print(f"Collected {len(child):,} subclass edges in {time.time() - start_time:.2f} seconds")
+
+    roots = [qid_to_int(qid) for qid in ANCESTOR_CLASSES]
+    for ancestor_id, ancestor_label in ANCESTOR_CLASSES.items():
+        labels.setdefault(qid_to_int(ancestor_id), ancestor_label)
+    closure = compute_closure(child, parent, roots, max_depth or None)
+
+    # An ancestor class only has a row if it is in the closure of another ancestor class
+    # (city is a subclass of city or town), like in the SPARQL export
+    rows = []
+    for ancestor_id, ancestor_label in ANCESTOR_CLASSES.items():
+        for subclass_number in closure[qid_to_int(ancestor_id)]:
+            subclass_id = f"Q{subclass_number}"
+            rows.append({
+                "citySubclassId": subclass_id,
+                "citySubclassLabel": labels.get(subclass_number, subclass_id),
+                "ancestorClassId": ancestor_id,
+                "ancestorClassLabel": ancestor_label
+            })
+
+    # Same order as the SPARQL export, which determines the ancestor of classes with several
+    rows.sort(key=lambda row: (row["ancestorClassLabel"], row["citySubclassLabel"]))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+
+    print(f"Saved {len(rows)} city subclasses to {cache_path}")
+    return cache_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Derive the city subclass hierarchy from the Wikidata dump.')
+    parser.add_argument('dump', help='Path to the Wikidata JSON dump (.json, .json.gz, .json.bz2 or .json.zst)')
+    parser.add_argument('--backend', choices=BACKENDS, default='auto', help='Input backend for reading the dump')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='Directory for the cached subclass files')
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH,
+                        help='Maximum subclass depth below the ancestors (default: %(default)s as in '
+                             'city-subclasses.sparql, 0 for the full closure)')
+    args = parser.parse_args()
+
+    derive_city_subclasses(args.dump, args.cache_dir, args.max_depth, args.backend)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Cache of the dump entities that matter for the extraction, as a small zstd-compressed sub-dump.
+
+With --write-subdump, the extraction workers also write the raw line of every candidate
+entity (P31 in the city subclasses or the province types) to a zstd shard, and the label
+pass can add the entities referenced by the cities. The shards are concatenated into
+data/subdump/subdump.json.zst, which has the same format as the dump, so later runs can use
+it with --dump and iterating on the extraction rules doesn't need a full scan.
+
+manifest.json records the source dump and the subclass set the sub-dump was built with. A
+sub-dump can only be used with a subclass set contained in that set.
+"""
+
+import datetime
+import glob
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configuration
+SCRIPT_DIR = pathlib.Path(__file__).parent
+SUBDUMP_DIR = str(SCRIPT_DIR / 'data/subdump')
+SUBDUMP_FILE = 'subdump.json.zst'
+MANIFEST_FILE = 'manifest.json'
+COMPRESSION_LEVEL = 3
+
+def is_candidate(record, candidate_types):
+    """Check if any instance of (P31) value of a record is a candidate type."""
+    for p31 in record.get('claims', {}).get('P31', []):
+        value = p31.get('mainsnak', {}).get('datavalue', {}).get('value')
+        if isinstance(value, dict) and value.get('id') in candidate_types:
+            return True
+    return False
+
+class SubdumpWriter:
+    """Writes raw dump lines to a zstd-compressed shard of the sub-dump."""
+
+    def __init__(self, subdump_dir, shard_name):
+        if zstandard is None:
+            raise RuntimeError("Writing a sub-dump requires the zstandard package (pip install zstandard)")
+        os.makedirs(os.path.join(subdump_dir, 'shards'), exist_ok=True)
+        self.path = os.path.join(subdump_dir, 'shards', f"{shard_name}.json.zst")
+        self._file = open(self.path, 'wb')
+        self._writer = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).stream_writer(self._file)
+        self.count = 0
+
+    def write(self, line):
+        self._writer.write(line.rstrip(b',\n') + b',\n')
+        self.count += 1
+
+    def close(self):
+        self._writer.close()
+
+def remove_shards(subdump_dir, prefix):
+    for path in glob.glob(os.path.join(subdump_dir, 'shards', f"{prefix}*.json.zst")):
+        os.remove(path)
+
+def assemble_subdump(subdump_dir):
+    """Concatenate the shards into the sub-dump file (zstd frames can be concatenated)."""
+    subdump_path = os.path.join(subdump_dir, SUBDUMP_FILE)
+    compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+    with open(subdump_path + '.tmp', 'wb') as f:
+        f.write(compressor.compress(b'[\n'))
+        for shard in sorted(glob.glob(os.path.join(subdump_dir, 'shards', '*.json.zst'))):
+            with open(shard, 'rb') as shard_file:
+                shutil.copyfileobj(shard_file, f, 16 * 1024 * 1024)
+        f.write(compressor.compress(b']\n'))
+    os.replace(subdump_path + '.tmp', subdump_path)
+    return subdump_path
+
+def get_subclass_fingerprint(city_subclasses):
+    return hashlib.sha256(','.join(sorted(city_subclasses)).encode('utf-8')).hexdigest()
+
+def read_manifest(subdump_dir):
+    manifest_path = os.path.join(subdump_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_manifest(subdump_dir, manifest):
+    with open(os.path.join(subdump_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+def finish_candidates(subdump_dir, wikidata_dump_path, city_subclasses, province_types, candidate_count):
+    """Assemble the sub-dump after an extraction run and record its manifest."""
+    stat = os.stat(wikidata_dump_path)
+    write_manifest(subdump_dir, {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'source': {
+            'path': os.path.abspath(wikidata_dump_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns
+        },
+        'subclasses': {
+            'count': len(city_subclasses),
+            'sha256': get_subclass_fingerprint(city_subclasses),
+            'ids': sorted(city_subclasses)
+        },
+        'province_types': sorted(province_types),
+        'entities': {'candidates': candidate_count, 'references': 0}
+    })
+    return assemble_subdump(subdump_dir)
+
+def finish_references(subdump_dir, reference_count):
+    """Re-assemble the sub-dump after the label pass added the referenced entities."""
+    manifest = read_manifest(subdump_dir)
+    manifest['entities']['references'] = reference_count
+    write_manifest(subdump_dir, manifest)
+    return assemble_subdump(subdump_dir)
+
+def get_manifest_candidate_types(manifest):
+    return set(manifest['subclasses']['ids']) | set(manifest['province_types'])
+
+def get_subdump_manifest(wikidata_dump_path):
+    """Return the manifest if the dump path is a sub-dump, otherwise None."""
+    if os.path.basename(wikidata_dump_path) != SUBDUMP_FILE:
+        return None
+    return read_manifest(os.path.dirname(os.path.abspath(wikidata_dump_path)))
+
+def check_subdump(wikidata_dump_path, city_subclasses):
+    """Raise ValueError if the dump is a sub-dump built with a subclass set that lacks some of city_subclasses."""
+    manifest = get_subdump_manifest(wikidata_dump_path)
+    if manifest is None:
+        return
+    missing = set(city_subclasses) - set(manifest['subclasses']['ids'])
+    if missing:
+        raise ValueError(
+            f"The sub-dump was built with a different subclass set; {len(missing)} subclasses "
+            f"(e.g. {', '.join(sorted(missing)[:5])}) are missing. Rebuild it from the full dump "
+            f"({manifest['source']['path']})"
+        )
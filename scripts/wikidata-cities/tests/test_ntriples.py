@@ -0,0 +1,71 @@
+"""
+Check that the truthy N-Triples reader yields the same cities as the JSON dump.
+
+tests/fixtures/sample.json and sample.nt hold the same two entities (Munich and Upper Bavaria)
+in both dump formats. Run from scripts/wikidata-cities with: python -m unittest discover tests
+"""
+
+import os
+import sys
+import pathlib
+import tempfile
+import unittest
+
+# Add the parent directory to sys.path to allow imports
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+from parser import RESULT_HEADER, load_city_subclasses
+from extractor import parse_json_lines, process_record
+from ntriples import iter_entities
+from city_buffer import CityBuffer
+from merge import iter_rows
+
+FIXTURES_DIR = pathlib.Path(__file__).parent / 'fixtures'
+CITY_SUBCLASSES_PATH = pathlib.Path(__file__).parent.parent / 'city-subclasses.json'
+
+# The truthy dump has no qualifiers, so these fields are always empty
+UNDATED_FIELDS = ['populationDate', 'countryDate']
+
+def extract(records, city_subclasses):
+    """Run process_record on the records and return the result rows as dicts."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        cities = CityBuffer(os.path.join(output_dir, 'cities_partial.json'))
+        for record in records:
+            process_record(record, city_subclasses, cities, 0)
+        final_file = os.path.join(output_dir, 'cities_final.json')
+        cities.finish(final_file)
+        return [dict(zip(RESULT_HEADER, row)) for row in iter_rows(final_file)]
+
+def read_lines(name):
+    with open(FIXTURES_DIR / name, 'rb') as f:
+        return f.read().split(b'\n')
+
+class NTriplesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        city_subclasses = load_city_subclasses(CITY_SUBCLASSES_PATH)
+        cls.json_rows = extract(parse_json_lines(read_lines('sample.json')), city_subclasses)
+        cls.ntriples_rows = extract(iter_entities(read_lines('sample.nt')), city_subclasses)
+
+    def test_same_cities(self):
+        self.assertEqual([row['cityWikidataId'] for row in self.json_rows], ['Q1726'])
+        self.assertEqual([row['cityWikidataId'] for row in self.ntriples_rows], ['Q1726'])
+
+    def test_same_fields(self):
+        json_row, ntriples_row = self.json_rows[0], self.ntriples_rows[0]
+        for field in RESULT_HEADER:
+            if field in UNDATED_FIELDS or field == 'populationHistory':
+                continue
+            self.assertEqual(ntriples_row[field], json_row[field], field)
+
+    def test_dates_are_empty(self):
+        json_row, ntriples_row = self.json_rows[0], self.ntriples_rows[0]
+        for field in UNDATED_FIELDS:
+            self.assertIsNotNone(json_row[field], field)
+            self.assertIsNone(ntriples_row[field], field)
+        # The population history keeps the values, without their dates
+        self.assertEqual([value for date, value in ntriples_row['populationHistory']],
+                         [value for date, value in json_row['populationHistory']])
+        self.assertTrue(all(date == 0 for date, value in ntriples_row['populationHistory']))
+
+if __name__ == '__main__':
+    unittest.main()